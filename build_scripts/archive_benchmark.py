@@ -0,0 +1,188 @@
+"""
+Compares archive formats for the release tree: compressed size against the
+time it takes 7-Zip to extract it on this machine, so the formats published in
+pythonCWMS_config.json are chosen on data.
+
+Measure the archives a release ships (the workflow does this and records each
+format's extraction time in the config's archive_variants):
+
+    python build_scripts/archive_benchmark.py --archive 7z=pythonCWMS0.9.7z --archive zip=pythonCWMS0.9.zip --archive tar.xz=pythonCWMS0.9.tar.xz --output archive_benchmark.json
+
+Or build candidate formats from an extracted tree and measure them too:
+
+    python build_scripts/archive_benchmark.py --tree pythonCWMS --candidates 7z:9,7z:5,zip:5,zip:1,tar.xz:9
+
+Every extraction goes to an empty folder on the same disk and uses
+multithreading where the format allows it (-mmt=on). Besides the raw numbers,
+the report estimates the installer's download-and-extract time at a few link
+speeds, the same way the installer picks a variant.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+FORMATS = ("7z", "zip", "tar.xz")
+DEFAULT_SEVEN_ZIP = r"C:\Program Files\7-Zip\7z.exe"
+LINK_SPEEDS_MBPS = (10, 50, 100, 500)
+
+
+def run(command, **kwargs):
+    process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, **kwargs)
+    if process.returncode != 0:
+        raise RuntimeError("{} failed ({}): {}".format(os.path.basename(command[0]), process.returncode,
+                                                       process.stderr.decode("utf-8", "replace").strip()))
+
+
+def tree_size(path):
+    total_bytes = total_files = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            total_bytes += os.path.getsize(os.path.join(dirpath, filename))
+            total_files += 1
+    return total_bytes, total_files
+
+
+def compress(seven_zip, tree, fmt, level, output):
+    """Packs tree into output; returns the wall time in seconds."""
+    started = time.perf_counter()
+    if fmt == "tar.xz":
+        tar_path = output[:-len(".xz")]
+        run([seven_zip, "a", "-ttar", tar_path, tree])
+        run([seven_zip, "a", "-txz", "-mx={}".format(level), "-mmt=on", output, tar_path])
+        os.remove(tar_path)
+    else:
+        run([seven_zip, "a", "-t{}".format(fmt), "-mx={}".format(level), "-mmt=on", output, tree])
+    return time.perf_counter() - started
+
+
+def extract(seven_zip, archive, fmt, destination):
+    """Extracts archive the way the installer does; returns the wall time in seconds."""
+    started = time.perf_counter()
+    if fmt == "tar.xz":
+        # Same pipe as the installer's streaming extractor: xz decoder into the tar unpacker.
+        decoder = subprocess.Popen([seven_zip, "x", "-txz", "-so", archive], stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+        try:
+            run([seven_zip, "x", "-ttar", "-si", "-o{}".format(destination), "-y"], stdin=decoder.stdout)
+        finally:
+            decoder.stdout.close()
+            decoder.wait()
+    else:
+        run([seven_zip, "x", archive, "-o{}".format(destination), "-y", "-mmt=on"])
+    return time.perf_counter() - started
+
+
+def measure(seven_zip, archive, fmt, runs, work_dir):
+    times = []
+    for _ in range(runs):
+        destination = tempfile.mkdtemp(prefix="extract-", dir=work_dir)
+        try:
+            times.append(extract(seven_zip, archive, fmt, destination))
+        finally:
+            shutil.rmtree(destination, ignore_errors=True)
+    return times
+
+
+def estimated_install_seconds(size_bytes, extract_seconds, mbps, pipelined=False):
+    """Download plus extraction time; a pipelined (streaming) install overlaps the two."""
+    download_seconds = size_bytes / (mbps * 1000.0 * 1000.0 / 8.0)
+    if pipelined:
+        return max(download_seconds, extract_seconds)
+    return download_seconds + extract_seconds
+
+
+def parse_candidates(text):
+    candidates = []
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        fmt, _, level = item.strip().partition(":")
+        if fmt not in FORMATS:
+            raise SystemExit("Unknown format {!r} (expected one of {})".format(fmt, ", ".join(FORMATS)))
+        candidates.append((fmt, int(level or 5)))
+    return candidates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compression ratio against extraction time for the release tree.")
+    parser.add_argument("--seven-zip", default=DEFAULT_SEVEN_ZIP if os.path.exists(DEFAULT_SEVEN_ZIP) else "7z")
+    parser.add_argument("--archive", action="append", default=[], metavar="FORMAT=PATH",
+                        help="existing archive to measure (repeatable)")
+    parser.add_argument("--tree", help="extracted release tree, to build --candidates from")
+    parser.add_argument("--candidates", help="comma separated FORMAT:LEVEL pairs to build from --tree")
+    parser.add_argument("--runs", type=int, default=3, help="extractions per archive")
+    parser.add_argument("--work-dir", help="where archives are built and extracted (default: system temp)")
+    parser.add_argument("--output", default="archive_benchmark.json")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="archive-benchmark-", dir=args.work_dir)
+    entries = []
+    try:
+        for item in args.archive:
+            fmt, _, path = item.partition("=")
+            if fmt not in FORMATS or not os.path.isfile(path):
+                raise SystemExit("--archive expects FORMAT=PATH with FORMAT in {}: {}".format(", ".join(FORMATS), item))
+            entries.append({"format": fmt, "level": None, "archive": os.path.basename(path), "path": path})
+        candidates = parse_candidates(args.candidates)
+        if candidates and not args.tree:
+            raise SystemExit("--candidates needs --tree")
+        for fmt, level in candidates:
+            path = os.path.join(work_dir, "candidate_{}.{}".format(level, fmt))
+            print("Building {} (level {})...".format(fmt, level))
+            entry = {"format": fmt, "level": level, "archive": None, "path": path}
+            entry["compress_seconds"] = compress(args.seven_zip, os.path.abspath(args.tree), fmt, level, path)
+            entries.append(entry)
+        if not entries:
+            raise SystemExit("Nothing to measure: give --archive or --tree with --candidates")
+
+        tree_bytes, tree_files = tree_size(args.tree) if args.tree else (None, None)
+        for entry in entries:
+            print("Extracting {} {} times...".format(entry["archive"] or entry["path"], args.runs))
+            entry["size_bytes"] = os.path.getsize(entry["path"])
+            entry["extract_runs"] = measure(args.seven_zip, entry["path"], entry["format"], args.runs, work_dir)
+            entry["extract_seconds"] = statistics.median(entry["extract_runs"])
+            if tree_bytes:
+                entry["ratio"] = entry["size_bytes"] / float(tree_bytes)
+            entry["estimated_install_seconds"] = dict(
+                (str(mbps), estimated_install_seconds(entry["size_bytes"], entry["extract_seconds"], mbps,
+                                                      pipelined=entry["format"] == "tar.xz"))
+                for mbps in LINK_SPEEDS_MBPS)
+            del entry["path"]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("{:<8} {:>5} {:>10} {:>7} {:>11} {:>11}  {}".format(
+        "Format", "Level", "Size MB", "Ratio", "Compress s", "Extract s",
+        "  ".join("{:>7}".format("@{}Mb".format(mbps)) for mbps in LINK_SPEEDS_MBPS)))
+    for entry in entries:
+        print("{:<8} {:>5} {:>10.1f} {:>7} {:>11} {:>11.1f}  {}".format(
+            entry["format"], entry["level"] if entry["level"] is not None else "-", entry["size_bytes"] / (1024.0 * 1024.0),
+            "{:.3f}".format(entry["ratio"]) if "ratio" in entry else "-",
+            "{:.1f}".format(entry["compress_seconds"]) if "compress_seconds" in entry else "-",
+            entry["extract_seconds"],
+            "  ".join("{:>6.0f}s".format(entry["estimated_install_seconds"][str(mbps)]) for mbps in LINK_SPEEDS_MBPS)))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "seven_zip": args.seven_zip,
+        "cpu_count": os.cpu_count(),
+        "runs": args.runs,
+        "tree_bytes": tree_bytes,
+        "tree_files": tree_files,
+        "link_speeds_mbps": list(LINK_SPEEDS_MBPS),
+        "results": entries,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Wrote {}".format(args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Measures the pythoncwms bulk client against a mock CWMS Data API served on
+localhost, next to the sequential loop most scripts use today (one request
+after another, each on a new connection).
+
+    pythonCWMS\\python\\python.exe build_scripts/cda_benchmark.py --series 500 --latency-ms 40 --connect-ms 60 --error-rate 0.02 --output cda_benchmark.json
+
+The mock answers GET and POST /cwms-data/timeseries like CDA does (JSON
+version 2, paged with next-page), with a delay per request (--latency-ms)
+and per new connection (--connect-ms, standing in for the TCP and TLS
+handshakes a real server needs), 503s at --error-rate and 429s above
+--server-limit requests in flight. The values are generated from the
+timeseries name, so every fetched series is checked against what the
+server sent.
+
+Each --per-host setting fetches all series --runs times and stores them
+once; the median is reported with the speedup over the sequential loop
+(run once over --baseline-series of them and scaled up). Then the series
+are fetched through an empty timeseries cache (cold), again (warm: served
+from disk) and with the window extended by --extend-days (only the new
+days are requested). The exit code is 1 if a fetched series is wrong or the
+best speedup is below --min-speedup.
+"""
+import argparse
+import datetime
+import http.server
+import json
+import os
+import platform
+import random
+import shutil
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Use the pythoncwms installed in the interpreter being measured; fall back to the repo's copy.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pythoncwms  # noqa: E402
+
+API_PATH = "/cwms-data/timeseries"
+OFFICE = "MOCK"
+
+
+def parse_time(text):
+    return datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+
+
+def series_values(name, begin, end, interval_minutes):
+    """The (epoch ms, value, quality) rows the mock serves for name between begin and end."""
+    step = interval_minutes * 60 * 1000
+    first = -(-int(begin.timestamp() * 1000) // step) * step
+    last = int(end.timestamp() * 1000)
+    seed = sum(ord(c) for c in name)
+    return [[ms, ((seed + ms // step) % 1000) / 10.0, 0] for ms in range(first, last + 1, step)]
+
+
+class MockCdaHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        # Called once per connection: what a pooled client saves on every request after the first.
+        time.sleep(self.server.connect_seconds)
+        self.server.count("connections")
+        http.server.BaseHTTPRequestHandler.setup(self)
+
+    def _reply(self, status, body=b"", content_type="application/json;version=2", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _admit(self):
+        """Applies latency, the server's own limit and random failures; returns False if the request was refused."""
+        server = self.server
+        server.count("requests")
+        with server.lock:
+            server.in_flight += 1
+            busy = server.in_flight > server.limit
+            failed = server.random.random() < server.error_rate
+        try:
+            time.sleep(server.latency_seconds)
+            if busy:
+                server.count("throttled")
+                self._reply(429, b"Too many requests", "text/plain")
+                return False
+            if failed:
+                server.count("failed")
+                self._reply(503, b"Try again", "text/plain", {"Retry-After": "0"})
+                return False
+            return True
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != API_PATH:
+            self._reply(404, b"Not found", "text/plain")
+            return
+        if not self._admit():
+            return
+        query = dict(urllib.parse.parse_qsl(url.query))
+        rows = series_values(query["name"], parse_time(query["begin"]), parse_time(query["end"]),
+                             self.server.interval_minutes)
+        page_size = min(int(query.get("page-size", 500)), self.server.max_page_size)
+        offset = int(query.get("page") or 0)
+        page = rows[offset:offset + page_size]
+        next_offset = offset + len(page)
+        document = {"name": query["name"], "office-id": query["office"], "units": "cfs", "begin": query["begin"],
+                    "end": query["end"], "page": str(offset), "page-size": page_size, "total": len(rows),
+                    "next-page": str(next_offset) if next_offset < len(rows) else None,
+                    "value-columns": [{"name": "date-time", "ordinal": 1, "datatype": "java.sql.Timestamp"},
+                                      {"name": "value", "ordinal": 2, "datatype": "java.lang.Double"},
+                                      {"name": "quality-code", "ordinal": 3, "datatype": "int"}],
+                    "values": page}
+        self._reply(200, json.dumps(document).encode("utf-8"))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urllib.parse.urlsplit(self.path).path != API_PATH:
+            self._reply(404, b"Not found", "text/plain")
+            return
+        if not self._admit():
+            return
+        if not self.headers.get("Authorization"):
+            self._reply(401, b"No API key", "text/plain")
+            return
+        self.server.count("stored_values", len(json.loads(body)["values"]))
+        self._reply(200)
+
+
+class MockCdaServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, args):
+        http.server.HTTPServer.__init__(self, ("127.0.0.1", 0), MockCdaHandler)
+        self.latency_seconds = args.latency_ms / 1000.0
+        self.connect_seconds = args.connect_ms / 1000.0
+        self.error_rate = args.error_rate
+        self.limit = args.server_limit
+        self.max_page_size = args.max_page_size
+        self.interval_minutes = args.interval_minutes
+        self.random = random.Random(1)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = {}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def take_counters(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+        return counters
+
+    @property
+    def root(self):
+        return "http://127.0.0.1:{}/cwms-data/".format(self.server_address[1])
+
+
+def sequential_fetch(root, names, begin, end, page_size, attempts=5):
+    """What scripts do today: one series after another, one connection per request, retrying on 429/503."""
+    values = 0
+    for name in names:
+        cursor = None
+        while True:
+            query = {"name": name, "office": OFFICE, "begin": begin, "end": end, "page-size": page_size}
+            if cursor:
+                query["page"] = cursor
+            request = urllib.request.Request(root + "timeseries?" + urllib.parse.urlencode(query),
+                                             headers={"Accept": "application/json;version=2", "Connection": "close"})
+            for attempt in range(attempts):
+                try:
+                    with urllib.request.urlopen(request, timeout=60) as response:
+                        page = json.loads(response.read())
+                    break
+                except urllib.error.HTTPError as e:
+                    if e.code not in (429, 503) or attempt + 1 == attempts:
+                        raise
+                    time.sleep(0.5 * 2 ** attempt)
+            values += len(page["values"])
+            cursor = page.get("next-page")
+            if not cursor:
+                break
+    return values
+
+
+def check(result, names, begin, end, interval_minutes):
+    """Names of the series that are missing or differ from what the mock served."""
+    wrong = [name for name in names if name in result.errors or name not in result]
+    for name, frame in result.items():
+        expected = series_values(name, parse_time(begin), parse_time(end), interval_minutes)
+        if len(frame) != len(expected) or abs(frame["value"].sum() - sum(row[1] for row in expected)) > 1e-6:
+            wrong.append(name)
+    return wrong
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk CDA retrieval against a mock CDA server.")
+    parser.add_argument("--series", type=int, default=500, help="timeseries to fetch")
+    parser.add_argument("--days", type=float, default=30, help="length of each series")
+    parser.add_argument("--interval-minutes", type=int, default=15, help="time step of each series")
+    parser.add_argument("--max-page-size", type=int, default=1000, help="largest page the mock returns (forces paging)")
+    parser.add_argument("--latency-ms", type=float, default=40, help="server time per request")
+    parser.add_argument("--connect-ms", type=float, default=60, help="server time per new connection")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="share of requests answered with 503")
+    parser.add_argument("--server-limit", type=int, default=32, help="requests in flight before the mock answers 429")
+    parser.add_argument("--per-host", default="4,8,16", help="comma separated per-host limits to measure")
+    parser.add_argument("--runs", type=int, default=3, help="fetches per setting")
+    parser.add_argument("--baseline-series", type=int, default=50, help="series fetched sequentially for the baseline (0 = skip)")
+    parser.add_argument("--extend-days", type=float, default=1, help="days added to the window for the incremental cache fetch")
+    parser.add_argument("--min-speedup", type=float, help="fail if the best setting is not this much faster than the baseline")
+    parser.add_argument("--output", default="cda_benchmark.json")
+    args = parser.parse_args(argv)
+
+    server = MockCdaServer(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    end = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    begin_text = (end - datetime.timedelta(days=args.days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    end_text = end.strftime("%Y-%m-%dT%H:%M:%SZ")
+    names = ["Loc{:05d}.Flow.Inst.15Minutes.0.Mock".format(i) for i in range(args.series)]
+    values_per_series = len(series_values(names[0], parse_time(begin_text), end, args.interval_minutes))
+    print("Mock CDA at {}: {} series of {} values, pages of {}, {} ms per request, {} ms per connection, {:.0%} errors".format(
+        server.root, args.series, values_per_series, args.max_page_size, args.latency_ms, args.connect_ms, args.error_rate))
+
+    report = {"python": platform.python_version(), "settings": vars(args), "values_per_series": values_per_series}
+    failures = []
+    try:
+        if args.baseline_series > 0:
+            subset = names[:args.baseline_series]
+            started = time.perf_counter()
+            sequential_fetch(server.root, subset, begin_text, end_text, args.max_page_size)
+            seconds = time.perf_counter() - started
+            report["baseline"] = {"series": len(subset), "seconds": seconds,
+                                  "estimated_seconds": seconds * args.series / len(subset),
+                                  "series_per_second": len(subset) / seconds, "server": server.take_counters()}
+            print("Sequential: {} series in {:.2f}s ({:.1f} series/s)".format(len(subset), seconds, len(subset) / seconds))
+
+        report["bulk"] = []
+        for per_host in [int(value) for value in args.per_host.split(",") if value.strip()]:
+            runs = []
+            for _ in range(args.runs):
+                result = pythoncwms.fetch_timeseries(names, OFFICE, begin_text, end_text, root=server.root,
+                                                     page_size=args.max_page_size, per_host=per_host)
+                wrong = check(result, names, begin_text, end_text, args.interval_minutes)
+                if wrong:
+                    failures.append("per_host {}: {} series wrong or missing, e.g. {}".format(per_host, len(wrong), wrong[0]))
+                runs.append(dict(result.stats, server=server.take_counters()))
+            store = pythoncwms.store_timeseries(result, OFFICE, root=server.root, api_key="benchmark", per_host=per_host)
+            store_counters = server.take_counters()
+            if len(store) != len(names) or store_counters.get("stored_values") != values_per_series * len(names):
+                failures.append("per_host {}: stored {} of {} series".format(per_host, len(store), len(names)))
+            seconds = statistics.median(run["seconds"] for run in runs)
+            entry = {"per_host": per_host, "seconds": seconds, "series_per_second": args.series / seconds,
+                     "values_per_second": args.series * values_per_series / seconds, "runs": runs,
+                     "store_seconds": store.stats["seconds"], "store_stats": dict(store.stats, server=store_counters)}
+            if "baseline" in report:
+                entry["speedup"] = report["baseline"]["estimated_seconds"] / seconds
+            report["bulk"].append(entry)
+
+        cache_dir = tempfile.mkdtemp(prefix="cda-benchmark-cache-")
+        try:
+            cache = pythoncwms.TimeseriesCache(cache_dir)
+            per_host = max(entry["per_host"] for entry in report["bulk"]) if report["bulk"] else 8
+            extended_end = (end + datetime.timedelta(days=args.extend_days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            report["cache"] = []
+            for phase, phase_end in (("cold", end_text), ("warm", end_text), ("incremental", extended_end)):
+                result = pythoncwms.fetch_timeseries(names, OFFICE, begin_text, phase_end, root=server.root,
+                                                     page_size=args.max_page_size, per_host=per_host, cache=cache)
+                wrong = check(result, names, begin_text, phase_end, args.interval_minutes)
+                if wrong:
+                    failures.append("cache {}: {} series wrong or missing, e.g. {}".format(phase, len(wrong), wrong[0]))
+                report["cache"].append(dict(result.stats, phase=phase, server=server.take_counters(),
+                                            cache_bytes=cache.stats()["bytes"]))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print("\n{:>8} {:>9} {:>10} {:>12} {:>9} {:>8} {:>8} {:>9}".format(
+        "per_host", "fetch s", "series/s", "values/s", "requests", "retries", "speedup", "store s"))
+    for entry in report["bulk"]:
+        last = entry["runs"][-1]
+        print("{:>8} {:>9.2f} {:>10.1f} {:>12,.0f} {:>9} {:>8} {:>8} {:>9.2f}".format(
+            entry["per_host"], entry["seconds"], entry["series_per_second"], entry["values_per_second"],
+            last["requests"], last["retries"], "{:.1f}x".format(entry["speedup"]) if "speedup" in entry else "-",
+            entry["store_seconds"]))
+    if report.get("cache"):
+        print("\n{:>12} {:>9} {:>9} {:>11} {:>11} {:>9}".format("cache", "fetch s", "requests", "cache hits", "gaps", "MB"))
+        for entry in report["cache"]:
+            print("{:>12} {:>9.2f} {:>9} {:>11} {:>11} {:>9.1f}".format(
+                entry["phase"], entry["seconds"], entry["requests"], entry["cache_hits"], entry["cache_gaps"],
+                entry["cache_bytes"] / 1048576.0))
+    speedups = [entry["speedup"] for entry in report["bulk"] if "speedup" in entry]
+    if args.min_speedup and speedups and max(speedups) < args.min_speedup:
+        failures.append("best speedup {:.1f}x is below --min-speedup {}".format(max(speedups), args.min_speedup))
+    report["failures"] = failures
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for failure in failures:
+        print("FAILED: " + failure)
+    print("Wrote {}".format(args.output))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Measures interpreter start-up and the import time of every top-level package
+in requirements_binary_only.txt, each in a fresh interpreter, and compares the
+results with the previous release.
+
+Run it with the interpreter being shipped:
+
+    pythonCWMS\\python\\python.exe build_scripts/import_benchmark.py --requirements requirements_binary_only.txt --previous import_benchmark.json --output import_benchmark.json
+
+For every package the first run uses only the bytecode shipped in the tree
+(what a user sees on the first import after installing; see precompile.py),
+the second starts with an empty bytecode cache (cold: includes compiling the
+package's modules) and the following --runs runs reuse that cache (warm).
+Bytecode goes to a temporary PYTHONPYCACHEPREFIX, or is not written at all,
+so the benchmarked tree is left untouched. Each run uses -X importtime, which gives
+the package's cumulative import time and its slowest modules, and reports the
+process's peak resident memory.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import metadata
+
+# Runs in the child interpreter: import the module, then report peak memory. __import__
+# goes through the import machinery that -X importtime instruments (importlib.import_module
+# does not), and nothing else is imported first so the module is charged for all of its imports.
+CHILD_CODE = r"""
+import sys
+__import__(sys.argv[1])
+import json
+peak = None
+try:
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        peak = counters.PeakWorkingSetSize
+except (ImportError, AttributeError, OSError):
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+print(json.dumps({"peak_rss_bytes": peak}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def normalize(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def read_requirements(path):
+    """Returns the distribution names listed in a requirements file (options and duplicates skipped)."""
+    names = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line or line.startswith("-"):
+                continue
+            if "://" in line:
+                # git+https://host/org/repo.git@ref -> repo
+                line = line.split("#egg=")[-1] if "#egg=" in line else line.rstrip("/").split("/")[-1]
+                line = line.split("@")[0]
+                if line.endswith(".git"):
+                    line = line[:-len(".git")]
+            name = re.split(r"[\s\[<>=!~;]", line, 1)[0]
+            if name and normalize(name) not in [normalize(n) for n in names]:
+                names.append(name)
+    return names
+
+
+def import_names(distributions):
+    """Maps each distribution to the top-level module(s) it installs, using the installed metadata."""
+    by_distribution = {}
+    for module, owners in metadata.packages_distributions().items():
+        if module.startswith("_") or module in ("tests", "test", "docs", "examples"):
+            continue
+        for owner in owners:
+            by_distribution.setdefault(normalize(owner), set()).add(module)
+    result = {}
+    for name in distributions:
+        modules = by_distribution.get(normalize(name))
+        if not modules:
+            modules = {name.replace("-", "_").lower()}  # Not installed as a distribution (e.g. stdlib).
+        preferred = [m for m in modules if normalize(m) == normalize(name)]
+        result[name] = sorted(preferred or modules)
+    return result
+
+
+def run_import(python, module, pycache_prefix):
+    """
+    Imports module in a fresh interpreter; returns wall time, import time, peak
+    RSS and slowest modules. Without pycache_prefix only the tree's own
+    __pycache__ is read and nothing is written.
+    """
+    env = dict(os.environ)
+    if pycache_prefix:
+        env["PYTHONPYCACHEPREFIX"] = pycache_prefix
+    else:
+        env.pop("PYTHONPYCACHEPREFIX", None)
+        env["PYTHONDONTWRITEBYTECODE"] = "1"
+    command = [python, "-X", "importtime", "-c", CHILD_CODE, module] if module else [python, "-c", "pass"]
+    started = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True, env=env)
+    wall_ms = (time.perf_counter() - started) * 1000.0
+    result = {"wall_ms": wall_ms}
+    if process.returncode != 0:
+        result["error"] = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "exit code {}".format(process.returncode)
+        return result
+    if not module:
+        return result
+    result.update(json.loads(process.stdout.strip().splitlines()[-1]))
+    modules = []
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((int(self_us), name))
+            if name == module and len(indent) <= 1:
+                result["import_ms"] = int(cumulative_us) / 1000.0
+    result["slowest_modules"] = [{"module": name, "self_ms": us / 1000.0} for us, name in sorted(modules, reverse=True)[:5]]
+    return result
+
+
+def benchmark_module(python, module, runs):
+    first_run = run_import(python, module, None)
+    if "error" in first_run:
+        return {"error": first_run["error"]}
+    pycache_prefix = tempfile.mkdtemp(prefix="pycache-")
+    try:
+        cold = run_import(python, module, pycache_prefix)
+        if "error" in cold:
+            return {"error": cold["error"]}
+        warm = [run_import(python, module, pycache_prefix) for _ in range(runs)]
+    finally:
+        shutil.rmtree(pycache_prefix, ignore_errors=True)
+    if module is None:
+        return {"first_run_wall_ms": first_run["wall_ms"], "cold_wall_ms": cold["wall_ms"],
+                "warm_wall_ms": statistics.median(r["wall_ms"] for r in warm)}
+    return {
+        "first_run_wall_ms": first_run["wall_ms"],
+        "first_run_import_ms": first_run.get("import_ms"),
+        "cold_wall_ms": cold["wall_ms"],
+        "cold_import_ms": cold.get("import_ms"),
+        "warm_wall_ms": statistics.median(r["wall_ms"] for r in warm),
+        "warm_import_ms": statistics.median(r.get("import_ms") or 0.0 for r in warm),
+        "peak_rss_mb": round(max(r.get("peak_rss_bytes") or 0 for r in warm) / (1024.0 * 1024.0), 1),
+        "slowest_modules": cold.get("slowest_modules", []),
+    }
+
+
+def find_regressions(current, previous, threshold, min_ms):
+    """Returns (package, metric, before, after) for timings that grew by more than threshold and min_ms."""
+    regressions = []
+    previous_packages = previous.get("packages", {})
+    for name, entry in current["packages"].items():
+        before = previous_packages.get(name)
+        if not before or "error" in entry or "error" in before:
+            continue
+        for metric in ("warm_import_ms", "first_run_import_ms", "cold_import_ms", "peak_rss_mb"):
+            old, new = before.get(metric), entry.get(metric)
+            if not old or new is None:
+                continue
+            floor = min_ms if metric.endswith("_ms") else 5.0
+            if new > old * (1.0 + threshold) and new - old > floor:
+                regressions.append((name, metric, old, new))
+    startup_before = previous.get("interpreter", {}).get("warm_wall_ms")
+    startup_after = current["interpreter"].get("warm_wall_ms")
+    if startup_before and startup_after and startup_after > startup_before * (1.0 + threshold) and \
+       startup_after - startup_before > min_ms:
+        regressions.append(("(interpreter)", "warm_wall_ms", startup_before, startup_after))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the bundled pythonCWMS interpreter.")
+    parser.add_argument("--requirements", default="requirements_binary_only.txt")
+    parser.add_argument("--output", default="import_benchmark.json")
+    parser.add_argument("--previous", help="results of the previous release to compare against")
+    parser.add_argument("--version", help="release version recorded in the results")
+    parser.add_argument("--runs", type=int, default=5, help="warm runs per package")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative slow-down reported as a regression")
+    parser.add_argument("--min-ms", type=float, default=50.0, help="ignore slow-downs smaller than this")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    previous = None
+    if args.previous and os.path.exists(args.previous):
+        with open(args.previous) as f:
+            previous = json.load(f)
+
+    results = {
+        "version": args.version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "interpreter": benchmark_module(sys.executable, None, args.runs),
+        "packages": {},
+    }
+    print("Interpreter start-up: first run {first_run_wall_ms:.0f} ms, cold {cold_wall_ms:.0f} ms, "
+          "warm {warm_wall_ms:.0f} ms".format(**results["interpreter"]))
+
+    print("{:<28} {:>10} {:>10} {:>10} {:>10} {:>9}".format(
+        "Package", "first ms", "cold ms", "warm ms", "wall ms", "peak MB"))
+    for distribution, modules in import_names(read_requirements(args.requirements)).items():
+        for module in modules:
+            name = distribution if len(modules) == 1 else "{}:{}".format(distribution, module)
+            entry = benchmark_module(sys.executable, module, args.runs)
+            entry["module"] = module
+            results["packages"][name] = entry
+            if "error" in entry:
+                print("{:<28} import failed: {}".format(name, entry["error"]))
+            else:
+                print("{:<28} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.0f} {:>9.1f}".format(
+                    name, entry["first_run_import_ms"] or 0, entry["cold_import_ms"] or 0, entry["warm_import_ms"],
+                    entry["warm_wall_ms"], entry["peak_rss_mb"]))
+
+    measured = [e for e in results["packages"].values() if e.get("first_run_import_ms") and e.get("cold_import_ms")]
+    if measured:
+        # How much of the compile cost the shipped bytecode saves on the first import after installing.
+        first_run = sum(e["first_run_import_ms"] for e in measured)
+        cold = sum(e["cold_import_ms"] for e in measured)
+        print("First-run imports: {:.0f} ms with the shipped bytecode, {:.0f} ms when compiling ({:.1f}x)".format(
+            first_run, cold, cold / first_run))
+
+    regressions = find_regressions(results, previous, args.threshold, args.min_ms) if previous else []
+    results["compared_to"] = previous.get("version") if previous else None
+    results["regressions"] = [{"package": p, "metric": m, "before": b, "after": a} for p, m, b, a in regressions]
+    for package, metric, before, after in regressions:
+        # Rendered as an annotation on the GitHub Actions run.
+        print("::warning::Import regression in {}: {} {:.1f} -> {:.1f} (previous release {})".format(
+            package, metric, before, after, results["compared_to"]))
+    if previous and not regressions:
+        print("No regressions against release {}.".format(results["compared_to"]))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print("Wrote {}".format(args.output))
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,692 @@
+"""
+Benchmarks whole installs by the installer's own InstallEngine
+(jython_scripts/install_python.py, the code behind the Install button) without
+Swing, GitHub or Windows, so download, extraction and update changes can be
+measured and regression-tested on any machine with Java.
+
+A synthetic release (--size-mb spread over --files files, with the file
+manifest the release workflow publishes) is built once and served from local
+HTTP servers: the origin, --mirrors mirrors with the same files (plus
+--dead-mirrors that never answer) and --peers LAN peers that serve archives by
+hash like python_scripts/pythoncwms_peer.py. The origin and mirrors can mimic
+a slow or flaky link:
+
+    --bandwidth-mbps       cap shared by all connections to a server, like a site WAN link
+    --connection-mbps      cap per connection, like a throttling proxy
+    --latency-ms           delay before every response
+    --drops N              cut the first N downloads short, on any server (--drop-after-mb)
+
+The release always has a .zip; with --seven-zip it also has a .7z and the
+tar.xz of the pipelined install (--formats picks which are published). Each
+run installs it from a config laid out like the one the release workflow
+writes, so the engine picks the archive variant, ranks mirrors and peers,
+fails over, uses the archive cache (--archive-cache; the first run fills it)
+and extracts while downloading exactly as it does for users. With --scenario
+upgrade every run starts from an installation of the previous release, which
+the engine updates in place, or from a delta pack with --delta. Environment
+variables are left alone: a benchmark should not change the machine it runs on.
+
+Each run is timed with the installer's InstallTelemetry, so the numbers
+compare directly with the install reports collected from users, and the
+installed files are checked against the release manifest afterwards.
+
+The installer runs in Jython inside CAVI, so run this with Jython 2.7 too:
+
+    java -Djava.awt.headless=true -jar jython-standalone-2.7.3.jar build_scripts/installer_benchmark.py --size-mb 200 --files 4000 --bandwidth-mbps 200 --connections 4 --mirrors 1 --min-download-mb-per-s 15 --min-extract-mb-per-s 40
+
+The median of --runs runs is compared with the --min-* and --max-* limits;
+the exit code is 1 if any of them is missed, so it can gate a change in CI.
+"""
+import argparse
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jython_scripts"))
+import install_python as engine
+import release_manifest
+
+TOP_DIR = "pythonCWMS"
+PYTHON_EXE_SUB_DIR = "pythonCWMS/python"
+ENV_VAR_NAME = "PYTHON_CWMS_BENCHMARK"
+# Same chunk size as the streaming archive of a real release
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+SEND_BLOCK_SIZE = 16 * 1024
+MODULE_TEXT = "import os\nimport sys\n\ndef main():\n    return sys.argv\n" * 64
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def module_path(root, index):
+    return os.path.join(root, TOP_DIR, "python", "Lib", "site-packages", "pkg{}".format(index % 97),
+                        "module{}.py".format(index))
+
+
+def write_file(path, size, compressibility):
+    """Writes size bytes, the given fraction repetitive text (so it compresses) and the rest random."""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    text_size = int(size * compressibility)
+    with open(path, "wb") as f:
+        f.write((MODULE_TEXT * (text_size // len(MODULE_TEXT) + 1))[:text_size] + os.urandom(size - text_size))
+    return size
+
+
+def build_tree(root, size_bytes, files, compressibility, seed=1):
+    """
+    Writes files files adding up to about size_bytes under root/pythonCWMS,
+    plus the python.exe the installer looks for. File sizes are skewed like a
+    Python tree (many small modules, a few large binaries). Returns the total
+    size.
+    """
+    rng = random.Random(seed)
+    weights = [rng.lognormvariate(0, 1.5) for _ in xrange(files)]
+    scale = size_bytes / sum(weights)
+    total = write_file(os.path.join(root, *(PYTHON_EXE_SUB_DIR.split("/") + ["python.exe"])), 64 * 1024, 0)
+    for index, weight in enumerate(weights):
+        total += write_file(module_path(root, index), max(1, int(weight * scale)), compressibility)
+    return total
+
+
+def change_tree(root, files, changed_percent, compressibility, seed=2):
+    """
+    Turns a copy of a release tree into the next release: changed_percent of
+    the modules get new content, and of those a tenth are removed and as
+    many new ones are added.
+    """
+    rng = random.Random(seed)
+    changed = rng.sample(xrange(files), min(files, int(round(files * changed_percent / 100.0))))
+    removed = changed[:len(changed) // 10]
+    for index in changed[len(removed):]:
+        path = module_path(root, index)
+        write_file(path, os.path.getsize(path), compressibility)
+    for offset, index in enumerate(removed):
+        size = os.path.getsize(module_path(root, index))
+        os.remove(module_path(root, index))
+        write_file(module_path(root, files + offset), size, compressibility)
+
+
+def file_sha256(path):
+    return engine.hash_file(path).hexdigest().upper()
+
+
+def chunk_sha256(path, chunk_size=STREAM_CHUNK_SIZE):
+    """Hashes of each chunk_size piece of path, as listed in the streaming_archive of a release config."""
+    hashes = []
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hashes.append(hashlib.sha256(chunk).hexdigest().upper())
+    return hashes
+
+
+def seven_zip(seven_zip_path, arguments, cwd):
+    process = subprocess.Popen([seven_zip_path] + arguments, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise engine.ExtractionError("7z {} failed ({}): {}".format(arguments[0], process.returncode, stderr.strip()))
+
+
+def pack(root, archive_format, path, seven_zip_path=None):
+    """Packs root/pythonCWMS into path the way the release workflow does."""
+    if archive_format == "zip":
+        archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        try:
+            for dirpath, _, filenames in os.walk(os.path.join(root, TOP_DIR)):
+                for filename in filenames:
+                    file_path = os.path.join(dirpath, filename)
+                    archive.write(file_path, os.path.relpath(file_path, root).replace(os.sep, "/"))
+        finally:
+            archive.close()
+    elif archive_format == "7z":
+        seven_zip(seven_zip_path, ["a", "-t7z", "-mx=9", "-mmt=on", path, TOP_DIR], root)
+    else:
+        tar_path = path[:-len(".xz")]
+        seven_zip(seven_zip_path, ["a", "-ttar", tar_path, TOP_DIR], root)
+        seven_zip(seven_zip_path, ["a", "-txz", "-mx=9", "-mmt=on", path, tar_path], root)
+        os.remove(tar_path)
+
+
+def write_manifest(release):
+    manifest = release_manifest.build_manifest(release["root"], TOP_DIR, release["version"])
+    with open(os.path.join(release["root"], TOP_DIR, engine.MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    release["manifest"] = manifest
+
+
+def build_release(args, work_dir, version, previous=None):
+    """
+    Builds the tree of a release (the next one after previous, if given) and
+    its manifest. Returns a dict with the tree's root, the manifest and its
+    size; publish_release() adds the archives.
+    """
+    root = os.path.join(work_dir, "release-" + version)
+    if previous is None:
+        unpacked_bytes = build_tree(root, args.size_mb * engine.BYTES_PER_MB, args.files, args.compressibility)
+    else:
+        shutil.copytree(os.path.join(previous["root"], TOP_DIR), os.path.join(root, TOP_DIR))
+        change_tree(root, args.files, args.changed_percent, args.compressibility)
+        unpacked_bytes = None
+    release = {"version": version, "root": root, "archives": {}, "files": {}}
+    write_manifest(release)
+    if unpacked_bytes is None:
+        unpacked_bytes = sum(entry["size"] for entry in release["manifest"]["files"].values())
+    release["unpacked_bytes"] = unpacked_bytes
+    return release
+
+
+def add_file(release, path):
+    """Publishes path with the release; returns its entry (name, sha256, size_bytes)."""
+    entry = {"name": os.path.basename(path), "path": path, "sha256": file_sha256(path), "size_bytes": os.path.getsize(path)}
+    release["files"][entry["name"]] = entry
+    return entry
+
+
+def publish_release(args, release, formats, previous=None):
+    """Packs the release in each format, and with --delta the delta pack from previous."""
+    for archive_format in formats:
+        path = os.path.join(os.path.dirname(release["root"]), "pythonCWMS{}.{}".format(release["version"], archive_format))
+        print("Packing {}...".format(os.path.basename(path)))
+        pack(release["root"], archive_format, path, args.seven_zip)
+        release["archives"][archive_format] = add_file(release, path)
+    manifest_path = os.path.join(os.path.dirname(release["root"]), "pythonCWMS{}_manifest.json".format(release["version"]))
+    shutil.copyfile(os.path.join(release["root"], TOP_DIR, engine.MANIFEST_NAME), manifest_path)
+    release["manifest_file"] = add_file(release, manifest_path)
+    release["delta_pack"] = None
+    if previous is not None and args.delta:
+        changed, _ = release_manifest.diff_manifests(previous["manifest"], release["manifest"])
+        path = os.path.join(os.path.dirname(release["root"]), "pythonCWMS{}_delta_from_{}.zip".format(
+            release["version"], previous["version"]))
+        pack_file = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        try:
+            for relative_path in changed:
+                pack_file.write(os.path.join(release["root"], *relative_path.split("/")), relative_path)
+        finally:
+            pack_file.close()
+        release["delta_pack"] = add_file(release, path)
+        release["delta_pack"]["from_version"] = previous["version"]
+
+
+def given_archive(path):
+    """A release made of an archive from --archive: no manifest, so nothing is checked beyond python.exe."""
+    archive_format = "7z" if path.lower().endswith(".7z") else "zip"
+    release = {"version": "given", "root": None, "manifest": None, "unpacked_bytes": None,
+               "archives": {}, "files": {}, "manifest_file": None, "delta_pack": None}
+    release["archives"][archive_format] = add_file(release, path)
+    return release
+
+
+class Throttle(object):
+    """Limits the bytes per second passed through wait(); shared by threads. None means no limit."""
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_slot = time.time()
+
+    def wait(self, count):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.time()
+            self._next_slot = max(now, self._next_slot) + count / float(self.bytes_per_second)
+            delay = self._next_slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Drops(object):
+    """
+    Cuts the first count downloads short, whichever server they go to.
+    Mirror probes (a few hundred KB) are never cut.
+    """
+
+    def __init__(self, count, drop_after_mb=None):
+        self.drop_after_bytes = int(drop_after_mb * engine.BYTES_PER_MB) if drop_after_mb else None
+        self._left = count
+        self._lock = threading.Lock()
+
+    def reset(self, count):
+        with self._lock:
+            self._left = count
+
+    def take(self, length):
+        """Bytes after which this response is cut short, or None to send it whole."""
+        if length <= engine.MIRROR_PROBE_BYTES:
+            return None
+        with self._lock:
+            if self._left <= 0:
+                return None
+            self._left -= 1
+        return min(self.drop_after_bytes or length // 2, length - 1)
+
+
+class ReleaseHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive and Range, as the segmented downloader expects from GitHub.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send_file(head=True)
+
+    def do_GET(self):
+        self._send_file(head=False)
+
+    def _send_file(self, head):
+        server = self.server
+        server.count("requests")
+        if server.latency:
+            time.sleep(server.latency)
+        entry = server.files.get(self.path.split("?")[0])
+        if entry is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        size = entry["size_bytes"]
+        start, end = 0, size - 1
+        match = re.match(r"^bytes=(\d+)-(\d*)$", (self.headers.getheader("Range") or "").strip())
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(206 if match else 200)
+        if match:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", '"{}"'.format(entry["sha256"].lower()))
+        self.end_headers()
+        if head:
+            return
+
+        remaining = end - start + 1
+        drop_at = server.drops.take(remaining) if server.drops is not None else None
+        connection_throttle = Throttle(server.connection_bytes_per_second)
+        sent = 0
+        with open(entry["path"], "rb") as f:
+            f.seek(start)
+            while sent < remaining:
+                block = f.read(min(SEND_BLOCK_SIZE, remaining - sent))
+                if not block:
+                    break
+                server.link.wait(len(block))
+                connection_throttle.wait(len(block))
+                self.wfile.write(block)
+                sent += len(block)
+                server.count("bytes_sent", len(block))
+                if drop_at is not None and sent >= drop_at:
+                    # Close without finishing the body, like a proxy timing out.
+                    server.count("drops")
+                    self.close_connection = 1
+                    return
+
+
+class ReleaseServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves the files of a release (entries from add_file) by name, and by
+    hash under /archive/ like a LAN peer.
+    """
+    daemon_threads = True
+
+    def __init__(self, role, files, bandwidth_mbps=None, connection_mbps=None, latency_ms=0, drops=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), ReleaseHandler)
+        self.role = role
+        self.files = {}
+        for entry in files:
+            self.files["/" + entry["name"]] = entry
+            self.files["/archive/" + entry["sha256"].lower()] = entry
+        self.link = Throttle(mbps_to_bytes_per_second(bandwidth_mbps))
+        self.connection_bytes_per_second = mbps_to_bytes_per_second(connection_mbps)
+        self.latency = latency_ms / 1000.0
+        self.drops = drops
+        self.stats = {"requests": 0, "drops": 0, "bytes_sent": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        return "127.0.0.1:{}".format(self.server_address[1])
+
+    @property
+    def base_url(self):
+        return "http://{}".format(self.address)
+
+    def url(self, name):
+        return "{}/{}".format(self.base_url, name)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+
+def mbps_to_bytes_per_second(mbps):
+    return mbps * 1000.0 * 1000.0 / 8.0 if mbps else None
+
+
+def dead_mirror_url():
+    """A URL on a local port nothing listens on, so probes and downloads from it fail at once."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:{}".format(sock.getsockname()[1])
+    finally:
+        sock.close()
+
+
+def release_config(args, release, origin, mirrors, peers, destination, cache_dir):
+    """The installer config for release, laid out like the one the release workflow publishes."""
+    archives = release["archives"]
+    main_archive = archives.get("7z") or archives["zip"]
+    config = {
+        "version": release["version"],
+        "python_download_url": origin.url(main_archive["name"]),
+        "python_expected_hash_sha256": main_archive["sha256"],
+        "archive_size_mb": round(main_archive["size_bytes"] / engine.BYTES_PER_MB, 2),
+        "default_install_directory": destination,
+        "default_env_var_name": ENV_VAR_NAME,
+        "python_exe_sub_directory": PYTHON_EXE_SUB_DIR,
+        "download_connections": args.connections,
+        "archive_variants": [{"format": archive_format, "url": origin.url(archives[archive_format]["name"]),
+                              "sha256": archives[archive_format]["sha256"],
+                              "size_bytes": archives[archive_format]["size_bytes"]}
+                             for archive_format in ("7z", "zip") if archive_format in archives],
+        "archive_cache_dir": cache_dir,
+        "archive_cache_max_mb": args.archive_cache_mb if args.archive_cache else 0,
+        "mirrors": [mirror.base_url for mirror in mirrors] + [dead_mirror_url() for _ in xrange(args.dead_mirrors)],
+        "peers": [peer.address for peer in peers],
+    }
+    if "tar.xz" in archives:
+        stream = archives["tar.xz"]
+        config["streaming_archive"] = {
+            "format": "tar.xz",
+            "url": origin.url(stream["name"]),
+            "sha256": stream["sha256"],
+            "size_bytes": stream["size_bytes"],
+            "chunk_size_bytes": STREAM_CHUNK_SIZE,
+            "chunk_sha256": chunk_sha256(stream["path"]),
+        }
+    if release["manifest_file"] is not None:
+        config["manifest_url"] = origin.url(release["manifest_file"]["name"])
+        config["manifest_sha256"] = release["manifest_file"]["sha256"]
+    if release["delta_pack"] is not None:
+        config["delta_packs"] = [{"from_version": release["delta_pack"]["from_version"],
+                                  "url": origin.url(release["delta_pack"]["name"]),
+                                  "sha256": release["delta_pack"]["sha256"],
+                                  "size_bytes": release["delta_pack"]["size_bytes"]}]
+    return config
+
+
+def install_copy(release, destination):
+    """Puts a release into destination the way the installer leaves it: the tree plus its file index."""
+    shutil.copytree(os.path.join(release["root"], TOP_DIR), os.path.join(destination, TOP_DIR))
+    index = engine.InstalledFileIndex(os.path.join(destination, TOP_DIR, engine.FILE_INDEX_NAME))
+    for relative_path, entry in release["manifest"]["files"].items():
+        index.record(destination, relative_path, entry["sha256"])
+    index.save()
+
+
+def check_installation(release, destination, previous=None):
+    """Returns a description of how the installation differs from the release, or None if it matches."""
+    if not os.path.isfile(os.path.join(destination, *(PYTHON_EXE_SUB_DIR.split("/") + ["python.exe"]))):
+        return "python.exe is missing"
+    if release["manifest"] is None:
+        return None
+    # Without the installer's file index, so every file is hashed again.
+    changed, removed = engine.plan_upgrade(destination, release["manifest"],
+                                           previous["manifest"] if previous is not None else None)
+    if changed or removed:
+        return "{} installed files differ from the release and {} should have been removed (e.g. {})".format(
+            len(changed), len(removed), (changed + removed)[0])
+    return None
+
+
+class BenchmarkUi(engine.InstallUi):
+    """Prints the engine's log with --verbose and keeps the warnings and errors it would show in dialogs."""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.messages = []
+
+    def log(self, text):
+        if self.verbose:
+            sys.stdout.write("".join("    " + line + "\n" for line in text.splitlines() if line.strip()))
+
+    def show_message(self, message, title, kind="info"):
+        if kind != "info":
+            self.messages.append("{}: {}".format(title, message))
+
+
+def run_once(args, release, config, work_dir, previous=None):
+    """One install of release with InstallEngine.run; returns the telemetry report."""
+    destination = config["default_install_directory"]
+    shutil.rmtree(destination, ignore_errors=True)
+    if previous is not None:
+        install_copy(previous, destination)
+    ui = BenchmarkUi(args.verbose)
+    install_engine = engine.InstallEngine(ui, config_cache_dir=os.path.join(work_dir, "installer"),
+                                          download_dir=os.path.join(work_dir, "downloads"))
+    install_engine.apply_config(config)
+    outcome = install_engine.run(config["python_download_url"], config["python_expected_hash_sha256"], destination,
+                                 ENV_VAR_NAME, PYTHON_EXE_SUB_DIR, args.seven_zip, set_environment=False)
+    report = install_engine.telemetry.report()
+    if ui.messages:
+        report["details"]["messages"] = ui.messages
+    if outcome == "succeeded":
+        problem = check_installation(release, destination, previous)
+        if problem is not None:
+            report["outcome"] = "failed"
+            report["details"]["error"] = problem
+    return report
+
+
+def summarize(reports):
+    """Median seconds, MB/s and files/s of each phase over the successful runs."""
+    phases = []
+    for report in reports:
+        if report["outcome"] != "succeeded":
+            continue
+        for phase in report["phases"]:
+            if phase["name"] not in phases:
+                phases.append(phase["name"])
+    summary = {}
+    for name in phases:
+        entries = [phase for report in reports if report["outcome"] == "succeeded"
+                   for phase in report["phases"] if phase["name"] == name and phase["outcome"] == "ok"]
+        summary[name] = {
+            "runs": len(entries),
+            "seconds": median([phase["seconds"] for phase in entries]),
+            "mb_per_second": median([phase["bytes_per_second"] / engine.BYTES_PER_MB
+                                     for phase in entries if "bytes_per_second" in phase]),
+            "files_per_second": median([phase["files_per_second"] for phase in entries if "files_per_second" in phase]),
+        }
+    totals = [report["total_seconds"] for report in reports if report["outcome"] == "succeeded"]
+    summary["total"] = {"runs": len(totals), "seconds": median(totals), "mb_per_second": None, "files_per_second": None}
+    return summary
+
+
+def check_limits(args, summary, reports):
+    """Returns a list of (description, passed) for every limit that was given."""
+    checks = []
+    failed_runs = [report for report in reports if report["outcome"] != "succeeded"]
+    checks.append(("all {} runs succeeded".format(len(reports)), not failed_runs))
+    for phase, key, limit, minimum, label in (
+            ("download", "mb_per_second", args.min_download_mb_per_s, True, "download MB/s"),
+            ("extract", "mb_per_second", args.min_extract_mb_per_s, True, "extract MB/s"),
+            ("extract", "files_per_second", args.min_extract_files_per_s, True, "extract files/s"),
+            ("total", "seconds", args.max_total_seconds, False, "total seconds")):
+        if limit is None:
+            continue
+        value = summary.get(phase, {}).get(key)
+        passed = value is not None and (value >= limit if minimum else value <= limit)
+        checks.append(("{} {} {} {}".format(label, "{:.2f}".format(value) if value is not None else "n/a",
+                                            ">=" if minimum else "<=", limit), passed))
+    return checks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmark of installs by the installer engine.")
+    parser.add_argument("--size-mb", type=float, default=100, help="uncompressed size of the synthetic release")
+    parser.add_argument("--files", type=int, default=2000, help="number of files in the synthetic release")
+    parser.add_argument("--compressibility", type=float, default=0.5,
+                        help="fraction of each file that is repetitive text (0 = random bytes)")
+    parser.add_argument("--archive", help="install this zip (or 7z, with --seven-zip) instead of a synthetic release")
+    parser.add_argument("--seven-zip", help="7z executable, for the .7z and tar.xz archives (default: zip only)")
+    parser.add_argument("--formats", help="archives to publish, comma separated from 7z, zip and tar.xz "
+                                          "(default: all that can be built)")
+    parser.add_argument("--scenario", choices=("fresh", "upgrade"), default="fresh",
+                        help="install into an empty folder, or over the previous release")
+    parser.add_argument("--changed-percent", type=float, default=5,
+                        help="share of the files that differ from the previous release (--scenario upgrade)")
+    parser.add_argument("--delta", action="store_true", help="publish a delta pack from the previous release")
+    parser.add_argument("--connections", type=int, default=1, help="download connections, like download_connections")
+    parser.add_argument("--mirrors", type=int, default=0, help="mirrors that serve the release files too")
+    parser.add_argument("--dead-mirrors", type=int, default=0, help="mirrors in the config that do not answer")
+    parser.add_argument("--peers", type=int, default=0, help="LAN peers holding the archives (no link limits)")
+    parser.add_argument("--archive-cache", action="store_true",
+                        help="turn on the archive cache; the first run fills it, later runs install from it")
+    parser.add_argument("--archive-cache-mb", type=float, default=engine.DEFAULT_ARCHIVE_CACHE_MAX_MB)
+    parser.add_argument("--bandwidth-mbps", type=float, help="link cap in Mbit/s of the origin and of each mirror")
+    parser.add_argument("--connection-mbps", type=float, help="cap in Mbit/s for each connection")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay before each response")
+    parser.add_argument("--drops", type=int, default=0, help="downloads cut short in each run")
+    parser.add_argument("--drop-after-mb", type=float, help="where downloads are cut (default: halfway)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--min-download-mb-per-s", type=float)
+    parser.add_argument("--min-extract-mb-per-s", type=float)
+    parser.add_argument("--min-extract-files-per-s", type=float)
+    parser.add_argument("--max-total-seconds", type=float)
+    parser.add_argument("--work-dir", help="where releases are built, downloaded and installed (default: system temp)")
+    parser.add_argument("--output", default="installer_benchmark.json")
+    parser.add_argument("--verbose", action="store_true", help="show the installer's log")
+    args = parser.parse_args(argv)
+
+    formats = [value.strip() for value in (args.formats or ("7z,zip,tar.xz" if args.seven_zip else "zip")).split(",")]
+    if set(formats) - set(["7z", "zip", "tar.xz"]) or not set(formats) & set(["7z", "zip"]):
+        parser.error("--formats takes 7z, zip and tar.xz, and needs 7z or zip")
+    if set(formats) - set(["zip"]) and not args.seven_zip:
+        parser.error("the 7z and tar.xz archives need --seven-zip")
+    if args.archive and (args.scenario != "fresh" or args.delta):
+        parser.error("--archive has no manifest, so it can only be benchmarked with --scenario fresh")
+    if args.seven_zip:
+        args.seven_zip = os.path.abspath(args.seven_zip)
+
+    work_dir = tempfile.mkdtemp(prefix="installer-benchmark-", dir=args.work_dir)
+    servers = []
+    reports = []
+    try:
+        previous = None
+        if args.archive:
+            release = given_archive(os.path.abspath(args.archive))
+        else:
+            if args.scenario == "upgrade":
+                print("Building the previous release ({:.0f}MB, {} files)...".format(args.size_mb, args.files))
+                previous = build_release(args, work_dir, "benchmark-1")
+                print("Building the release with {}% of the files changed...".format(args.changed_percent))
+                release = build_release(args, work_dir, "benchmark-2", previous)
+            else:
+                print("Building a {:.0f}MB, {} file release...".format(args.size_mb, args.files))
+                release = build_release(args, work_dir, "benchmark-1")
+            publish_release(args, release, formats, previous)
+
+        drops = Drops(args.drops, args.drop_after_mb)
+        files = release["files"].values()
+        origin = ReleaseServer("origin", files, args.bandwidth_mbps, args.connection_mbps, args.latency_ms, drops)
+        mirrors = [ReleaseServer("mirror", files, args.bandwidth_mbps, args.connection_mbps, args.latency_ms, drops)
+                   for _ in xrange(args.mirrors)]
+        peers = [ReleaseServer("peer", release["archives"].values()) for _ in xrange(args.peers)]
+        servers = [origin] + mirrors + peers
+        for server in servers:
+            server.start()
+        config = release_config(args, release, origin, mirrors, peers, os.path.join(work_dir, "install"),
+                                os.path.join(work_dir, "archive_cache"))
+        for archive_format, entry in sorted(release["archives"].items()):
+            print("Serving the .{} archive ({:.2f}MB) at {}".format(archive_format, entry["size_bytes"] / engine.BYTES_PER_MB,
+                                                                     origin.url(entry["name"])))
+        if release["delta_pack"] is not None:
+            print("Serving the delta pack ({:.2f}MB) at {}".format(release["delta_pack"]["size_bytes"] / engine.BYTES_PER_MB,
+                                                                   origin.url(release["delta_pack"]["name"])))
+
+        for run in xrange(args.runs):
+            drops.reset(args.drops)
+            report = run_once(args, release, config, work_dir, previous)
+            reports.append(report)
+            print("Run {}: {} in {:.1f}s{}".format(run + 1, report["outcome"], report["total_seconds"],
+                                                    " ({})".format(report["details"]["error"]) if "error" in report["details"] else ""))
+            for message in report["details"].get("messages", []):
+                print("    " + message.replace("\n", " "))
+    finally:
+        for server in servers:
+            server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = summarize(reports)
+    print("{:<20} {:>5} {:>9} {:>9} {:>9}".format("Phase", "Runs", "Seconds", "MB/s", "Files/s"))
+    for name in [phase for phase in summary if phase != "total"] + ["total"]:
+        entry = summary[name]
+        print("{:<20} {:>5} {:>9} {:>9} {:>9}".format(
+            name, entry["runs"],
+            "{:.2f}".format(entry["seconds"]) if entry["seconds"] is not None else "-",
+            "{:.2f}".format(entry["mb_per_second"]) if entry["mb_per_second"] is not None else "-",
+            "{:.0f}".format(entry["files_per_second"]) if entry["files_per_second"] is not None else "-"))
+    checks = check_limits(args, summary, reports)
+    for description, passed in checks:
+        print("{}  {}".format("PASS" if passed else "FAIL", description))
+
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": dict((key, value) for key, value in vars(args).items() if key not in ("output", "verbose")),
+        "release": {
+            "archive_bytes": dict((archive_format, entry["size_bytes"]) for archive_format, entry in release["archives"].items()),
+            "delta_pack_bytes": release["delta_pack"]["size_bytes"] if release["delta_pack"] is not None else None,
+            "unpacked_bytes": release["unpacked_bytes"],
+        },
+        "servers": [{"role": server.role, "url": server.base_url, "stats": server.stats} for server in servers],
+        "summary": summary,
+        "checks": [{"check": description, "passed": passed} for description, passed in checks],
+        "runs": reports,
+    }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=1, sort_keys=True)
+    print("Wrote {}".format(args.output))
+    return 0 if all(passed for _, passed in checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Precompiles the bundled interpreter's libraries so users never pay bytecode
+compilation (or write __pycache__ into C:\\hec\\python) on first import.
+
+Run it with the interpreter being shipped:
+
+    pythonCWMS\\python\\python.exe build_scripts/precompile.py --requirements requirements_binary_only.txt [--zip-stdlib]
+
+- Every .py under Lib (stdlib and site-packages) is compiled to an
+  unchecked-hash .pyc: the interpreter loads it without comparing it to the
+  source's timestamp or hash, so it stays valid after extraction changes
+  file times. pip rewrites the .pyc of anything it installs later.
+- With --zip-stdlib, pure-Python stdlib modules and packages are packed as
+  .pyc into python3XY.zip next to python.exe (already on the default
+  sys.path) and removed from Lib, which replaces thousands of small files
+  with one archive. Packages that carry data files stay in Lib.
+- Finally every packed module and every package from the requirements is
+  imported in a fresh interpreter, before and after the changes. Imports
+  that worked before and fail afterwards fail the build, and modules that
+  still had to be compiled at import time are reported.
+"""
+import argparse
+import compileall
+import json
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+import import_benchmark
+
+# Stdlib parts that read files next to their modules, need a real directory or are not needed at run time.
+ZIP_EXCLUDE = {
+    "site-packages", "test", "idlelib", "tkinter", "turtledemo", "lib2to3", "venv", "ensurepip",
+    "pydoc_data", "__pycache__", "__phello__",
+}
+
+# Importing these has side effects (opening a browser, printing), so the import check skips them.
+VERIFY_SKIP = {"antigravity", "this"}
+
+VERIFY_CODE = r"""
+import json, sys
+failures = {}
+for name in sys.argv[1:]:
+    try:
+        __import__(name)
+    except BaseException as e:
+        failures[name] = "{}: {}".format(type(e).__name__, e)
+print(json.dumps(failures))
+"""
+
+
+def precompile(lib_dir, workers):
+    print("Compiling {} (unchecked-hash .pyc)...".format(lib_dir))
+    ok = compileall.compile_dir(lib_dir, quiet=1, workers=workers,
+                                invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    if not ok:
+        # Some wheels ship templates or Python 2 files with a .py extension; the import check decides.
+        print("::warning::Some files could not be compiled (see above)")
+
+
+def stdlib_candidates(lib_dir):
+    """Yields (name, path) for top-level stdlib modules and pure-Python packages that can be zipped."""
+    for name in sorted(os.listdir(lib_dir)):
+        path = os.path.join(lib_dir, name)
+        if name in ZIP_EXCLUDE:
+            continue
+        if os.path.isfile(path) and name.endswith(".py"):
+            yield name[:-3], path
+        elif os.path.isdir(path) and os.path.isfile(os.path.join(path, "__init__.py")):
+            pure = True
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = [d for d in dirnames if d != "__pycache__"]
+                if any(not f.endswith(".py") for f in filenames):
+                    pure = False
+                    break
+            if pure:
+                yield name, path
+
+
+def zip_stdlib(python_dir, lib_dir, remove_packed):
+    """Packs pure-Python stdlib modules into python3XY.zip; returns the packed top-level names."""
+    # The interpreter always lists its stdlib zip on sys.path (next to python.exe on Windows).
+    zip_name = "python{}{}.zip".format(*sys.version_info[:2])
+    zip_path = next((p for p in sys.path if os.path.basename(p) == zip_name), os.path.join(python_dir, zip_name))
+    pth_files = [f for f in os.listdir(python_dir) if f.endswith("._pth")]
+    if pth_files:
+        print("::warning::{} overrides sys.path; make sure it lists {}".format(pth_files[0], zip_name))
+    packed = []
+    build_dir = tempfile.mkdtemp(prefix="stdlib-zip-")
+    try:
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+            for name, path in stdlib_candidates(lib_dir):
+                sources = [path] if os.path.isfile(path) else [
+                    os.path.join(dirpath, f) for dirpath, dirnames, filenames in os.walk(path)
+                    if "__pycache__" not in dirpath for f in filenames]
+                for source in sources:
+                    relative = os.path.relpath(source, lib_dir).replace(os.sep, "/")
+                    compiled = os.path.join(build_dir, relative + "c")
+                    py_compile.compile(source, cfile=compiled, dfile=relative, doraise=True,
+                                       invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+                    archive.write(compiled, relative + "c")
+                packed.append((name, path))
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    print("Packed {} stdlib modules into {} ({:.1f} MB)".format(
+        len(packed), zip_path, os.path.getsize(zip_path) / (1024.0 * 1024.0)))
+    if remove_packed:
+        for _, path in packed:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+                cache_dir = os.path.join(os.path.dirname(path), "__pycache__")
+                stem = os.path.basename(path)[:-3] + "."
+                if os.path.isdir(cache_dir):
+                    for cached in os.listdir(cache_dir):
+                        if cached.startswith(stem):
+                            os.remove(os.path.join(cache_dir, cached))
+    return [name for name, _ in packed]
+
+
+def pyc_files(root):
+    result = set()
+    for dirpath, _, filenames in os.walk(root):
+        result.update(os.path.join(dirpath, f) for f in filenames if f.endswith(".pyc"))
+    return result
+
+
+def verify_imports(python_dir, modules):
+    """Imports modules in a fresh interpreter; returns (failures, pyc files written by the imports)."""
+    before = pyc_files(python_dir)
+    env = dict(os.environ)
+    env.pop("PYTHONPYCACHEPREFIX", None)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    process = subprocess.run([sys.executable, "-c", VERIFY_CODE] + modules, capture_output=True, text=True, env=env)
+    if process.returncode != 0:
+        return {"(interpreter)": process.stderr.strip()}, []
+    failures = json.loads(process.stdout.strip().splitlines()[-1])
+    written = sorted(pyc_files(python_dir) - before)
+    for path in written:
+        os.remove(path)  # Keep the shipped tree exactly as built.
+    return failures, written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompile the bundled pythonCWMS interpreter's libraries.")
+    parser.add_argument("--requirements", default="requirements_binary_only.txt")
+    parser.add_argument("--zip-stdlib", action="store_true", help="pack pure-Python stdlib modules into python3XY.zip")
+    parser.add_argument("--keep-packed", action="store_true", help="leave zipped stdlib sources in Lib")
+    parser.add_argument("--workers", type=int, default=0, help="compile processes (0 = one per CPU)")
+    args = parser.parse_args(argv)
+
+    python_dir = sys.prefix
+    lib_dir = os.path.join(python_dir, "Lib")
+    if not os.path.isdir(lib_dir):
+        lib_dir = os.path.dirname(os.__file__)
+
+    modules = set(name for name, _ in stdlib_candidates(lib_dir)) if args.zip_stdlib else set()
+    for names in import_benchmark.import_names(import_benchmark.read_requirements(args.requirements)).values():
+        modules.update(names)
+    modules = sorted(modules - VERIFY_SKIP)
+    baseline_failures, _ = verify_imports(python_dir, modules)
+
+    # Compile before zipping: this process cannot import from a zip created after it started.
+    precompile(lib_dir, args.workers)
+    if args.zip_stdlib:
+        zip_stdlib(python_dir, lib_dir, remove_packed=not args.keep_packed)
+
+    failures, written = verify_imports(python_dir, modules)
+    broken = dict((name, error) for name, error in failures.items() if name not in baseline_failures)
+    print("Checked {} imports: {} broken by this stage, {} already failing, {} modules compiled at import time".format(
+        len(modules), len(broken), len(failures) - len(broken), len(written)))
+    for path in written[:20]:
+        print("::warning::Not precompiled: {}".format(os.path.relpath(path, python_dir)))
+    for name, error in sorted(failures.items()):
+        if name not in broken:
+            print("::warning::import {} fails with or without precompiling: {}".format(name, error))
+    for name, error in sorted(broken.items()):
+        print("::error::import {} failed after precompiling: {}".format(name, error))
+    return 1 if broken else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
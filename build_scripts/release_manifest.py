@@ -0,0 +1,99 @@
+"""
+Builds the per-file release manifest and the delta pack used by the installer
+to update an existing pythonCWMS installation without downloading the full
+archive.
+
+    python build_scripts/release_manifest.py manifest --root . --top pythonCWMS --version 1.02 --output pythonCWMS/pythonCWMS_manifest.json
+    python build_scripts/release_manifest.py delta --root . --old previous_manifest.json --new pythonCWMS/pythonCWMS_manifest.json --output pythonCWMS1.02_delta_from_1.01.zip
+
+Manifest paths are relative to the installation directory (so they start with
+the top-level ``pythonCWMS/`` folder) and always use forward slashes.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import zipfile
+
+MANIFEST_NAME = "pythonCWMS_manifest.json"
+READ_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(READ_SIZE), b""):
+            hasher.update(buf)
+    return hasher.hexdigest().upper()
+
+
+def build_manifest(root, top, version):
+    """Returns the manifest dict for every file under root/top (except the manifest itself)."""
+    files = {}
+    for dirpath, _, filenames in os.walk(os.path.join(root, top)):
+        for filename in filenames:
+            if filename == MANIFEST_NAME:
+                continue
+            path = os.path.join(dirpath, filename)
+            relative_path = os.path.relpath(path, root).replace(os.sep, "/")
+            files[relative_path] = {"size": os.path.getsize(path), "sha256": file_sha256(path)}
+    return {"version": version, "top": top, "files": files}
+
+
+def diff_manifests(old_manifest, new_manifest):
+    """Returns (changed, removed): paths to ship in a delta pack and paths to delete."""
+    old_files = old_manifest["files"]
+    new_files = new_manifest["files"]
+    changed = sorted(path for path, entry in new_files.items()
+                     if old_files.get(path, {}).get("sha256") != entry["sha256"])
+    removed = sorted(path for path in old_files if path not in new_files)
+    return changed, removed
+
+
+def write_delta_pack(root, old_manifest, new_manifest, output):
+    changed, removed = diff_manifests(old_manifest, new_manifest)
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as pack:
+        for path in changed:
+            pack.write(os.path.join(root, *path.split("/")), path)
+    return changed, removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    manifest_parser = commands.add_parser("manifest", help="write the per-file manifest of a release tree")
+    manifest_parser.add_argument("--root", required=True, help="directory that contains the top-level folder")
+    manifest_parser.add_argument("--top", default="pythonCWMS", help="top-level folder inside the archive")
+    manifest_parser.add_argument("--version", required=True)
+    manifest_parser.add_argument("--output", required=True)
+
+    delta_parser = commands.add_parser("delta", help="write a zip with the files that changed since a previous manifest")
+    delta_parser.add_argument("--root", required=True)
+    delta_parser.add_argument("--old", required=True, help="manifest of the previous release")
+    delta_parser.add_argument("--new", required=True, help="manifest of this release")
+    delta_parser.add_argument("--output", required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "manifest":
+        manifest = build_manifest(args.root, args.top, args.version)
+        with open(args.output, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        total_mb = sum(entry["size"] for entry in manifest["files"].values()) / (1024.0 * 1024.0)
+        print("Wrote {} ({} files, {:.2f} MB)".format(args.output, len(manifest["files"]), total_mb))
+    else:
+        with open(args.old) as f:
+            old_manifest = json.load(f)
+        with open(args.new) as f:
+            new_manifest = json.load(f)
+        changed, removed = write_delta_pack(args.root, old_manifest, new_manifest, args.output)
+        print("Wrote {} ({} changed files, {} removed since {}, {:.2f} MB)".format(
+            args.output, len(changed), len(removed), old_manifest.get("version"),
+            os.path.getsize(args.output) / (1024.0 * 1024.0)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
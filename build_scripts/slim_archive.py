@@ -0,0 +1,226 @@
+"""
+Removes content that is never used at run time (test suites, docs, examples,
+type stubs) from the bundled interpreter before it is archived, following the
+rules in build_scripts/slim_rules.txt, and writes a per-package size report.
+
+Run it with the interpreter being shipped:
+
+    pythonCWMS\\python\\python.exe build_scripts/slim_archive.py --rules build_scripts/slim_rules.txt --output slim_report.json
+
+- Files are attributed to the distribution whose RECORD lists them; anything
+  else (the stdlib, WinPython's own files) is reported as "(python)". The
+  report has each package's size and file count before and after, and what
+  each rule removed.
+- The RECORD of every trimmed distribution is rewritten without the removed
+  files, so pip can still uninstall or upgrade it cleanly.
+- DLLs that are shipped more than once with identical content are listed but
+  left in place: each package loads them from its own folder.
+- The top-level modules of every installed distribution are imported in a
+  fresh interpreter before and after pruning; an import that worked before and
+  fails afterwards fails the build (fix it with a ! line in the rules).
+"""
+import argparse
+import csv
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import time
+from importlib import metadata
+
+import import_benchmark
+import precompile
+
+OTHER = "(python)"
+
+
+def load_rules(path):
+    """Returns (pattern, keep) pairs in file order."""
+    rules = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            keep = line.startswith("!")
+            rules.append((line[1:].strip() if keep else line, keep))
+    return rules
+
+
+def matching_rule(relative, rules):
+    """Returns the rule that removes relative, or None if the file stays (the last matching line wins)."""
+    removed_by = None
+    for pattern, keep in rules:
+        if fnmatch.fnmatchcase(relative, pattern):
+            removed_by = None if keep else pattern
+    return removed_by
+
+
+def file_owners(python_dir):
+    """Maps the normalized path of every file installed by a distribution to (name, version, distribution)."""
+    owners = {}
+    for dist in metadata.distributions():
+        name = dist.metadata["Name"]
+        for f in dist.files or []:
+            path = os.path.normcase(os.path.abspath(str(dist.locate_file(f))))
+            if path.startswith(os.path.normcase(python_dir) + os.sep):
+                owners[path] = (name, dist.version, dist)
+    return owners
+
+
+def rewrite_record(dist, removed_paths):
+    """Drops removed files from a distribution's RECORD."""
+    record = next((f for f in dist.files or [] if f.name == "RECORD" and f.parent.name.endswith(".dist-info")), None)
+    if record is None:
+        return
+    record_path = str(dist.locate_file(record))
+    with open(record_path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    kept = [row for row in rows
+            if not row or os.path.normcase(os.path.abspath(str(dist.locate_file(row[0])))) not in removed_paths]
+    with open(record_path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f, lineterminator="\n").writerows(kept)
+
+
+def remove_emptied_dirs(directories, root):
+    """Removes folders (and their parents up to root) left empty by pruning; folders that were empty stay."""
+    for directory in sorted(directories, key=len, reverse=True):
+        while directory != root and os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest().upper()
+
+
+def duplicate_dlls(dlls):
+    """Groups DLLs with identical content; dlls is a list of (relative path, path, size)."""
+    by_size = {}
+    for relative, path, size in dlls:
+        by_size.setdefault((os.path.basename(relative).lower(), size), []).append((relative, path))
+    groups = []
+    for (_, size), paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        by_hash = {}
+        for relative, path in paths:
+            by_hash.setdefault(file_sha256(path), []).append(relative)
+        for same in by_hash.values():
+            if len(same) > 1:
+                groups.append({"size_bytes": size, "wasted_bytes": size * (len(same) - 1), "files": sorted(same)})
+    return sorted(groups, key=lambda g: -g["wasted_bytes"])
+
+
+def installed_modules():
+    """Top-level modules of every installed distribution."""
+    names = sorted(set(dist.metadata["Name"] for dist in metadata.distributions() if dist.metadata["Name"]))
+    modules = set()
+    for found in import_benchmark.import_names(names).values():
+        modules.update(found)
+    return sorted(m for m in modules - precompile.VERIFY_SKIP if m.isidentifier())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prune non-runtime files from the bundled pythonCWMS interpreter.")
+    parser.add_argument("--rules", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "slim_rules.txt"))
+    parser.add_argument("--output", default="slim_report.json")
+    parser.add_argument("--version", help="release version recorded in the report")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be removed without removing it")
+    args = parser.parse_args(argv)
+
+    python_dir = os.path.abspath(sys.prefix)
+    rules = load_rules(args.rules)
+    owners = file_owners(python_dir)
+
+    modules = installed_modules()
+    baseline_failures = {} if args.dry_run else precompile.verify_imports(python_dir, modules)[0]
+
+    packages = {}
+    by_rule = dict((pattern, {"files": 0, "bytes": 0}) for pattern, keep in rules if not keep)
+    removed_by_dist = {}
+    emptied_dirs = set()
+    dlls = []
+    for dirpath, dirnames, filenames in os.walk(python_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relative = os.path.relpath(path, python_dir).replace(os.sep, "/")
+            size = os.path.getsize(path)
+            name, version, dist = owners.get(os.path.normcase(path), (OTHER, None, None))
+            entry = packages.setdefault(name, {"version": version, "before_bytes": 0, "before_files": 0,
+                                               "after_bytes": 0, "after_files": 0})
+            entry["before_bytes"] += size
+            entry["before_files"] += 1
+            rule = matching_rule(relative, rules)
+            if rule is None:
+                entry["after_bytes"] += size
+                entry["after_files"] += 1
+                if filename.lower().endswith(".dll"):
+                    dlls.append((relative, path, size))
+                continue
+            by_rule[rule]["files"] += 1
+            by_rule[rule]["bytes"] += size
+            if dist is not None:
+                removed_by_dist.setdefault(name, (dist, set()))[1].add(os.path.normcase(path))
+            if not args.dry_run:
+                os.remove(path)
+                emptied_dirs.add(dirpath)
+
+    if not args.dry_run:
+        for dist, removed_paths in removed_by_dist.values():
+            rewrite_record(dist, removed_paths)
+        remove_emptied_dirs(emptied_dirs, python_dir)
+
+    totals = dict((key, sum(entry[key] for entry in packages.values()))
+                  for key in ("before_bytes", "before_files", "after_bytes", "after_files"))
+    duplicates = duplicate_dlls(dlls)
+    report = {
+        "version": args.version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "dry_run": args.dry_run,
+        "totals": totals,
+        "packages": packages,
+        "removed_by_rule": by_rule,
+        "duplicate_dlls": duplicates,
+    }
+
+    mb = 1024.0 * 1024.0
+    print("{:<32} {:>10} {:>10} {:>8} {:>8}".format("Package", "before MB", "after MB", "files", "removed"))
+    for name, entry in sorted(packages.items(), key=lambda item: -item[1]["before_bytes"])[:25]:
+        print("{:<32} {:>10.1f} {:>10.1f} {:>8} {:>8}".format(
+            name[:32], entry["before_bytes"] / mb, entry["after_bytes"] / mb, entry["after_files"],
+            entry["before_files"] - entry["after_files"]))
+    for pattern, removed in by_rule.items():
+        print("  {:<45} {:>7} files {:>8.1f} MB".format(pattern, removed["files"], removed["bytes"] / mb))
+    print("{} {:.1f} MB in {} files, {:.1f} MB in {} files remain".format(
+        "Would remove" if args.dry_run else "Removed", (totals["before_bytes"] - totals["after_bytes"]) / mb,
+        totals["before_files"] - totals["after_files"], totals["after_bytes"] / mb, totals["after_files"]))
+    if duplicates:
+        print("Identical DLLs shipped more than once ({:.1f} MB, kept):".format(
+            sum(g["wasted_bytes"] for g in duplicates) / mb))
+        for group in duplicates[:10]:
+            print("  {:.1f} MB x {}: {}".format(group["size_bytes"] / mb, len(group["files"]), ", ".join(group["files"])))
+
+    broken = {}
+    if not args.dry_run:
+        failures, _ = precompile.verify_imports(python_dir, modules)
+        broken = dict((name, error) for name, error in failures.items() if name not in baseline_failures)
+        print("Checked {} imports: {} broken by pruning, {} already failing".format(
+            len(modules), len(broken), len(failures) - len(broken)))
+        for name, error in sorted(broken.items()):
+            print("::error::import {} failed after pruning: {}".format(name, error))
+    report["broken_imports"] = broken
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print("Wrote {}".format(args.output))
+    return 1 if broken else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
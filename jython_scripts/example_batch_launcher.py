@@ -0,0 +1,41 @@
+import os
+import sys
+
+# scripts to run, as (path to your python script, arguments) pairs; arguments can be None or ''
+jobs = [
+    (r"C:\code\CWMS-data-acquisition-python\src\get_USGS_measurements\get_USGS_measurements.py", "-d 60"),
+    (r"C:\code\CWMS-data-acquisition-python\src\get_METAR\get_METAR.py", ""),
+]
+
+# optional JSON file with more jobs: [{"script": "...", "args": "...", "timeout": 600, "job": "..."}, ...], set to None
+# if not needed; "job" names the state the script keeps between runs (see python_scripts/pythoncwms_state.py), by default
+# the script's file name plus a hash of its args, the same name example_python_script_launcher.py uses
+jobs_manifest_path = None
+
+# how many scripts run at the same time, None = one per CPU core
+max_concurrent = None
+
+# scripts still running after this many seconds are stopped (a job can override it with "timeout"), None = no limit
+job_timeout_seconds = 1800
+
+# folder for one full output log per job, set to None to keep only the last lines of each job
+batch_log_dir = None
+
+# how many of the last output lines of each job to print in the summary
+output_tail_lines = 20
+
+##################################################################################################
+
+# The launcher code (pythoncwms_launch.py) is installed with pythonCWMS in its jython_scripts folder
+pythoncwms_home = os.environ.get('PYTHON_CWMS_HOME')
+if not pythoncwms_home:
+    print("Error: PYTHON_CWMS_HOME environment variable not set.")
+    exit()  # Or handle the error appropriately
+jython_scripts_dir = os.path.normpath(os.path.join(pythoncwms_home, os.pardir, "jython_scripts"))
+if jython_scripts_dir not in sys.path:
+    sys.path.append(jython_scripts_dir)
+import pythoncwms_launch
+
+batch = pythoncwms_launch.run_batch(
+    jobs, jobs_manifest_path, max_concurrent=max_concurrent, job_timeout_seconds=job_timeout_seconds,
+    batch_log_dir=batch_log_dir, output_tail_lines=output_tail_lines)
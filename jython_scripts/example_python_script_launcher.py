@@ -1,5 +1,5 @@
 import os
-import subprocess
+import sys
 
 # path to your python script
 python_script_path = r"C:\code\CWMS-data-acquisition-python\src\get_USGS_measurements\get_USGS_measurements.py"
@@ -7,61 +7,73 @@ python_script_path = r"C:\code\CWMS-data-acquisition-python\src\get_USGS_measure
 # any arguments you may need, set to None or '' if not needed
 args = "-d 60"
 
+# name under which the script keeps its state between runs (see python_scripts/pythoncwms_state.py), so it can
+# fetch only data newer than its last run instead of a fixed window; None = the script's file name, plus a hash
+# of args if there are any, so the same script run with different args keeps separate state
+job_name = None
+
+# run the script in a warm pythonCWMS worker that keeps heavy modules imported between runs,
+# set to False to start a new python.exe for every run
+use_worker = True
+
+# modules the worker imports once when it starts
+worker_preload = "pandas,xarray,cwms,hecdss"
+
+# the worker is replaced with a fresh process after this many runs, or after an hour without one
+worker_max_jobs = 50
+worker_idle_timeout = 3600
+
+# print output line by line while the script runs, set to False to print it all after the script exits
+stream_output = True
+
+# also write the script's output to a log file that rolls over at output_log_max_mb, set to None to skip
+output_log_path = None
+output_log_max_mb = 10
+output_log_backups = 3
+
+# stop echoing output to the CAVI console after this many lines (the log file still gets all of it), 0 = no limit
+console_max_lines = 0
+
+# replay the output of an earlier successful run instead of running the script again, as long as the
+# script, args, the environment variables in cache_env_vars and the files in cache_input_files are unchanged
+cache_results = False
+
+# comma separated environment variables and input files (wildcards allowed) the script's result depends on;
+# list local modules the script imports here too, only the script file itself is checked by default
+cache_env_vars = ""
+cache_input_files = ""
+
+# comma separated files the script writes (wildcards allowed), restored when a cached result is replayed;
+# relative paths are relative to the script's folder
+cache_output_files = ""
+
+# cached results expire after cache_ttl_seconds, and the least recently used are removed above cache_max_mb
+cache_ttl_seconds = 3600
+cache_max_mb = 200
+
+# set to True (or set PYTHON_CWMS_NO_CACHE=1) to run the script even if a cached result exists;
+# the new result replaces the cached one
+cache_bypass = False
+
 ##################################################################################################
 
-# 1. Get the expanded pythonCWMS directory from the environment variable
-pythoncwms_home = os.environ.get('PYTHON_CWMS_HOME')  # Get the value of PYTHON_CWMS_HOME
+# The launcher code (pythoncwms_launch.py) is installed with pythonCWMS in its jython_scripts folder
+pythoncwms_home = os.environ.get('PYTHON_CWMS_HOME')
 if not pythoncwms_home:
     print("Error: PYTHON_CWMS_HOME environment variable not set.")
     exit()  # Or handle the error appropriately
+jython_scripts_dir = os.path.normpath(os.path.join(pythoncwms_home, os.pardir, "jython_scripts"))
+if jython_scripts_dir not in sys.path:
+    sys.path.append(jython_scripts_dir)
+import pythoncwms_launch
 
-# 2. Construct the pythonCWMS directory path using os.path.join
-
-pythoncwms_path = os.path.join(pythoncwms_home, "python.exe") # Path to the executable
-
-# 3. Check if the pythonCWMS_dir is in the PATH
-current_path = os.environ.get('PATH', '')
-if pythoncwms_home not in current_path:
-    os.environ['PATH'] = pythoncwms_home + os.pathsep + current_path
-    print("Updated PATH:", os.environ['PATH'])
-else:
-    print("pythonCWMS directory already in PATH.")
-
-
-# 4. Test using os.system()
-print("\n--- Testing pythonCWMS directly with os.system() ---")
-return_code_os_system = os.system("pythonCWMS --version") 
-print("os.system return code:", return_code_os_system)
-
-if return_code_os_system == 0:
-    print("os.system succeeded. pythonCWMS is accessible.")
-else:
-    print("os.system failed. pythonCWMS is NOT accessible. Check the PATH.")
-
-# 5. Subprocess Call (only if the above test succeeds)
-if return_code_os_system == 0:
-    python_executable = pythoncwms_path  # Use the constructed path
-    
-
-    cmd = [python_executable, python_script_path]
-    if not args or args != '':
-    	cmd.append(args)
-    	
-    print("Executing command:", cmd)
-
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
-
-    stdout_str = stdout.decode('utf-8')
-    stderr_str = stderr.decode('utf-8')
-    stdout_str = stdout_str.replace('\r\n', '\n')
-    stderr_str = stderr_str.replace('\r\n', '\n')
-    print("STDOUT:\n")
-    print(stdout_str)
-    print("STDERR:\n")
-    print(stderr_str)
-
-    return_code = process.returncode
-    print("Return Code:", return_code)
-else:
-    print("\nSkipping subprocess call because os.system failed.")
+return_code = pythoncwms_launch.run_script(
+    python_script_path, args, job_name=job_name,
+    use_worker=use_worker, worker_preload=worker_preload,
+    worker_max_jobs=worker_max_jobs, worker_idle_timeout=worker_idle_timeout,
+    stream_output=stream_output, output_log_path=output_log_path,
+    output_log_max_mb=output_log_max_mb, output_log_backups=output_log_backups,
+    console_max_lines=console_max_lines,
+    cache_results=cache_results, cache_env_vars=cache_env_vars,
+    cache_input_files=cache_input_files, cache_output_files=cache_output_files,
+    cache_ttl_seconds=cache_ttl_seconds, cache_max_mb=cache_max_mb, cache_bypass=cache_bypass)
@@ -3,21 +3,3447 @@ import os
 import subprocess
 import threading
 import urllib
+import urllib2
+import urlparse
+import httplib
+import socket
+import time
+import Queue
+import collections
 import tempfile
 import shutil
 import hashlib
 import json
+import zipfile
 
 from javax.swing import (
     JFrame, JPanel, JLabel, JTextField, JButton, JFileChooser, JTextArea, JScrollPane,
-    JOptionPane, BorderFactory
+    JOptionPane, BorderFactory, Timer
 )
 from java.awt import (
     BorderLayout, GridLayout, Insets, FlowLayout, Dimension
 )
 from java.awt.event import ActionListener
 from java.io import File as JFile
-from javax.swing import SwingUtilities, JProgressBar # JProgressBar was missing from this specific import line
+from java.lang import Runtime
+from javax.swing import JProgressBar # JProgressBar was missing from this specific import line
+
+
+# --- Download engine ---
+# Nothing below this point touches Swing, so the engine can be driven from the
+# installer thread or from a plain script against a local test server.
+
+BYTES_PER_MB = 1024.0 * 1024.0
+
+# archive_size_mb is published rounded to two decimals, so allow that much slack
+# when comparing it against the byte counts reported by the server.
+ARCHIVE_SIZE_TOLERANCE_MB = 0.01
+
+DEFAULT_ARCHIVE_CACHE_MAX_MB = 1024
+
+
+# Verify-on-disk reads are large and block aligned; Jython has no mmap module and
+# a handful of 1 MiB reads per second keeps slow profile disks streaming.
+HASH_READ_SIZE = 1024 * 1024
+
+
+def iter_file_blocks(path, start=0, end=None, block_size=HASH_READ_SIZE):
+    """
+    Yields the bytes of path[start:end] using large reads aligned to block_size.
+    Raises IOError if the file is shorter than end.
+    """
+    position = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        # Read up to the next block boundary first so every later read is aligned.
+        read_size = block_size - (start % block_size)
+        while end is None or position < end:
+            buf = f.read(read_size if end is None else min(read_size, end - position))
+            if not buf:
+                break
+            position += len(buf)
+            read_size = block_size
+            yield buf
+    if end is not None and position < end:
+        raise IOError("{} ended at byte {} while reading up to byte {}.".format(path, position, end))
+
+
+def hash_file(path, algorithm='sha256', hasher=None, start=0, end=None, block_size=HASH_READ_SIZE):
+    """
+    Feeds path[start:end] into a hasher using large, block-aligned reads and
+    returns the hasher. Used to verify resumed or previously downloaded files.
+    """
+    if hasher is None:
+        hasher = hashlib.new(algorithm)
+    for buf in iter_file_blocks(path, start, end, block_size):
+        hasher.update(buf)
+    return hasher
+
+
+class IntegrityError(Exception):
+    """Raised when downloaded data does not match its published hash."""
+
+
+class ExtractionError(Exception):
+    """Raised when the pipelined extraction stops before the download does."""
+
+
+class StreamingHasher(object):
+    """
+    Computes a file digest while the file is still being written. Bytes fed in
+    order are hashed straight away, out-of-order pieces wait in a bounded
+    buffer, and anything that did not fit is read back from disk by sync().
+
+    When the release publishes per-chunk hashes, each chunk is also checked as
+    soon as its last byte is hashed, and on_verified_chunk receives the bytes
+    of every chunk that matched, in order. It is called without the hasher's
+    lock held, so a callback that blocks only holds back the thread that is
+    handing chunks on (and, once max_buffer_bytes of verified chunks are
+    waiting, the threads that verify more).
+    """
+
+    def __init__(self, path, algorithm='sha256', max_buffer_bytes=32 * 1024 * 1024,
+                 chunk_size=None, chunk_hashes=None, total_size=None, on_verified_chunk=None):
+        self.path = path
+        self.algorithm = algorithm
+        self.max_buffer_bytes = max_buffer_bytes
+        self.chunk_size = chunk_size
+        self.chunk_hashes = [h.lower() for h in chunk_hashes] if chunk_hashes else None
+        self.total_size = total_size
+        self.on_verified_chunk = on_verified_chunk
+        self._lock = threading.Lock()
+        self._handoff_lock = threading.Lock()
+        self._verified = collections.deque()
+        self._verified_bytes = 0
+        self._restart()
+
+    def _restart(self):
+        self._pending = {}
+        self._pending_bytes = 0
+        self.position = 0
+        self.verified_position = 0
+        self._hasher = hashlib.new(self.algorithm)
+        self._chunk_hasher = hashlib.new(self.algorithm)
+        self._chunk_filled = 0
+        self._chunk_data = []
+        self._failure = None
+
+    def _consume(self, data):
+        """Hashes the next in-order bytes of the file."""
+        if self._failure:
+            raise IntegrityError(self._failure)
+        self._hasher.update(data)
+        self.position += len(data)
+        if self.chunk_hashes:
+            self._verify_chunks(data)
+
+    def _verify_chunks(self, data):
+        while data:
+            index = self.verified_position // self.chunk_size
+            if index >= len(self.chunk_hashes):
+                self._failure = "Archive is longer than its published chunk hashes."
+                raise IntegrityError(self._failure)
+            chunk_start = index * self.chunk_size
+            chunk_length = min(self.chunk_size, self.total_size - chunk_start)
+            piece = data[:chunk_length - self._chunk_filled]
+            data = data[len(piece):]
+            self._chunk_hasher.update(piece)
+            self._chunk_filled += len(piece)
+            if self.on_verified_chunk:
+                self._chunk_data.append(piece)
+            if self._chunk_filled < chunk_length:
+                continue
+            if self._chunk_hasher.hexdigest() != self.chunk_hashes[index]:
+                self._failure = "Chunk {} (bytes {}-{}) failed SHA-256 verification.".format(
+                    index, chunk_start, chunk_start + chunk_length - 1)
+                raise IntegrityError(self._failure)
+            self.verified_position += chunk_length
+            self._chunk_hasher = hashlib.new(self.algorithm)
+            self._chunk_filled = 0
+            if self.on_verified_chunk:
+                self._verified.append("".join(self._chunk_data))
+                self._verified_bytes += chunk_length
+            self._chunk_data = []
+
+    def _hand_on_verified(self):
+        """Passes the verified chunks to on_verified_chunk in order; call it without holding _lock."""
+        while True:
+            with self._lock:
+                backlog_bytes = self._verified_bytes
+            if not backlog_bytes:
+                return
+            # One thread hands chunks on at a time. The others move on, unless the
+            # backlog is full, in which case they wait so the download is held back.
+            if not self._handoff_lock.acquire(backlog_bytes > self.max_buffer_bytes):
+                return
+            try:
+                while True:
+                    with self._lock:
+                        if not self._verified:
+                            break
+                        data = self._verified.popleft()
+                        self._verified_bytes -= len(data)
+                    self.on_verified_chunk(data)
+            finally:
+                self._handoff_lock.release()
+            # Loop: chunks verified by a thread that gave way just before the release are handed on here.
+
+    def update_at(self, offset, data):
+        """Feeds bytes that were just written at offset."""
+        with self._lock:
+            if offset == self.position:
+                self._consume(data)
+                self._drain()
+            elif offset > self.position:
+                # A retried segment sends its offsets again; count only what replaces the old piece.
+                replaced = len(self._pending.get(offset, ""))
+                if self._pending_bytes - replaced + len(data) <= self.max_buffer_bytes:
+                    self._pending[offset] = data
+                    self._pending_bytes += len(data) - replaced
+        self._hand_on_verified()
+
+    def _drain(self):
+        # Buffered pieces that now start behind the cursor were already read
+        # from disk; keep only the part (if any) that reaches past it.
+        for pending_offset in [o for o in self._pending if o < self.position]:
+            data = self._pending.pop(pending_offset)
+            self._pending_bytes -= len(data)
+            if pending_offset + len(data) > self.position:
+                tail = data[self.position - pending_offset:]
+                self._pending[self.position] = tail
+                self._pending_bytes += len(tail)
+        while self.position in self._pending:
+            data = self._pending.pop(self.position)
+            self._pending_bytes -= len(data)
+            self._consume(data)
+
+    def advance_to(self, offset):
+        """Hashes any bytes before offset that were not fed in order, reading them from disk."""
+        while True:
+            with self._lock:
+                caught_up = self.position >= offset
+                if caught_up:
+                    self._drain()
+                else:
+                    # A block at a time, so verified chunks are handed on as they complete.
+                    for buf in iter_file_blocks(self.path, self.position, min(offset, self.position + HASH_READ_SIZE)):
+                        self._consume(buf)
+            self._hand_on_verified()
+            if caught_up:
+                return
+
+    def sync(self, offset):
+        """Brings the digest to cover exactly the first offset bytes of the file."""
+        with self._lock:
+            if self.position > offset:
+                if self.on_verified_chunk and self.verified_position:
+                    # Verified chunks have already been handed on and cannot be taken back.
+                    raise IntegrityError("Download restarted after part of it was already extracted.")
+                self._restart()
+        self.advance_to(offset)
+        # Another thread may still be handing chunks on; wait for it, so all of them are when sync returns.
+        with self._handoff_lock:
+            pass
+        self._hand_on_verified()
+
+    def hexdigest(self):
+        with self._lock:
+            return self._hasher.hexdigest()
+
+
+class DownloadError(IOError):
+    """Raised when a download cannot be completed or safely resumed."""
+
+
+class HttpStatusError(DownloadError):
+    """Raised when a range request gets an unexpected HTTP status back."""
+
+    def __init__(self, status, message):
+        DownloadError.__init__(self, message)
+        self.status = status
+
+
+class StalledError(DownloadError):
+    """Raised when a transfer delivers too little data for too long."""
+
+
+class ThroughputWatchdog(object):
+    """
+    Fed with the size of every block a transfer receives; raises StalledError
+    when less than min_bytes_per_second arrived over a window of seconds. A
+    watchdog without seconds never fires.
+    """
+
+    def __init__(self, seconds, min_bytes_per_second):
+        self.seconds = seconds
+        self.min_bytes_per_second = min_bytes_per_second
+        self.window_start = time.time()
+        self.window_bytes = 0
+
+    def update(self, count):
+        if not self.seconds:
+            return
+        self.window_bytes += count
+        elapsed = time.time() - self.window_start
+        if elapsed >= self.seconds:
+            if self.window_bytes < self.min_bytes_per_second * elapsed:
+                raise StalledError("Transfer stalled at {:.1f}KB/s over {:.0f}s.".format(
+                    self.window_bytes / 1024.0 / elapsed, elapsed))
+            self.window_start += elapsed
+            self.window_bytes = 0
+
+
+class ResumableDownloader(object):
+    """
+    Downloads a URL into a partial file that survives dropped connections and
+    installer relaunches. A small JSON sidecar records how many bytes have been
+    committed to disk so the next attempt can continue with an HTTP Range request.
+
+    With connections > 1 the file is preallocated and split into byte ranges
+    that a bounded pool of worker threads fetches over keep-alive connections,
+    each writing its range at the right offset. Servers that do not support
+    ranges get a single stream instead.
+
+    The SHA-256 of the file is computed as bytes arrive and is available as
+    the sha256 attribute once download() returns. If chunk hashes are given,
+    each chunk is verified as soon as it is complete and passed, in order, to
+    on_verified_chunk; a mismatch raises IntegrityError and is not retried.
+
+    mirrors lists URLs of identical copies of the file, tried in order (url
+    itself is used when there are none). A transfer that fails, or that stays
+    below stall_min_bytes_per_second for stall_seconds while another mirror is
+    available, continues from the next mirror with the bytes already
+    committed. The file name, resume state and hashes all belong to url, not
+    to the mirror that served a particular byte. If the finished file does
+    not match expected_sha256 and some of it came from an untrusted mirror
+    (a LAN peer), it is downloaded again from the other mirrors alone.
+    """
+
+    def __init__(self, url, download_dir, expected_sha256=None, expected_size_mb=None,
+                 reporthook=None, cancel_event=None, log=None, max_retries=5,
+                 retry_delay=2.0, block_size=65536, timeout=60,
+                 state_save_interval=4 * 1024 * 1024, connections=1,
+                 segment_size=8 * 1024 * 1024, progress_interval=0.25,
+                 expected_size_bytes=None, chunk_size=None, chunk_hashes=None,
+                 on_verified_chunk=None, cache=None, mirrors=None,
+                 stall_seconds=None, stall_min_bytes_per_second=32 * 1024, untrusted=()):
+        self.url = url
+        self.download_dir = download_dir
+        self.expected_sha256 = (expected_sha256 or "").lower()
+        self.expected_size_mb = expected_size_mb
+        self.reporthook = reporthook
+        self.cancel_event = cancel_event
+        self.log = log
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.block_size = block_size
+        self.timeout = timeout
+        self.state_save_interval = state_save_interval
+        self.connections = max(1, int(connections or 1))
+        self.segment_size = segment_size
+        self.progress_interval = progress_interval
+        self.expected_size_bytes = expected_size_bytes
+        self.chunk_size = chunk_size
+        self.chunk_hashes = chunk_hashes
+        self.on_verified_chunk = on_verified_chunk
+        self.cache = cache
+        self.sources = list(mirrors) if mirrors else [url]
+        self.source_index = 0
+        # Giving up on a slow transfer only helps if there is somewhere else to go.
+        self.stall_seconds = stall_seconds if len(self.sources) > 1 else None
+        self.stall_min_bytes_per_second = stall_min_bytes_per_second
+        if self.stall_seconds:
+            self.timeout = min(timeout, self.stall_seconds)
+        self.untrusted = set(untrusted)
+        self._used_sources = set()
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors = []
+        self._bytes_done = 0
+        self._last_report_time = 0
+        self._hasher = None
+        self.sha256 = None
+        self.from_cache = False
+
+        filename = os.path.basename(urlparse.urlparse(url).path) or "pythonCWMS_download.7z"
+        self.final_path = os.path.join(download_dir, filename)
+        self.partial_path = self.final_path + ".part"
+        self.state_path = self.final_path + ".download.json"
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    def _is_cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def _new_state(self):
+        return {
+            "url": self.url,
+            "expected_sha256": self.expected_sha256,
+            "total_size": None,
+            "bytes_committed": 0,
+            "etag": None,
+            "last_modified": None,
+            "source": None,
+            "complete": False,
+            "segments": None,
+        }
+
+    @property
+    def source_url(self):
+        """The mirror the next request goes to."""
+        return self.sources[self.source_index]
+
+    def _switch_source(self, error, state):
+        """Moves on to the next mirror after a failure; committed bytes are kept."""
+        previous = self.source_url
+        self.source_index = (self.source_index + 1) % len(self.sources)
+        self._log("{} failed at {:.2f}MB ({}); continuing from {}.".format(
+            urlparse.urlparse(previous).netloc, self._committed_bytes(state) / BYTES_PER_MB, error,
+            urlparse.urlparse(self.source_url).netloc))
+
+    @staticmethod
+    def _validator(state, source):
+        """
+        The ETag or Last-Modified recorded for the partial file, if it came from
+        source. Validators from another mirror mean nothing to this one, so
+        bytes from several mirrors rely on the final hash instead.
+        """
+        if (state.get("source") or state.get("url")) != source:
+            return None
+        return state.get("etag") or state.get("last_modified")
+
+    def _load_state(self):
+        """Returns the sidecar state if it belongs to this URL and hash, else None."""
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if state.get("url") != self.url or state.get("expected_sha256") != self.expected_sha256:
+            return None
+        return state
+
+    def _save_state(self, state):
+        temp_state_path = self.state_path + ".tmp"
+        with open(temp_state_path, 'w') as f:
+            json.dump(state, f)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        os.rename(temp_state_path, self.state_path)
+
+    def _reset(self, state):
+        """Forgets any partial data so the next attempt starts from byte zero."""
+        fresh_state = self._new_state()
+        state.clear()
+        state.update(fresh_state)
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+        self._save_state(state)
+
+    def _check_total_size(self, total_size):
+        """Checks a server-reported archive size against the size published in the config."""
+        if total_size is None:
+            return
+        if self.expected_size_bytes is not None:
+            if total_size != self.expected_size_bytes:
+                raise DownloadError("Server reports {} bytes but the configuration expects {} bytes.".format(
+                    total_size, self.expected_size_bytes))
+            return
+        if not self.expected_size_mb:
+            return
+        total_mb = total_size / BYTES_PER_MB
+        if abs(total_mb - float(self.expected_size_mb)) > ARCHIVE_SIZE_TOLERANCE_MB:
+            raise DownloadError("Server reports {:.2f}MB but the configuration expects {:.2f}MB.".format(
+                total_mb, float(self.expected_size_mb)))
+
+    @staticmethod
+    def _parse_content_range(content_range):
+        """Parses 'bytes start-end/total' into (start, end, total); total may be None."""
+        try:
+            unit, byte_range = content_range.strip().split(" ", 1)
+            span, total = byte_range.split("/", 1)
+            start, end = span.split("-", 1)
+            if unit.lower() != "bytes":
+                raise ValueError(unit)
+            return int(start), int(end), (None if total == "*" else int(total))
+        except (AttributeError, ValueError):
+            raise DownloadError("Invalid Content-Range header from server: {}".format(content_range))
+
+    def _prepare_partial(self, state):
+        """Trims the partial file back to the last committed byte and returns that offset."""
+        if not os.path.exists(self.partial_path):
+            state["bytes_committed"] = 0
+            return 0
+        committed = min(state.get("bytes_committed") or 0, os.path.getsize(self.partial_path))
+        with open(self.partial_path, 'r+b') as f:
+            f.truncate(committed)
+        state["bytes_committed"] = committed
+        return committed
+
+    def _report(self, bytes_done, total_size, force=False):
+        """Forwards progress to the reporthook, at most once per progress_interval."""
+        if not self.reporthook:
+            return
+        now = time.time()
+        if not force and now - self._last_report_time < self.progress_interval:
+            return
+        self._last_report_time = now
+        self.reporthook(bytes_done // self.block_size, self.block_size, total_size or -1)
+
+    @staticmethod
+    def _committed_bytes(state):
+        if state.get("segments"):
+            return sum(segment[2] for segment in state["segments"])
+        return state.get("bytes_committed") or 0
+
+    def has_partial(self):
+        """True if an earlier attempt left committed bytes that can be resumed."""
+        state = self._load_state()
+        return bool(state and self._committed_bytes(state) and os.path.exists(self.partial_path))
+
+    def partial_size(self):
+        state = self._load_state()
+        return self._committed_bytes(state) if state else 0
+
+    def discard(self):
+        """Removes the downloaded file, any partial data and the sidecar state."""
+        for path in (self.final_path, self.partial_path, self.state_path, self.state_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def download(self):
+        """
+        Downloads (or resumes) the file and returns the path of the completed
+        download. Dropped connections are retried with Range requests; the retry
+        budget is reset whenever an attempt makes progress.
+        """
+        path = self._download()
+        with self._lock:
+            used_untrusted = [source for source in self.sources if source in self._used_sources and source in self.untrusted]
+        trusted = [source for source in self.sources if source not in self.untrusted]
+        if used_untrusted and trusted and self.expected_sha256 and self.sha256 != self.expected_sha256:
+            self._log("The download does not match its SHA-256 and part of it came from {}; downloading it again without them.".format(
+                ", ".join(urlparse.urlparse(source).netloc for source in used_untrusted)))
+            self.discard()
+            self.sources = trusted
+            self.source_index = 0
+            self._used_sources = set()
+            path = self._download()
+        return path
+
+    def _download(self):
+        if self.cache is not None and self.expected_sha256:
+            cached_path = self._from_cache()
+            if cached_path:
+                return cached_path
+
+        if not os.path.isdir(self.download_dir):
+            os.makedirs(self.download_dir)
+
+        state = self._load_state()
+        if state and state.get("complete") and os.path.exists(self.final_path):
+            self._log("Reusing previously completed download: {}".format(self.final_path))
+            self._hasher = self._new_hasher(self.final_path)
+            self._hasher.sync(os.path.getsize(self.final_path))
+            self.sha256 = self._hasher.hexdigest()
+            return self.final_path
+        self._hasher = self._new_hasher(self.partial_path)
+        if state is None:
+            state = self._new_state()
+            if os.path.exists(self.partial_path):
+                os.remove(self.partial_path)
+
+        if self.connections > 1:
+            probe = None
+            probe_error = None
+            for _ in self.sources:
+                try:
+                    probe = self._probe_ranges(self.source_url)
+                    probe_error = None
+                    break
+                except (IOError, socket.error, httplib.HTTPException), e:
+                    probe_error = e
+                    if len(self.sources) > 1:
+                        self._switch_source(e, state)
+            if probe is not None:
+                self._download_segmented(state, *probe)
+                return self._finish(state)
+            if probe_error is not None:
+                self._log("Could not check {} for byte range support ({}); downloading over a single connection.".format(
+                    "the server" if len(self.sources) == 1 else "any of the {} servers".format(len(self.sources)),
+                    probe_error))
+            else:
+                self._log("Server does not advertise byte ranges; downloading over a single connection.")
+        if state.get("segments"):
+            self._reset(state)
+
+        failures = 0
+        while True:
+            offset = self._prepare_partial(state)
+            try:
+                self._fetch(offset, state)
+                break
+            except (IOError, socket.error, httplib.HTTPException), e:
+                if self._is_cancelled():
+                    raise
+                self._save_state(state)
+                if state["bytes_committed"] > offset:
+                    failures = 0
+                failures += 1
+                if failures > self.max_retries * len(self.sources):
+                    raise DownloadError("Download failed after {} retries: {}".format(self.max_retries, e))
+                if len(self.sources) > 1:
+                    self._switch_source(e, state)
+                    if failures % len(self.sources):
+                        continue  # Wait only once every mirror has failed in a row.
+                attempt = failures // len(self.sources)
+                delay = self.retry_delay * attempt
+                self._log("Connection problem at {:.2f}MB ({}). Retrying in {:.0f}s (attempt {}/{})...".format(
+                    state["bytes_committed"] / BYTES_PER_MB, e, delay, attempt, self.max_retries))
+                time.sleep(delay)
+                if self._is_cancelled():
+                    raise IOError("Download cancelled by user.")
+
+        return self._finish(state)
+
+    def _from_cache(self):
+        """Returns the cached copy of the archive if it passes verification."""
+        cached_path = self.cache.lookup(self.expected_sha256)
+        if not cached_path:
+            return None
+        self._log("Found archive in the local cache: {}".format(cached_path))
+        try:
+            self._hasher = self._new_hasher(cached_path)
+            self._hasher.sync(os.path.getsize(cached_path))
+        except IntegrityError:
+            self.cache.remove(self.expected_sha256)
+            raise
+        if self._hasher.hexdigest() != self.expected_sha256:
+            self._log("Cached archive failed verification; removing it and downloading again.")
+            self.cache.remove(self.expected_sha256)
+            return None
+        self.sha256 = self._hasher.hexdigest()
+        self.from_cache = True
+        return cached_path
+
+    def _new_hasher(self, path):
+        return StreamingHasher(path, chunk_size=self.chunk_size, chunk_hashes=self.chunk_hashes,
+                               total_size=self.expected_size_bytes, on_verified_chunk=self.on_verified_chunk)
+
+    def _finish(self, state):
+        """Promotes the partial file to the final path and marks the state complete."""
+        self._hasher.sync(os.path.getsize(self.partial_path))
+        self.sha256 = self._hasher.hexdigest()
+        if os.path.exists(self.final_path):
+            os.remove(self.final_path)
+        os.rename(self.partial_path, self.final_path)
+        state["complete"] = True
+        self._save_state(state)
+        return self.final_path
+
+    def _fetch(self, offset, state):
+        """Makes one request starting at offset and streams it to the partial file."""
+        source = self.source_url
+        with self._lock:
+            self._used_sources.add(source)
+        request = urllib2.Request(source)
+        if offset > 0:
+            request.add_header("Range", "bytes={}-".format(offset))
+            validator = self._validator(state, source)
+            if validator:
+                # If the file changed on the server we get a full 200 response instead.
+                request.add_header("If-Range", validator)
+
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError, e:
+            if e.code == 416 and offset > 0:
+                self._reset(state)
+                raise DownloadError("Server rejected the resume range; restarting download from the beginning.")
+            raise
+
+        try:
+            headers = response.info()
+            if offset > 0 and response.getcode() == 206:
+                start, _, total_size = self._parse_content_range(headers.getheader("Content-Range"))
+                if start != offset:
+                    raise DownloadError("Server resumed at byte {} instead of {}.".format(start, offset))
+                if total_size is not None and state.get("total_size") not in (None, total_size):
+                    self._reset(state)
+                    raise DownloadError("Archive size changed on the server; restarting download.")
+                self._log("Resuming download at {:.2f}MB.".format(offset / BYTES_PER_MB))
+            else:
+                if offset > 0:
+                    self._log("Server did not honour the resume request; restarting download.")
+                    offset = 0
+                content_length = headers.getheader("Content-Length")
+                total_size = int(content_length) if content_length else None
+                state["etag"] = headers.getheader("ETag")
+                state["last_modified"] = headers.getheader("Last-Modified")
+                state["source"] = source
+
+            self._check_total_size(total_size)
+            state["total_size"] = total_size
+            state["bytes_committed"] = offset
+            self._save_state(state)
+
+            bytes_done = offset
+            last_saved = offset
+            # Bring the running hash up to the resume point (read back from disk if needed).
+            self._hasher.sync(offset)
+            watchdog = ThroughputWatchdog(self.stall_seconds, self.stall_min_bytes_per_second)
+            with open(self.partial_path, 'r+b' if offset > 0 else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                self._report(bytes_done, total_size, force=True)
+                try:
+                    while True:
+                        buf = response.read(self.block_size)
+                        if not buf:
+                            break
+                        f.write(buf)
+                        self._hasher.update_at(bytes_done, buf)
+                        bytes_done += len(buf)
+                        watchdog.update(len(buf))
+                        if bytes_done - last_saved >= self.state_save_interval:
+                            f.flush()
+                            state["bytes_committed"] = bytes_done
+                            self._save_state(state)
+                            last_saved = bytes_done
+                        self._report(bytes_done, total_size)
+                finally:
+                    f.flush()
+                    state["bytes_committed"] = bytes_done
+
+            self._report(bytes_done, total_size, force=True)
+            if total_size is not None and bytes_done != total_size:
+                raise DownloadError("Connection closed after {} of {} bytes.".format(bytes_done, total_size))
+            self._check_total_size(bytes_done)
+        finally:
+            response.close()
+
+    # --- Segmented (multi-connection) mode ---
+
+    def _probe_ranges(self, url):
+        """
+        Follows redirects and asks for the first byte to see whether the server
+        honours ranges. Returns (final_url, total_size, etag, last_modified), or
+        None when the download should fall back to a single stream.
+        """
+        if urllib.getproxies().get(urlparse.urlparse(url).scheme):
+            # The keep-alive workers talk to the server directly, which a proxy would not allow.
+            return None
+        request = urllib2.Request(url)
+        request.add_header("Range", "bytes=0-0")
+        response = urllib2.urlopen(request, timeout=self.timeout)
+        try:
+            headers = response.info()
+            accept_ranges = (headers.getheader("Accept-Ranges") or "").strip().lower()
+            if response.getcode() == 206:
+                total_size = self._parse_content_range(headers.getheader("Content-Range"))[2]
+            elif accept_ranges == "bytes" and headers.getheader("Content-Length"):
+                total_size = int(headers.getheader("Content-Length"))
+            else:
+                return None
+            if not total_size:
+                return None
+            return response.geturl(), total_size, headers.getheader("ETag"), headers.getheader("Last-Modified")
+        finally:
+            response.close()
+
+    def _download_segmented(self, state, final_url, total_size, etag, last_modified):
+        """Fetches all unfinished byte ranges on a pool of worker threads."""
+        self._check_total_size(total_size)
+        recorded_etag = state.get("etag") if self._validator(state, self.source_url) else None
+        if (not state.get("segments") or state.get("total_size") != total_size or
+                (etag and recorded_etag and etag != recorded_etag) or
+                not os.path.exists(self.partial_path)):
+            if state.get("segments"):
+                self._log("Partial download does not match the server copy; starting over.")
+            self._reset(state)
+            state["total_size"] = total_size
+            state["segments"] = [[start, min(start + self.segment_size, total_size) - 1, 0]
+                                 for start in xrange(0, total_size, self.segment_size)]
+            with open(self.partial_path, 'wb') as f:
+                f.truncate(total_size)
+        state["etag"] = etag
+        state["last_modified"] = last_modified
+        state["source"] = self.source_url
+        self._save_state(state)
+
+        segments = state["segments"]
+        pending = Queue.Queue()
+        for index, segment in enumerate(segments):
+            if segment[2] < segment[1] - segment[0] + 1:
+                pending.put(index)
+        self._bytes_done = self._committed_bytes(state)
+        if self._bytes_done:
+            self._log("Resuming download at {:.2f}MB over {} connections.".format(self._bytes_done / BYTES_PER_MB, self.connections))
+        else:
+            self._log("Downloading {:.2f}MB over {} connections.".format(total_size / BYTES_PER_MB, self.connections))
+
+        self._stop.clear()
+        del self._errors[:]
+        workers = []
+        for _ in xrange(min(self.connections, pending.qsize())):
+            worker = threading.Thread(target=self._segment_worker, args=(self.source_index, final_url, pending, state))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        # Only this thread talks to the reporthook, so progress from every
+        # worker is combined into one throttled stream of updates.
+        last_saved = time.time()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(self.progress_interval)
+                self._report(self._bytes_done, total_size, force=True)
+                # Keep the hash cursor (and chunk verification) moving even when
+                # ranges finish out of order and overflow the in-memory buffer.
+                self._hasher.advance_to(self._contiguous_committed(state))
+                if time.time() - last_saved >= 1.0:
+                    with self._lock:
+                        self._save_state(state)
+                    last_saved = time.time()
+        except:
+            self._stop.set()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+            self._save_state(state)
+
+        if self._errors:
+            raise self._errors[0]
+        if self._is_cancelled():
+            raise IOError("Download cancelled by user.")
+        self._report(total_size, total_size, force=True)
+
+    @staticmethod
+    def _contiguous_committed(state):
+        """Number of bytes from the start of the file that are committed without gaps."""
+        contiguous = 0
+        for start, end, committed in state["segments"]:
+            contiguous += committed
+            if committed < end - start + 1:
+                break
+        return contiguous
+
+    def _open_connection(self, url):
+        parsed = urlparse.urlparse(url)
+        connection_class = httplib.HTTPSConnection if parsed.scheme == "https" else httplib.HTTPConnection
+        return connection_class(parsed.hostname, parsed.port, timeout=self.timeout)
+
+    def _next_segment_source(self, source_index, url, error, segment, state):
+        """
+        Returns (source_index, url) for a worker whose mirror failed: the next
+        mirror that serves ranges of a file with the same size, or the failed
+        one asked again (signed redirect targets expire), or, if no mirror
+        answers, the same ones as before.
+        """
+        for step in xrange(1, len(self.sources) + 1):
+            candidate = (source_index + step) % len(self.sources)
+            try:
+                probe = self._probe_ranges(self.sources[candidate])
+            except (IOError, socket.error, httplib.HTTPException):
+                continue
+            if probe is None or probe[1] != state["total_size"]:
+                continue
+            if candidate != source_index:
+                self._log("{} failed in range starting at {:.2f}MB ({}); continuing from {}.".format(
+                    urlparse.urlparse(self.sources[source_index]).netloc, segment[0] / BYTES_PER_MB, error,
+                    urlparse.urlparse(self.sources[candidate]).netloc))
+            return candidate, probe[0]
+        return source_index, url
+
+    def _segment_worker(self, source_index, url, pending, state):
+        """
+        Pulls segment indexes off the queue and fetches them over one kept-alive
+        connection to the mirror at source_index (url is where it redirected to).
+        """
+        connection = None
+        try:
+            while not self._stop.is_set() and not self._is_cancelled():
+                try:
+                    index = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                segment = state["segments"][index]
+                failures = 0
+                while True:
+                    committed_before = segment[2]
+                    try:
+                        if connection is None:
+                            connection = self._open_connection(url)
+                        with self._lock:
+                            self._used_sources.add(self.sources[source_index])
+                        self._fetch_segment(connection, url, segment, state,
+                                            self._validator(state, self.sources[source_index]))
+                        break
+                    except (IOError, socket.error, httplib.HTTPException), e:
+                        if connection is not None:
+                            connection.close()
+                            connection = None
+                        if self._stop.is_set() or self._is_cancelled():
+                            return
+                        if segment[2] > committed_before:
+                            failures = 0
+                        failures += 1
+                        if failures > self.max_retries * len(self.sources):
+                            self._errors.append(DownloadError("Download failed after {} retries: {}".format(self.max_retries, e)))
+                            self._stop.set()
+                            return
+                        if len(self.sources) > 1 or isinstance(e, HttpStatusError):
+                            source_index, url = self._next_segment_source(source_index, url, e, segment, state)
+                            if failures % len(self.sources):
+                                continue  # Wait only once every mirror has failed in a row.
+                        attempt = failures // len(self.sources)
+                        delay = self.retry_delay * attempt
+                        self._log("Connection problem in range starting at {:.2f}MB ({}). Retrying in {:.0f}s (attempt {}/{})...".format(
+                            segment[0] / BYTES_PER_MB, e, delay, attempt, self.max_retries))
+                        time.sleep(delay)
+        except Exception, e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _fetch_segment(self, connection, url, segment, state, validator=None):
+        """
+        Requests the unfinished part of one segment and writes it at its offset;
+        validator (an ETag or date) makes the server refuse a changed file.
+        """
+        start, end = segment[0], segment[1]
+        offset = start + segment[2]
+        parsed = urlparse.urlparse(url)
+        path = parsed.path + ("?" + parsed.query if parsed.query else "")
+        headers = {"Range": "bytes={}-{}".format(offset, end)}
+        if validator:
+            headers["If-Range"] = validator
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        if response.status != 206:
+            raise HttpStatusError(response.status, "Expected a partial response for bytes {}-{} but got HTTP {}.".format(offset, end, response.status))
+        range_start, range_end, total_size = self._parse_content_range(response.getheader("Content-Range"))
+        if range_start != offset or range_end != end or total_size not in (None, state["total_size"]):
+            raise DownloadError("Server returned bytes {}-{} of {} instead of {}-{}.".format(range_start, range_end, total_size, offset, end))
+
+        written = offset
+        committed = offset
+        watchdog = ThroughputWatchdog(self.stall_seconds, self.stall_min_bytes_per_second)
+        with open(self.partial_path, 'r+b') as f:
+            f.seek(offset)
+            try:
+                while written <= end:
+                    if self._stop.is_set() or self._is_cancelled():
+                        raise IOError("Download cancelled by user.")
+                    buf = response.read(min(self.block_size, end - written + 1))
+                    if not buf:
+                        break
+                    f.write(buf)
+                    self._hasher.update_at(written, buf)
+                    written += len(buf)
+                    with self._lock:
+                        self._bytes_done += len(buf)
+                    watchdog.update(len(buf))
+                    if written - committed >= self.state_save_interval:
+                        f.flush()
+                        with self._lock:
+                            segment[2] += written - committed
+                        committed = written
+            finally:
+                f.flush()
+                with self._lock:
+                    segment[2] += written - committed
+        if written <= end:
+            raise DownloadError("Connection closed after {} of {} bytes in range starting at {}.".format(
+                written - start, end - start + 1, start))
+
+
+class ArchiveCache(object):
+    """
+    Content-addressed store of verified archives keyed by their SHA-256. It can
+    live on the local machine or on a shared (UNC) path: entries are copied to
+    a unique temporary name and renamed into place, so concurrent installers
+    never see a half-written archive. Hits refresh the entry's modification
+    time, and the least recently used entries are evicted once the cache grows
+    past max_bytes.
+    """
+
+    ENTRY_SUFFIX = ".archive"
+    LOCK_NAME = ".evict.lock"
+    STALE_SECONDS = 24 * 60 * 60
+    STALE_LOCK_SECONDS = 10 * 60
+
+    def __init__(self, root, max_bytes, log=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.log = log
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    def entry_path(self, sha256):
+        return os.path.join(self.root, sha256.lower() + self.ENTRY_SUFFIX)
+
+    def lookup(self, sha256):
+        """Returns the cached archive for sha256 (marking it recently used), or None."""
+        path = self.entry_path(sha256)
+        if not os.path.isfile(path):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass  # Read-only share; the entry is still usable.
+        return path
+
+    def remove(self, sha256):
+        """Drops an entry, e.g. one that failed verification."""
+        try:
+            os.remove(self.entry_path(sha256))
+        except OSError:
+            pass
+
+    def store(self, source_path, sha256):
+        """Copies a verified archive into the cache and evicts old entries. Returns the entry path."""
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        path = self.entry_path(sha256)
+        if os.path.exists(path):
+            return self.lookup(sha256)
+        fd, temp_path = tempfile.mkstemp(prefix="." + sha256.lower()[:16] + "-", suffix=".tmp", dir=self.root)
+        os.close(fd)
+        try:
+            with open(source_path, 'rb') as source:
+                with open(temp_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, HASH_READ_SIZE)
+            if not os.path.exists(path):
+                os.rename(temp_path, path)
+        except OSError:
+            # Another installer renamed the same archive into place first.
+            if not os.path.exists(path):
+                raise
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict(keep=path)
+        return path
+
+    def _acquire_lock(self):
+        lock_path = os.path.join(self.root, self.LOCK_NAME)
+        for _ in range(2):
+            try:
+                os.mkdir(lock_path)
+                return lock_path
+            except OSError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > self.STALE_LOCK_SECONDS:
+                        os.rmdir(lock_path)
+                        continue
+                except OSError:
+                    pass
+                return None
+        return None
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        lock_path = self._acquire_lock()
+        if lock_path is None:
+            return  # Another installer is evicting right now.
+        try:
+            entries = []
+            now = time.time()
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                try:
+                    stat = os.stat(path)
+                    if name.endswith(".tmp") and now - stat.st_mtime > self.STALE_SECONDS:
+                        os.remove(path)  # Left behind by an installer that was killed mid-copy.
+                    elif name.endswith(self.ENTRY_SUFFIX):
+                        entries.append((stat.st_mtime, stat.st_size, path))
+                except OSError:
+                    pass
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total_bytes -= size
+                    self._log("Evicted {} from the archive cache.".format(os.path.basename(path)))
+                except OSError:
+                    pass  # Still open in another installer; try again next time.
+        finally:
+            try:
+                os.rmdir(lock_path)
+            except OSError:
+                pass
+
+
+# How often a feed() waiting on a full extraction queue checks whether extraction stopped.
+EXTRACTOR_FEED_POLL_SECONDS = 0.5
+
+
+class StreamingExtractor(object):
+    """
+    Unpacks a tar.xz archive with 7-Zip while it is still downloading. Verified
+    chunks are queued by feed() and written to a '7z x -txz -so' decoder whose
+    output is pumped into a '7z x -ttar' unpacker. The queue is bounded, so a
+    slow extraction holds back the download instead of filling memory; a
+    feed() waiting on it gives up when extraction fails, is aborted or
+    cancel_event is set.
+    """
+
+    def __init__(self, seven_z_exe_path, destination_dir, max_queued_chunks=16, cancel_event=None):
+        self.seven_z_exe_path = seven_z_exe_path
+        self.destination_dir = destination_dir
+        self.cancel_event = cancel_event
+        self._queue = Queue.Queue(max_queued_chunks)
+        self._decoder = None
+        self._unpacker = None
+        self._threads = []
+        self._errors = []
+        self._decoder_stderr = []
+        self._unpacker_stderr = []
+        self._aborted = threading.Event()
+
+    def start(self):
+        self._decoder = subprocess.Popen([self.seven_z_exe_path, "x", "-txz", "-si", "-so"],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE, shell=False)
+        self._unpacker = subprocess.Popen([self.seven_z_exe_path, "x", "-ttar", "-si",
+                                           "-o{}".format(self.destination_dir), "-y"],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.PIPE, shell=False)
+        # stderr is drained as it is written: a 7-Zip blocked on a full error
+        # pipe (one line per locked file) would stop reading its input and
+        # stall the whole pipeline.
+        for target, target_args in ((self._feed_decoder, ()), (self._pump_decoder_output, ()),
+                                    (self._drain_unpacker_output, ()),
+                                    (self._drain_error_output, (self._decoder, self._decoder_stderr)),
+                                    (self._drain_error_output, (self._unpacker, self._unpacker_stderr))):
+            thread = threading.Thread(target=target, args=target_args)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _check_running(self):
+        if self._errors or self._aborted.is_set():
+            raise ExtractionError("Extraction stopped: {}".format(self._errors[0] if self._errors else "aborted"))
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ExtractionError("Extraction stopped: cancelled")
+
+    def feed(self, data):
+        """Queues verified archive bytes for extraction (blocks while the queue is full)."""
+        while True:
+            self._check_running()
+            try:
+                self._queue.put(data, timeout=EXTRACTOR_FEED_POLL_SECONDS)
+                return
+            except Queue.Full:
+                pass
+
+    def _feed_decoder(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                if not self._errors and not self._aborted.is_set():
+                    self._decoder.stdin.write(data)
+        except Exception, e:
+            self._errors.append(e)
+            # Keep emptying the queue so a blocked feed() call can return and see the error.
+            while self._queue.get() is not None:
+                pass
+        finally:
+            try:
+                self._decoder.stdin.close()
+            except Exception:
+                pass
+
+    def _pump_decoder_output(self):
+        unpacking = True
+        try:
+            while True:
+                buf = self._decoder.stdout.read(HASH_READ_SIZE)
+                if not buf:
+                    break
+                if not unpacking:
+                    continue
+                try:
+                    self._unpacker.stdin.write(buf)
+                except Exception, e:
+                    # The unpacker has stopped (e.g. a full disk). Keep reading the
+                    # decoder so it never blocks on its output and the feed thread
+                    # can keep emptying the queue.
+                    self._errors.append(e)
+                    unpacking = False
+        except Exception, e:
+            self._errors.append(e)
+        finally:
+            try:
+                self._unpacker.stdin.close()
+            except Exception:
+                pass
+
+    def _drain_unpacker_output(self):
+        while self._unpacker.stdout.read(HASH_READ_SIZE):
+            pass
+
+    def _drain_error_output(self, process, output):
+        while True:
+            buf = process.stderr.read(HASH_READ_SIZE)
+            if not buf:
+                break
+            output.append(buf)
+
+    def finish(self):
+        """
+        Signals the end of the archive and waits for 7-Zip. Returns a
+        (return_code, error_output) tuple; return_code is 0 on success.
+        """
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        decoder_code = self._decoder.wait()
+        unpacker_code = self._unpacker.wait()
+        stderr_output = "".join(self._decoder_stderr + self._unpacker_stderr).decode('utf-8', 'ignore')
+        if self._errors:
+            stderr_output += "\n".join(str(e) for e in self._errors)
+        return (decoder_code or unpacker_code or (1 if self._errors else 0)), stderr_output
+
+    def abort(self):
+        """Stops both 7-Zip processes; used when verification or the download fails."""
+        self._aborted.set()
+        for process in (self._decoder, self._unpacker):
+            if process is not None and process.poll() is None:
+                try:
+                    process.terminate()
+                except Exception:
+                    pass
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(None)
+        except Queue.Full:
+            pass
+
+
+# --- Mirrors ---
+# A release can be published on more than one server. "mirrors" in the config
+# lists base URLs that host the release files under the same names ({version}
+# is replaced with the release version) and "config_mirrors" lists copies of
+# the config itself. Before a download every copy is probed in parallel and
+# they are tried fastest first; ResumableDownloader moves on to the next one
+# when a transfer fails or stalls. Whichever server sent a byte, the file is
+# still checked against the SHA-256 published in the config.
+
+MIRROR_PROBE_BYTES = 256 * 1024
+MIRROR_PROBE_TIMEOUT = 5
+# A mirror delivering less than this for MIRROR_STALL_SECONDS is abandoned for the next one.
+MIRROR_STALL_SECONDS = 15
+MIRROR_STALL_MIN_BYTES_PER_SECOND = 32 * 1024
+
+
+def mirror_urls(url, mirrors, version=None):
+    """Returns url followed by the file of the same name on each mirror, without duplicates."""
+    filename = os.path.basename(urlparse.urlparse(url).path)
+    urls = [url]
+    for base in mirrors or []:
+        if not base or not filename:
+            continue
+        if version is not None:
+            base = base.replace("{version}", str(version))
+        candidate = base.rstrip("/") + "/" + filename
+        if candidate not in urls:
+            urls.append(candidate)
+    return urls
+
+
+def probe_mirror(url, probe_bytes=MIRROR_PROBE_BYTES, timeout=MIRROR_PROBE_TIMEOUT):
+    """
+    Reads up to the first probe_bytes of url. Returns a dict with the url, the
+    latency (seconds until the response headers arrived), the rate of the
+    body that followed in bytes per second, and the error if the probe failed.
+    """
+    result = {"url": url, "latency": None, "bytes_per_second": None, "error": None}
+    request = urllib2.Request(url)
+    request.add_header("Range", "bytes=0-{}".format(probe_bytes - 1))
+    started = time.time()
+    try:
+        response = urllib2.urlopen(request, timeout=timeout)
+        try:
+            result["latency"] = time.time() - started
+            received = 0
+            # A server that ignores the range sends the whole file; stop after probe_bytes.
+            while received < probe_bytes and time.time() - started < timeout:
+                buf = response.read(min(65536, probe_bytes - received))
+                if not buf:
+                    break
+                received += len(buf)
+            elapsed = time.time() - started - result["latency"]
+            if received:
+                result["bytes_per_second"] = received / max(elapsed, 0.001)
+        finally:
+            response.close()
+    except (IOError, socket.error, httplib.HTTPException), e:
+        result["error"] = e
+    return result
+
+
+def probe_mirrors(urls, probe_bytes=MIRROR_PROBE_BYTES, timeout=MIRROR_PROBE_TIMEOUT):
+    """Probes every URL on its own thread; returns the results in the order of urls."""
+    results = [None] * len(urls)
+
+    def probe(index):
+        results[index] = probe_mirror(urls[index], probe_bytes, timeout)
+
+    threads = [threading.Thread(target=probe, args=(index,)) for index in xrange(len(urls))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    deadline = time.time() + 2 * timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.time()))
+    return [result if result is not None else
+            {"url": url, "latency": None, "bytes_per_second": None, "error": socket.timeout("no answer")}
+            for url, result in zip(urls, results)]
+
+
+def rank_mirrors(probes, size_bytes=None):
+    """
+    Orders probe results fastest first: by latency plus the time to transfer
+    size_bytes at the probed rate, or by latency alone when the size is not
+    known. Mirrors that failed the probe keep their order at the end, as a
+    last resort.
+    """
+    def sort_key(probe):
+        if not size_bytes:
+            return (0, probe["latency"])
+        if not probe["bytes_per_second"]:
+            return (1, probe["latency"])
+        return (0, probe["latency"] + size_bytes / probe["bytes_per_second"])
+
+    reachable = sorted((probe for probe in probes if probe["error"] is None), key=sort_key)
+    return reachable + [probe for probe in probes if probe["error"] is not None]
+
+
+# --- LAN peers ---
+# Machines that already hold a verified archive can share it with installers on
+# the same network (python_scripts/pythoncwms_peer.py, started after an install
+# when "peer_sharing" is on). Peers are found with a discovery datagram sent to
+# the local subnet and through the "peers" list in the config, and are tried
+# before any mirror. To the downloader a peer is just another mirror, so its
+# data is verified against the published SHA-256 like everything else.
+
+PEER_PORT = 8737
+PEER_DISCOVERY_GROUP = "239.255.67.77"
+PEER_DISCOVERY_TIMEOUT = 1.0
+# A shared peer exits after this long without requests, e.g. once a rollout is over.
+PEER_IDLE_TIMEOUT = 8 * 60 * 60
+
+
+def peer_archive_url(host, port, sha256):
+    return "http://{}:{}/archive/{}".format(host, port, sha256.lower())
+
+
+def configured_peer_urls(peers, sha256, port=PEER_PORT):
+    """URLs of the archive on each "host" or "host:port" in peers."""
+    urls = []
+    for peer in peers or []:
+        host, _, peer_port = str(peer).strip().partition(":")
+        if not host:
+            continue
+        url = peer_archive_url(host, int(peer_port) if peer_port.isdigit() else port, sha256)
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def discover_peers(sha256, port=PEER_PORT, timeout=PEER_DISCOVERY_TIMEOUT, addresses=None):
+    """
+    Asks the local network who holds the archive with this hash, by multicast
+    and broadcast (neither leaves the subnet). Returns the URLs of the archive
+    on every peer that answered within timeout.
+    """
+    sha256 = sha256.lower()
+    if addresses is None:
+        addresses = [(PEER_DISCOVERY_GROUP, port), ("<broadcast>", port)]
+    urls = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        except socket.error:
+            pass  # Multicast still works.
+        for address in addresses:
+            try:
+                sock.sendto("pythonCWMS-discover {}".format(sha256), address)
+            except socket.error:
+                pass
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, address = sock.recvfrom(512)
+            except socket.timeout:
+                break
+            parts = data.split()
+            if len(parts) == 3 and parts[0] == "pythonCWMS-have" and parts[1] == sha256 and parts[2].isdigit():
+                url = peer_archive_url(address[0], int(parts[2]), sha256)
+                if url not in urls:
+                    urls.append(url)
+    finally:
+        sock.close()
+    return urls
+
+
+# --- Archive variants ---
+# A release can publish the same tree in several formats (archive_variants in
+# the config): the LZMA2 .7z is the smallest, a Deflate .zip is larger but
+# decodes several times faster. build_scripts/archive_benchmark.py measures how
+# long 7-Zip takes to extract each one, and the installer downloads the variant
+# with the lowest estimated download-plus-extract time.
+
+SEVEN_ZIP_ARCHIVE_FORMATS = ("7z", "zip")
+# Formats ParallelZipExtractor handles without 7z.exe
+BUILTIN_ARCHIVE_FORMATS = ("zip",)
+DEFAULT_EXPECTED_DOWNLOAD_MBPS = 100
+
+
+def estimated_install_seconds(entry, bytes_per_second, pipelined=False):
+    """
+    Download plus extraction time of an archive_variants or streaming_archive
+    entry, or None if the release did not measure its extraction time. A
+    pipelined install extracts while downloading, so the slower of the two wins.
+    """
+    if entry.get("extract_seconds") is None:
+        return None
+    download_seconds = float(entry["size_bytes"]) / bytes_per_second
+    if pipelined:
+        return max(download_seconds, float(entry["extract_seconds"]))
+    return download_seconds + float(entry["extract_seconds"])
+
+
+def choose_archive_variant(variants, bytes_per_second, is_cached=None, formats=SEVEN_ZIP_ARCHIVE_FORMATS):
+    """
+    Returns the archive_variants entry to download: one that is already cached
+    if there is one, otherwise the fastest estimated install. Entries in other
+    formats or that lack a URL, hash or size are skipped; measured entries are
+    preferred over unmeasured ones. Returns None if none is usable.
+    """
+    usable = []
+    for variant in variants or []:
+        try:
+            if variant.get("format") not in formats or not variant.get("url") or \
+               len(variant.get("sha256") or "") != 64 or int(variant["size_bytes"]) <= 0:
+                continue
+        except (AttributeError, KeyError, TypeError, ValueError):
+            continue
+        if is_cached is not None and is_cached(variant["sha256"]):
+            return variant
+        usable.append(variant)
+    if not usable:
+        return None
+
+    def sort_key(variant):
+        estimate = estimated_install_seconds(variant, bytes_per_second)
+        return (estimate is None, estimate if estimate is not None else int(variant["size_bytes"]))
+    return sorted(usable, key=sort_key)[0]
+
+
+# --- Built-in zip extraction ---
+# Zip archives are extracted in-process: every entry can be read on its own, and
+# Jython threads run in parallel, so a pool of threads inflates and writes files
+# at disk speed instead of going through 7z.exe and its console output.
+
+def zip_member_path(root, name):
+    """Maps a zip entry name under root, rejecting names that would escape it."""
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or name.startswith("/") or ":" in parts[0] or ".." in parts:
+        raise ExtractionError("Unsafe path in archive: {}".format(name))
+    return os.path.join(root, *parts)
+
+
+class ParallelZipExtractor(object):
+    """
+    Extracts a zip archive (or only the given members) into destination_dir.
+    All directories are created up front in one pass, then worker threads take
+    files largest first, inflate them in block_size reads and write them out;
+    zipfile checks each file's CRC as it is read. progress(bytes_done,
+    total_bytes, files_done, total_files) is called from the calling thread at
+    most every progress_interval seconds. The first error, or cancel_event,
+    stops all workers.
+    """
+
+    def __init__(self, archive_path, destination_dir, workers=None, cancel_event=None, progress=None,
+                 members=None, progress_interval=0.25, block_size=1024 * 1024):
+        self.archive_path = archive_path
+        self.destination_dir = destination_dir
+        self.workers = workers or min(8, max(2, Runtime.getRuntime().availableProcessors()))
+        self.cancel_event = cancel_event
+        self.progress = progress
+        self.members = set(members) if members is not None else None
+        self.progress_interval = progress_interval
+        self.block_size = block_size
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors = []
+        self.bytes_done = 0
+        self.files_done = 0
+        self.total_bytes = 0
+        self.total_files = 0
+
+    def _is_cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def _plan(self, archive):
+        """Returns (directories, [(zip info, target path)]) for the entries to extract."""
+        directories = set()
+        files = []
+        for info in archive.infolist():
+            name = info.filename.replace("\\", "/")
+            if self.members is not None and name.rstrip("/") not in self.members:
+                continue
+            target = zip_member_path(self.destination_dir, name)
+            if name.endswith("/"):
+                directories.add(target)
+            else:
+                directories.add(os.path.dirname(target))
+                files.append((info, target))
+        if self.members is not None and len(files) < len(self.members):
+            found = set(info.filename.replace("\\", "/") for info, _ in files)
+            missing = sorted(self.members - found)
+            raise ExtractionError("{} files missing from the archive, e.g. {}".format(len(missing), missing[0]))
+        return directories, files
+
+    def _make_directories(self, directories):
+        # Sorted, so each parent exists before its children and is created only once.
+        for directory in sorted(directories):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    def _extract_file(self, archive, info, target):
+        source = archive.open(info)
+        try:
+            with open(target, 'wb') as f:
+                while True:
+                    if self._stop.is_set() or self._is_cancelled():
+                        return
+                    data = source.read(self.block_size)
+                    if not data:
+                        break
+                    f.write(data)
+                    with self._lock:
+                        self.bytes_done += len(data)
+        finally:
+            source.close()
+        modified = time.mktime(info.date_time + (0, 0, -1))
+        os.utime(target, (modified, modified))
+        with self._lock:
+            self.files_done += 1
+
+    def _worker(self, archive, pending):
+        try:
+            while not self._stop.is_set() and not self._is_cancelled():
+                try:
+                    info, target = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                self._extract_file(archive, info, target)
+        except Exception, e:
+            with self._lock:
+                self._errors.append(e)
+            self._stop.set()
+
+    def _report(self):
+        if self.progress:
+            self.progress(self.bytes_done, self.total_bytes, self.files_done, self.total_files)
+
+    def extract(self):
+        """Extracts the archive; returns (files, bytes) written."""
+        # Opened by name, so each ZipFile.open() gets its own file handle and the
+        # workers can read different entries at the same time.
+        archive = zipfile.ZipFile(self.archive_path, 'r')
+        try:
+            directories, files = self._plan(archive)
+            self.total_files = len(files)
+            self.total_bytes = sum(info.file_size for info, _ in files)
+            self._make_directories(directories)
+
+            pending = Queue.Queue()
+            for item in sorted(files, key=lambda item: -item[0].file_size):
+                pending.put(item)
+            threads = [threading.Thread(target=self._worker, args=(archive, pending))
+                       for _ in range(min(self.workers, len(files)) or 1)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(self.progress_interval)
+                    self._report()
+            self._report()
+        finally:
+            archive.close()
+
+        if self._is_cancelled():
+            raise Exception("Installation cancelled.")
+        if self._errors:
+            error = self._errors[0]
+            if isinstance(error, ExtractionError):
+                raise error
+            raise ExtractionError("Could not extract {}: {}".format(os.path.basename(self.archive_path), error))
+        return self.files_done, self.bytes_done
+
+
+# --- Delta updates and in-place upgrades ---
+# Every release ships pythonCWMS_manifest.json (path -> size and SHA-256 of each
+# file) inside its top-level folder, and publishes a delta pack: a zip of the
+# files that changed since the previous release. An installation that still has
+# the previous manifest can be brought up to date from the pack alone; any other
+# existing installation is upgraded by extracting only the files that differ.
+
+MANIFEST_NAME = "pythonCWMS_manifest.json"
+FILE_INDEX_NAME = ".pythonCWMS_file_index.json"
+STAGING_DIR_NAME = ".pythonCWMS_staging"
+BACKUP_DIR_NAME = ".pythonCWMS_backup"
+
+
+def manifest_local_path(root, relative_path):
+    """Maps a manifest path (forward slashes) under root, rejecting paths that would escape it."""
+    parts = relative_path.split("/")
+    if not relative_path or relative_path.startswith("/") or "\\" in relative_path or \
+       ":" in relative_path or ".." in parts or "" in parts:
+        raise IntegrityError("Unsafe path in manifest: {}".format(relative_path))
+    return os.path.join(root, *parts)
+
+
+def load_manifest(path):
+    """Returns the manifest stored at path, or None if it is missing or unreadable."""
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("files"), dict):
+        return None
+    return manifest
+
+
+def fetch_manifest(url, expected_sha256=None, timeout=60):
+    """Downloads and verifies a release manifest."""
+    response = urllib2.urlopen(url, timeout=timeout)
+    try:
+        data = response.read()
+    finally:
+        response.close()
+    if expected_sha256 and hashlib.sha256(data).hexdigest().lower() != expected_sha256.lower():
+        raise IntegrityError("Manifest hash mismatch for {}".format(url))
+    manifest = json.loads(data)
+    if not isinstance(manifest.get("files"), dict):
+        raise ValueError("Manifest {} has no file list.".format(url))
+    return manifest
+
+
+def manifest_diff(old_manifest, new_manifest):
+    """Returns (changed, removed): paths whose content differs or is new, and paths that are gone."""
+    old_files = old_manifest["files"]
+    new_files = new_manifest["files"]
+    changed = sorted(path for path, entry in new_files.items()
+                     if old_files.get(path, {}).get("sha256", "").lower() != entry["sha256"].lower())
+    removed = sorted(path for path in old_files if path not in new_files)
+    return changed, removed
+
+
+def plan_delta_update(installed_manifest, new_manifest, root):
+    """
+    Returns (changed, removed) for moving the tree under root from
+    installed_manifest to new_manifest. Files the delta pack does not carry
+    must already be in place; a missing file or one with the wrong size
+    raises IntegrityError, since only a full install can repair it.
+    """
+    changed, removed = manifest_diff(installed_manifest, new_manifest)
+    changed_paths = set(changed)
+    for relative_path, entry in new_manifest["files"].items():
+        if relative_path in changed_paths:
+            continue
+        try:
+            size = os.path.getsize(manifest_local_path(root, relative_path))
+        except OSError:
+            raise IntegrityError("{} is missing from the installation.".format(relative_path))
+        if size != entry["size"]:
+            raise IntegrityError("{} is {} bytes, expected {}.".format(relative_path, size, entry["size"]))
+    return changed, removed
+
+
+class StagedUpdate(object):
+    """
+    Replaces and removes files of an installed tree with rollback. New files
+    are written to a staging directory inside the tree (same volume, so every
+    move is a rename). commit() first moves each file it replaces or removes
+    into a backup directory and puts them all back if any step fails.
+    """
+
+    def __init__(self, root, cancel_event=None):
+        self.root = root
+        self.cancel_event = cancel_event
+        self.staging_dir = os.path.join(root, STAGING_DIR_NAME)
+        self.backup_dir = os.path.join(root, BACKUP_DIR_NAME)
+        self.rollback_errors = []
+        self._staged = []
+        self._moves = []  # [relative_path, backed_up, installed]
+
+    @staticmethod
+    def _make_parent(path):
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+
+    def begin(self):
+        self.cleanup()  # Leftovers of an update that was killed part way.
+        os.makedirs(self.staging_dir)
+
+    def stage(self, relative_path, source, expected_sha256=None):
+        """Copies the file object source into the staging area and checks its hash."""
+        path = manifest_local_path(self.staging_dir, relative_path)
+        self._make_parent(path)
+        hasher = hashlib.sha256()
+        with open(path, 'wb') as target:
+            while True:
+                buf = source.read(HASH_READ_SIZE)
+                if not buf:
+                    break
+                hasher.update(buf)
+                target.write(buf)
+        if expected_sha256 and hasher.hexdigest().lower() != expected_sha256.lower():
+            raise IntegrityError("{} does not match its manifest hash.".format(relative_path))
+        self._staged.append(relative_path)
+
+    def verify_staged(self, relative_path, expected_sha256):
+        """Accepts a file another tool (7-Zip) already wrote into the staging area, after checking its hash."""
+        path = manifest_local_path(self.staging_dir, relative_path)
+        if not os.path.isfile(path):
+            raise IntegrityError("{} was not extracted from the archive.".format(relative_path))
+        if hash_file(path).hexdigest().lower() != expected_sha256.lower():
+            raise IntegrityError("{} does not match its manifest hash.".format(relative_path))
+        self._staged.append(relative_path)
+
+    def stage_extracted(self):
+        """
+        Accepts every file extracted into the staging area, for a whole
+        release archive whose hash was already checked. Returns the number of
+        files.
+        """
+        for dirpath, _, filenames in os.walk(self.staging_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                self._staged.append(os.path.relpath(path, self.staging_dir).replace(os.sep, "/"))
+        return len(self._staged)
+
+    def _move_to_backup(self, relative_path):
+        path = manifest_local_path(self.root, relative_path)
+        if not os.path.exists(path):
+            return False
+        backup_path = manifest_local_path(self.backup_dir, relative_path)
+        self._make_parent(backup_path)
+        os.rename(path, backup_path)
+        return True
+
+    def commit(self, removed=()):
+        """Swaps the staged files in and removes the given paths, rolling back on failure."""
+        try:
+            for relative_path in self._staged:
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    raise Exception("Installation cancelled.")
+                move = [relative_path, self._move_to_backup(relative_path), False]
+                self._moves.append(move)
+                target = manifest_local_path(self.root, relative_path)
+                self._make_parent(target)
+                os.rename(manifest_local_path(self.staging_dir, relative_path), target)
+                move[2] = True
+            for relative_path in removed:
+                if self._move_to_backup(relative_path):
+                    self._moves.append([relative_path, True, False])
+        except Exception:
+            self.rollback()
+            if self.rollback_errors:
+                raise IOError("Could not restore {} files after a failed update; the originals are in {}.".format(
+                    len(self.rollback_errors), self.backup_dir))
+            raise
+        self._prune_empty_dirs(removed)
+
+    def rollback(self):
+        """Restores every file moved by commit(); failures are kept in rollback_errors."""
+        for relative_path, backed_up, installed in reversed(self._moves):
+            target = manifest_local_path(self.root, relative_path)
+            try:
+                if installed and os.path.exists(target):
+                    os.remove(target)
+                if backed_up:
+                    self._make_parent(target)
+                    os.rename(manifest_local_path(self.backup_dir, relative_path), target)
+            except OSError, e:
+                self.rollback_errors.append("{}: {}".format(relative_path, e))
+        self._moves = []
+
+    def _prune_empty_dirs(self, removed):
+        directories = set()
+        for relative_path in removed:
+            parts = relative_path.split("/")[:-1]
+            while parts:
+                directories.add("/".join(parts))
+                parts = parts[:-1]
+        # Deepest first, so a package folder goes after its subfolders.
+        for relative_path in sorted(directories, key=lambda p: p.count("/"), reverse=True):
+            try:
+                os.rmdir(manifest_local_path(self.root, relative_path))
+            except OSError:
+                pass  # Not empty.
+
+    def cleanup(self):
+        """Removes the staging and backup directories (the backup is kept if a rollback failed)."""
+        directories = [self.staging_dir] if self.rollback_errors else [self.staging_dir, self.backup_dir]
+        for directory in directories:
+            if os.path.exists(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+def _commit_update(update, root, new_manifest, changed, removed, index=None):
+    """Swaps a fully staged update in, writes the new manifest and records the new files in index."""
+    update.commit(removed)
+    manifest_path = os.path.join(root, new_manifest.get("top", "pythonCWMS"), MANIFEST_NAME)
+    with open(manifest_path, 'w') as f:
+        json.dump(new_manifest, f, indent=1, sort_keys=True)
+    if index is not None:
+        for relative_path in changed:
+            index.record(root, relative_path, new_manifest["files"][relative_path]["sha256"])
+        for relative_path in removed:
+            index.forget(relative_path)
+        index.save()
+
+
+def apply_delta_pack(pack_path, root, new_manifest, changed, removed, cancel_event=None, index=None):
+    """
+    Stages every changed file from the delta pack (checking it against
+    new_manifest), swaps them into the tree under root, removes the files
+    that are no longer part of the release and writes the new manifest.
+    Raises with the tree unchanged if anything fails before the swap.
+    """
+    update = StagedUpdate(root, cancel_event)
+    update.begin()
+    try:
+        pack = zipfile.ZipFile(pack_path, 'r')
+        try:
+            names = set(pack.namelist())
+            missing = [path for path in changed if path not in names]
+            if missing:
+                raise IntegrityError("Delta pack is missing {} changed files (e.g. {}).".format(len(missing), missing[0]))
+            for relative_path in changed:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise Exception("Installation cancelled.")
+                source = pack.open(relative_path)
+                try:
+                    update.stage(relative_path, source, new_manifest["files"][relative_path]["sha256"])
+                finally:
+                    source.close()
+        finally:
+            pack.close()
+        _commit_update(update, root, new_manifest, changed, removed, index)
+    finally:
+        update.cleanup()
+
+
+class InstalledFileIndex(object):
+    """
+    SHA-256 of installed files, remembered together with the size and
+    modification time each file had when its hash was taken. An upgrade only
+    hashes files whose size or time changed since, so comparing an untouched
+    installation with a new manifest costs one stat per file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f).get("files", {})
+        except (IOError, ValueError, AttributeError):
+            pass  # No index yet, or a damaged one; every file gets hashed once.
+
+    def sha256(self, root, relative_path, stat=None):
+        """Returns the file's SHA-256, hashing it only if it changed since it was recorded."""
+        path = manifest_local_path(root, relative_path)
+        if stat is None:
+            stat = os.stat(path)
+        entry = self.entries.get(relative_path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return entry[2]
+        digest = hash_file(path).hexdigest()
+        self.entries[relative_path] = [stat.st_size, stat.st_mtime, digest]
+        return digest
+
+    def record(self, root, relative_path, sha256):
+        """Stores the hash of a file that was just written and verified."""
+        stat = os.stat(manifest_local_path(root, relative_path))
+        self.entries[relative_path] = [stat.st_size, stat.st_mtime, sha256.lower()]
+
+    def forget(self, relative_path):
+        self.entries.pop(relative_path, None)
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({"files": self.entries}, f)
+
+
+def plan_upgrade(root, new_manifest, installed_manifest=None, index=None, cancel_event=None):
+    """
+    Compares the tree under root with new_manifest and returns (changed,
+    removed). Sizes are compared first and files of the right size are
+    hashed (through index when given). Only files listed in
+    installed_manifest are removed, so anything the user added to the
+    installation is left alone.
+    """
+    if index is None:
+        index = InstalledFileIndex(os.devnull)
+    changed = []
+    for relative_path, entry in sorted(new_manifest["files"].items()):
+        if cancel_event is not None and cancel_event.is_set():
+            raise Exception("Installation cancelled.")
+        try:
+            stat = os.stat(manifest_local_path(root, relative_path))
+        except OSError:
+            changed.append(relative_path)
+            continue
+        if stat.st_size != entry["size"] or \
+           index.sha256(root, relative_path, stat).lower() != entry["sha256"].lower():
+            changed.append(relative_path)
+    removed = []
+    if installed_manifest is not None:
+        removed = sorted(path for path in installed_manifest["files"]
+                         if path not in new_manifest["files"] and
+                         os.path.exists(manifest_local_path(root, path)))
+    return changed, removed
+
+
+def apply_archive_upgrade(seven_z_exe_path, archive_path, root, new_manifest, changed, removed,
+                          cancel_event=None, index=None, progress=None):
+    """
+    Extracts only the changed files from the release archive into a staging
+    directory, checks them against new_manifest and swaps them into the tree
+    under root. Files that did not change are never rewritten. Raises with
+    the tree unchanged if extraction or verification fails. Zip archives are
+    extracted in-process (reporting to progress), others with 7z.exe.
+    """
+    update = StagedUpdate(root, cancel_event)
+    update.begin()
+    try:
+        if changed and zipfile.is_zipfile(archive_path):
+            ParallelZipExtractor(archive_path, update.staging_dir, cancel_event=cancel_event, progress=progress,
+                                 members=changed).extract()
+        elif changed:
+            if not seven_z_exe_path:
+                raise ExtractionError("7z.exe is needed to extract {}".format(os.path.basename(archive_path)))
+            fd, list_path = tempfile.mkstemp(prefix="pythonCWMS-", suffix=".lst")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for relative_path in changed:
+                        f.write((relative_path.replace("/", os.sep) + "\n").encode('utf-8'))
+                process = subprocess.Popen([seven_z_exe_path, "x", archive_path,
+                                            "-o{}".format(update.staging_dir), "-scsUTF-8", "-y", "-mmt=on",
+                                            "@" + list_path],
+                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
+                _, stderr_output = process.communicate()
+            finally:
+                os.remove(list_path)
+            if cancel_event is not None and cancel_event.is_set():
+                raise Exception("Installation cancelled.")
+            if process.returncode != 0:
+                raise ExtractionError("7-Zip exited with code {}: {}".format(
+                    process.returncode, stderr_output.decode('utf-8', 'ignore').strip()))
+        for relative_path in changed:
+            update.verify_staged(relative_path, new_manifest["files"][relative_path]["sha256"])
+        _commit_update(update, root, new_manifest, changed, removed, index)
+    finally:
+        update.cleanup()
+
+
+# --- Configuration cache ---
+# The last configuration fetched from each config URL is kept together with its
+# ETag and Last-Modified validators, so the installer can show it immediately
+# and only downloads it again when the server reports a change.
+
+CONFIG_FETCH_TIMEOUT = 10
+
+
+class CachedConfig(object):
+    """
+    Local copy of the configuration JSON fetched from url, stored in cache_dir.
+    load() returns the cached copy; revalidate() sends a conditional request
+    and downloads the configuration only if it changed, from url or one of
+    its mirrors.
+    """
+
+    def __init__(self, url, cache_dir, timeout=CONFIG_FETCH_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.path = os.path.join(cache_dir, "config_{}.json".format(hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]))
+        self.entry = None
+
+    def load(self):
+        """Returns the cached configuration, or None if there is no usable copy."""
+        try:
+            with open(self.path, 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("url") != self.url or not isinstance(entry.get("config"), dict):
+            return None
+        self.entry = entry
+        return entry["config"]
+
+    def revalidate(self, sources=None):
+        """
+        Asks the server whether the configuration changed since it was cached.
+        Returns (config, changed); raises IOError if it cannot be fetched and
+        ValueError if the server's copy is not valid JSON.
+
+        sources lists the URLs to ask in order (url itself by default); the
+        first one that answers wins. A mirror serving a configuration older
+        than the cached one has not caught up yet and is skipped.
+        """
+        error = None
+        for source in sources or [self.url]:
+            try:
+                return self._revalidate_from(source)
+            except (IOError, ValueError), e:
+                error = e
+        raise error
+
+    def _revalidate_from(self, source):
+        request = urllib2.Request(source)
+        if self.entry is not None and (self.entry.get("source") or self.url) == source:
+            if self.entry.get("etag"):
+                request.add_header("If-None-Match", self.entry["etag"])
+            if self.entry.get("last_modified"):
+                request.add_header("If-Modified-Since", self.entry["last_modified"])
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError, e:
+            if e.code == 304 and self.entry is not None:
+                return self.entry["config"], False
+            raise
+        try:
+            body = response.read()
+            headers = response.info()
+        finally:
+            response.close()
+        config = json.loads(body)
+        if not isinstance(config, dict):
+            raise ValueError("The configuration is not a JSON object.")
+        if source != self.url and self.entry is not None and \
+           str(config.get("created_date") or "") < str(self.entry["config"].get("created_date") or ""):
+            raise IOError("{} serves an older configuration (created {}).".format(source, config.get("created_date")))
+        changed = self.entry is None or config != self.entry.get("config")
+        self.entry = {
+            "url": self.url,
+            "source": source,
+            "etag": headers.getheader("ETag"),
+            "last_modified": headers.getheader("Last-Modified"),
+            "fetched": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "config": config,
+        }
+        try:
+            self._save()
+        except (IOError, OSError):
+            pass  # Without a writable cache the next launch simply downloads it again.
+        return config, changed
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.entry, f)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+
+# --- Install telemetry ---
+# Every installer run is split into timed phases (config fetch, source probing,
+# download, hashing, extraction, setx/reg calls, cleanup), so a slow install
+# can be pinned on one of them. The phases of each install are written to a
+# JSON report, which sites can also collect in a shared folder
+# (install_report_dir) to compare machines and releases.
+
+INSTALL_REPORT_SCHEMA_VERSION = 1
+INSTALL_REPORTS_KEPT = 20
+
+
+class PhaseSpan(object):
+    """
+    One timed phase of an installer run, used as a context manager. Code in
+    the phase fills in bytes, files and details as it learns them; leaving
+    the block records the duration, and the error if the phase raised.
+    """
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+        self.bytes = None
+        self.files = None
+        self.details = {}
+        self.outcome = None
+        self.started = None
+        self.seconds = None
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.time() - self.started
+        if exc_type is not None:
+            self.outcome = "failed"
+            self.details.setdefault("error", str(exc_value))
+        else:
+            self.outcome = self.outcome or "ok"
+        self.telemetry.record(self)
+        return False
+
+    def as_dict(self, origin):
+        entry = {
+            "name": self.name,
+            "start_seconds": round(self.started - origin, 3),
+            "seconds": round(self.seconds, 3),
+            "outcome": self.outcome,
+        }
+        if self.bytes is not None:
+            entry["bytes"] = self.bytes
+            if self.seconds > 0:
+                entry["bytes_per_second"] = int(self.bytes / self.seconds)
+        if self.files is not None:
+            entry["files"] = self.files
+            if self.seconds > 0:
+                entry["files_per_second"] = round(self.files / self.seconds, 1)
+        if self.details:
+            entry["details"] = self.details
+        return entry
+
+
+class InstallTelemetry(object):
+    """
+    The phases of one installer run ("install" or "config"), in the order
+    they finished. Phases may be recorded from several threads.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.started = time.time()
+        self.finished = None
+        self.outcome = None
+        self.details = {}
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def phase(self, name):
+        return PhaseSpan(self, name)
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self, outcome, error=None):
+        self.finished = time.time()
+        self.outcome = outcome
+        if error is not None:
+            self.details["error"] = str(error)
+
+    def report(self):
+        finished = self.finished or time.time()
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "schema_version": INSTALL_REPORT_SCHEMA_VERSION,
+            "run": self.run,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+            "host": os.environ.get("COMPUTERNAME") or socket.gethostname(),
+            "outcome": self.outcome,
+            "total_seconds": round(finished - self.started, 3),
+            "details": self.details,
+            "phases": [span.as_dict(self.started) for span in spans],
+        }
+
+    def summary_lines(self):
+        """The phases as a fixed-width table, for the installer log."""
+        report = self.report()
+        lines = ["{:<20} {:>8} {:>9} {:>7} {:>8}  {}".format("Phase", "Seconds", "MB", "Files", "MB/s", "Outcome")]
+        for phase in report["phases"]:
+            lines.append("{:<20} {:>8.1f} {:>9} {:>7} {:>8}  {}".format(
+                phase["name"], phase["seconds"],
+                "{:.2f}".format(phase["bytes"] / BYTES_PER_MB) if "bytes" in phase else "-",
+                phase.get("files", "-"),
+                "{:.2f}".format(phase["bytes_per_second"] / BYTES_PER_MB) if "bytes_per_second" in phase else "-",
+                phase["outcome"]))
+        lines.append("{:<20} {:>8.1f} {:>9} {:>7} {:>8}  {}".format(
+            "total", report["total_seconds"], "", "", "", report["outcome"] or ""))
+        return lines
+
+
+def write_install_report(report, directory, filename, keep=None):
+    """
+    Writes report as JSON to directory/filename and returns its path. With
+    keep, only the newest keep .json files are left in directory.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, filename)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+    if keep:
+        reports = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+        for name in reports[:-keep]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return path
+
+
+# --- Install engine ---
+# The install itself (update in place, download, verify, extract, set the
+# environment variables) without any Swing, so build_scripts/installer_benchmark.py
+# runs exactly what the installer window runs. Progress, messages and the
+# start/end of an install are reported to an InstallUi.
+
+class InstallUi(object):
+    """
+    Receives the progress of an InstallEngine; called from the install thread.
+    Every method does nothing here, subclasses override what they show.
+    """
+
+    def log(self, text):
+        pass
+
+    def set_status(self, text):
+        pass
+
+    def set_progress(self, value=None, text=None, indeterminate=False):
+        pass
+
+    def show_message(self, message, title, kind="info"):
+        """A message for the user; kind is "info", "warning" or "error"."""
+        pass
+
+    def install_started(self):
+        pass
+
+    def install_finished(self, success, was_cancelled=False):
+        pass
+
+
+class InstallEngine(object):
+    """
+    Installs the configuration given to apply_config() with run(). Install
+    reports go under config_cache_dir and downloads to download_dir (both
+    default to the per-user locations the installer always used).
+    """
+
+    def __init__(self, ui=None, config_cache_dir=None, download_dir=None):
+        self.ui = ui or InstallUi()
+        # Initialize these as None; they will be populated from the config file
+        self.python_7z_url = None
+        self.expected_sha256_hash = None
+        self.destination_dir = None
+        self.env_var_name = None
+        self.python_exe_sub_dir = None
+        self.archive_size_mb = None
+        self.download_connections = 1
+        self.streaming_archive = None
+        self.archive_variants = []
+        self.expected_download_mbps = DEFAULT_EXPECTED_DOWNLOAD_MBPS
+        self.archive_cache_dir = None
+        self.archive_cache_max_mb = DEFAULT_ARCHIVE_CACHE_MAX_MB
+        self.config_version = None
+        self.manifest_url = None
+        self.manifest_sha256 = None
+        self.delta_packs = []
+        self.mirrors = []
+        self.config_mirrors = []
+        self.peers = []
+        self.peer_sharing = False
+        self.peer_port = PEER_PORT
+        self._release_manifest = None
+        # Last configuration fetched from each config URL, shown while it is revalidated
+        self.config_cache_dir = config_cache_dir or os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(), "pythonCWMS")
+        self.installation_running = False
+        self.install_report_dir = None
+        # Phase timings of the running (or last) install and of the last config load
+        self.telemetry = InstallTelemetry("install")
+        self.config_telemetry = None
+
+        self.python_exe_path = None
+        self.temp_7z_file = None
+        # Downloads live in a stable location (not a fresh temp file) so an
+        # interrupted download can be resumed on retry or after a relaunch.
+        self.download_dir = download_dir or os.path.join(tempfile.gettempdir(), "pythonCWMS_downloads")
+        self.cancel_event = threading.Event()
+
+    def apply_config(self, config_data):
+        """
+        Validates a configuration and makes it the one run() installs.
+        Raises ValueError if essential keys are missing.
+        """
+        if not config_data.get("python_download_url") or not config_data.get("python_expected_hash_sha256") or \
+           not config_data.get("default_install_directory") or not config_data.get("default_env_var_name") or \
+           config_data.get("python_exe_sub_directory") is None:
+            raise ValueError("Missing essential configuration keys in JSON.")
+
+        self.python_7z_url = config_data.get("python_download_url")
+        self.expected_sha256_hash = config_data.get("python_expected_hash_sha256")
+        self.destination_dir = config_data.get("default_install_directory")
+        self.env_var_name = config_data.get("default_env_var_name")
+        self.python_exe_sub_dir = config_data.get("python_exe_sub_directory")
+        self.archive_size_mb = config_data.get("archive_size_mb")
+        # Optional: number of parallel connections for the archive download (1 = single stream)
+        self.download_connections = config_data.get("download_connections", 1)
+        # Optional: tar.xz variant with per-chunk hashes for the pipelined install
+        self.streaming_archive = config_data.get("streaming_archive")
+        # Optional: the same tree in other formats, and the link speed assumed when picking one
+        self.archive_variants = config_data.get("archive_variants") or []
+        self.expected_download_mbps = config_data.get("expected_download_mbps", DEFAULT_EXPECTED_DOWNLOAD_MBPS)
+        # Optional: shared (e.g. UNC) archive cache location and size cap (0 disables the cache)
+        self.archive_cache_dir = config_data.get("archive_cache_dir")
+        self.archive_cache_max_mb = config_data.get("archive_cache_max_mb", DEFAULT_ARCHIVE_CACHE_MAX_MB)
+        # Optional: file manifest and delta packs for updating an existing installation
+        self.config_version = config_data.get("version")
+        self.manifest_url = config_data.get("manifest_url")
+        self.manifest_sha256 = config_data.get("manifest_sha256")
+        self.delta_packs = config_data.get("delta_packs") or []
+        # Optional: other servers with the release files and with this config, tried fastest first
+        self.mirrors = config_data.get("mirrors") or []
+        self.config_mirrors = config_data.get("config_mirrors") or []
+        # Optional: LAN peers that share verified archives (python_scripts/pythoncwms_peer.py)
+        self.peers = config_data.get("peers") or []
+        self.peer_sharing = bool(config_data.get("peer_sharing", False))
+        self.peer_port = config_data.get("peer_port", PEER_PORT)
+        # Optional: shared folder that collects the install report of every machine
+        self.install_report_dir = config_data.get("install_report_dir")
+
+    def _log(self, text):
+        self.ui.log(text)
+
+    def _set_status(self, text):
+        self.ui.set_status(text)
+
+    def _set_progress(self, value=None, text=None, indeterminate=False):
+        self.ui.set_progress(value, text, indeterminate)
+
+    def _phase(self, name):
+        """A PhaseSpan of the current install; use it as a context manager."""
+        return self.telemetry.phase(name)
+
+    def _write_install_report(self, outcome, error=None):
+        """Logs the phase timings of the install that just ended and saves them as a JSON report."""
+        self.telemetry.finish(outcome, error)
+        report = self.telemetry.report()
+        if self.config_telemetry is not None:
+            report["config_load"] = self.config_telemetry.report()
+        self._log("\nInstall timing:\n" + "".join(line + "\n" for line in self.telemetry.summary_lines()))
+        filename = "install_{}.json".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(self.telemetry.started)))
+        try:
+            path = write_install_report(report, os.path.join(self.config_cache_dir, "install_reports"), filename,
+                                        keep=INSTALL_REPORTS_KEPT)
+            self._log("Install report saved to {}\n".format(path))
+        except (IOError, OSError), e:
+            self._log("Warning: Could not save the install report: {}\n".format(e))
+        if self.install_report_dir:
+            try:
+                write_install_report(report, self.install_report_dir, "{}_{}".format(report["host"], filename))
+            except (IOError, OSError), e:
+                self._log("Warning: Could not copy the install report to {}: {}\n".format(self.install_report_dir, e))
+
+    def _download_progress_hook(self, blocks_transferred, block_size, total_size):
+        """urlretrieve-style reporthook used by the download engine to update progress."""
+        if self.cancel_event.is_set():
+            raise IOError("Download cancelled by user.")
+
+        if total_size > 0:
+            percentage = int(100.0 * blocks_transferred * block_size / total_size)
+            if percentage > 100:
+                percentage = 100
+            self._set_progress(percentage, "Downloading: {}%".format(percentage))
+            
+            downloaded_mb = (blocks_transferred * block_size) / (1024.0 * 1024.0)
+            total_mb = total_size / (1024.0 * 1024.0)
+            self._set_status("Status: Downloading {:.2f}MB / {:.2f}MB".format(downloaded_mb, total_mb))
+        else:
+            self._set_progress(indeterminate=True)
+            self._set_status("Status: Downloading (size unknown)...")
+
+    def _calculate_file_hash(self, filepath, hash_algo='sha256', block_size=HASH_READ_SIZE):
+        """Calculates the hash of a file."""
+        with self._phase("hash") as span:
+            try:
+                span.bytes = os.path.getsize(filepath)
+                return hash_file(filepath, hash_algo, block_size=block_size).hexdigest()
+            except Exception, e:
+                raise Exception("Failed to calculate hash of {}: {}".format(filepath, e))
+
+    def _add_to_user_path(self, env_var_name):
+        """
+        Checks if %ENV_VAR_NAME% and %ENV_VAR_NAME%\Scripts are in the user's PATH
+        and adds them if they are not.
+        """
+        self._log("\nChecking/updating user PATH...\n")
+        current_user_path = ""
+        
+        with self._phase("reg_query_path") as span:
+            try:
+                reg_query_cmd = ["reg", "query", "HKCU\\Environment", "/v", "Path"]
+                reg_process = subprocess.Popen(reg_query_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
+                reg_stdout_bytes, reg_stderr_bytes = reg_process.communicate()
+            
+                reg_stdout = reg_stdout_bytes.decode('utf-8', errors='ignore')
+            
+                if reg_process.returncode == 0:
+                    for line in reg_stdout.splitlines():
+                        if "REG_EXPAND_SZ" in line or "REG_SZ" in line:
+                            parts = line.split("    ") 
+                            if len(parts) >= 3:
+                                current_user_path = parts[3].strip()
+                                break
+                else:
+                    span.outcome = "failed"
+                    self._log("Warning: Could not read current user PATH from registry. Error: {}\n".format(reg_stderr_bytes.decode('utf-8', errors='ignore')))
+            except Exception, e:
+                span.outcome = "failed"
+                self._log("Warning: Error querying registry for PATH: {}\n".format(e))
+        
+        paths_to_add_str = [
+            "%{}%".format(env_var_name),
+            "%{}%\\Scripts".format(env_var_name)
+        ]
+        
+        expanded_paths_to_add = [os.path.normpath(os.path.expandvars(p)) for p in paths_to_add_str]
+
+        current_paths_normalized = [os.path.normpath(os.path.expandvars(p)) for p in current_user_path.split(os.pathsep) if p]
+        
+        new_paths_for_setx = []
+        for i, path_to_check in enumerate(expanded_paths_to_add):
+            if path_to_check not in current_paths_normalized:
+                new_paths_for_setx.append(paths_to_add_str[i])
+
+        if new_paths_for_setx:
+            self._log("Adding {} to user PATH...\n".format(", ".join(new_paths_for_setx)))
+            
+            new_path_value = current_user_path
+            if new_path_value and not new_path_value.endswith(os.pathsep):
+                new_path_value += os.pathsep
+
+            new_path_value += os.pathsep.join(new_paths_for_setx)
+
+            setx_path_cmd = ["setx", "Path", new_path_value]
+            with self._phase("setx_path") as span:
+                try:
+                    setx_path_process = subprocess.Popen(setx_path_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
+                    setx_path_stdout_bytes, setx_path_stderr_bytes = setx_path_process.communicate()
+                
+                    setx_path_stdout = setx_path_stdout_bytes.decode('utf-8', errors='ignore')
+                    setx_path_stderr = setx_path_stderr_bytes.decode('utf-8', errors='ignore')
+
+                    if setx_path_process.returncode == 0:
+                        self._log("Successfully added to user PATH.\n")
+                        self._log("SETX PATH Output: {}\n".format(setx_path_stdout))
+                        self._log("\nIMPORTANT: User PATH changes will be available in NEW command prompt windows.\n")
+                        self._log('\nUser can launch python with "pythonCWMS" in the command prompt window.\n')
+                    else:
+                        span.outcome = "failed"
+                        self._log("Failed to add to user PATH. Error: {}. Output: {}\n".format(setx_path_stderr, setx_path_stdout))
+                except Exception, e:
+                    span.outcome = "failed"
+                    self._log("Error executing SETX for PATH: {}\n".format(e))
+        else:
+            self._log("User PATH already contains required Python entries. No changes made.\n")
+
+
+    def _cleanup_destination_dir(self, path):
+        """Removes the destination directory and its contents."""
+        if os.path.exists(path):
+            self._log("Cleaning up partially installed directory: {}\n".format(path))
+            self._set_status("Status: Cleaning up...")
+            try:
+                with self._phase("cleanup"):
+                    shutil.rmtree(path)
+                self._log("Cleaned up: {}\n".format(path))
+            except Exception, e:
+                self._log("Warning: Failed to clean up directory {}: {}\n".format(path, e))
+                self.ui.show_message("Warning: Could not fully clean up directory {}. Please close any open python instances and " \
+                                     "try again or remove it manually if needed.\nError: {}".format(path, e), "Cleanup Warning", "warning")
+
+
+    def _open_archive_cache(self):
+        """
+        Returns the ArchiveCache to use, or None if caching is disabled. The
+        PYTHON_CWMS_ARCHIVE_CACHE environment variable overrides the config,
+        which overrides the per-machine default under ProgramData.
+        """
+        if not self.archive_cache_max_mb or float(self.archive_cache_max_mb) <= 0:
+            return None
+        cache_dir = os.environ.get("PYTHON_CWMS_ARCHIVE_CACHE") or self.archive_cache_dir
+        if not cache_dir:
+            machine_dir = os.environ.get("ProgramData") or tempfile.gettempdir()
+            cache_dir = os.path.join(machine_dir, "pythonCWMS", "archive_cache")
+        return ArchiveCache(cache_dir, int(float(self.archive_cache_max_mb) * BYTES_PER_MB),
+                            log=lambda message: self._log(message + "\n"))
+
+    def _store_in_archive_cache(self, archive_cache, archive_path, archive_sha256_hash):
+        """Keeps a verified archive for later installs; failures only produce a warning."""
+        self._set_status("Status: Saving archive to cache...")
+        try:
+            cached_path = archive_cache.store(archive_path, archive_sha256_hash)
+            self._log("Saved archive to the local cache: {}\n".format(cached_path))
+        except Exception, e:
+            self._log("Warning: Could not save archive to the cache {}: {}\n".format(archive_cache.root, e))
+
+    def _expected_bytes_per_second(self):
+        try:
+            mbps = float(self.expected_download_mbps)
+        except (TypeError, ValueError):
+            mbps = 0
+        return (mbps if mbps > 0 else DEFAULT_EXPECTED_DOWNLOAD_MBPS) * 1000.0 * 1000.0 / 8.0
+
+    def _select_archive_variant(self, current_python_7z_url, archive_cache, formats=SEVEN_ZIP_ARCHIVE_FORMATS):
+        """
+        Returns the archive_variants entry to download instead of the configured
+        .7z, or None to use the URL from the UI (no usable variants, or the user
+        changed the URL).
+        """
+        if not self.archive_variants or current_python_7z_url != self.python_7z_url:
+            return None
+        is_cached = None
+        if archive_cache is not None:
+            is_cached = lambda sha256: archive_cache.lookup(sha256) is not None
+        return choose_archive_variant(self.archive_variants, self._expected_bytes_per_second(), is_cached, formats)
+
+    def zip_archive_available(self, current_python_7z_url):
+        """True if the install can be done from a .zip, which does not need 7z.exe."""
+        if urlparse.urlparse(current_python_7z_url).path.lower().endswith(".zip"):
+            return True
+        return self._select_archive_variant(current_python_7z_url, None, BUILTIN_ARCHIVE_FORMATS) is not None
+
+    def _extraction_progress(self, bytes_done, total_bytes, files_done, total_files):
+        """Progress callback of ParallelZipExtractor."""
+        percentage = int(100.0 * bytes_done / total_bytes) if total_bytes else 100
+        self._set_progress(percentage, "Extracting: {}%".format(percentage))
+        self._set_status("Status: Extracting {:.2f}MB / {:.2f}MB ({} of {} files)".format(
+            bytes_done / BYTES_PER_MB, total_bytes / BYTES_PER_MB, files_done, total_files))
+
+    def _select_streaming_archive(self, current_python_7z_url, variant=None):
+        """
+        Returns the streaming_archive entry from the config if the pipelined
+        install can be used: the user kept the configured archive URL, the
+        entry carries a complete set of chunk hashes and it is not estimated to
+        be slower than downloading and then extracting the chosen variant.
+        """
+        streaming_archive = self.streaming_archive
+        if not streaming_archive or current_python_7z_url != self.python_7z_url:
+            return None
+        try:
+            size_bytes = int(streaming_archive["size_bytes"])
+            chunk_size = int(streaming_archive["chunk_size_bytes"])
+            expected_chunks = (size_bytes + chunk_size - 1) // chunk_size
+            if streaming_archive.get("format") != "tar.xz" or not streaming_archive.get("url") or \
+               len(streaming_archive.get("sha256") or "") != 64 or \
+               len(streaming_archive.get("chunk_sha256") or []) != expected_chunks:
+                raise ValueError("incomplete streaming_archive entry")
+        except (KeyError, TypeError, ValueError), e:
+            self._log("Ignoring streaming archive from config ({}); using the .7z archive.\n".format(e))
+            return None
+        if variant is not None:
+            bytes_per_second = self._expected_bytes_per_second()
+            pipelined_seconds = estimated_install_seconds(streaming_archive, bytes_per_second, pipelined=True)
+            variant_seconds = estimated_install_seconds(variant, bytes_per_second)
+            if pipelined_seconds is not None and variant_seconds is not None and variant_seconds < pipelined_seconds:
+                self._log("The .{} archive is estimated to install faster ({:.0f}s) than the pipelined install ({:.0f}s).\n".format(
+                    variant["format"], variant_seconds, pipelined_seconds))
+                return None
+        return streaming_archive
+
+    def _installed_state_paths(self, current_destination_dir, current_python_exe_sub_dir):
+        """Returns (manifest_path, file_index_path) inside the installation's top-level folder."""
+        top_dir = current_python_exe_sub_dir.replace("\\", "/").split("/")[0]
+        return (os.path.join(current_destination_dir, top_dir, MANIFEST_NAME),
+                os.path.join(current_destination_dir, top_dir, FILE_INDEX_NAME))
+
+    def _get_release_manifest(self):
+        """Downloads (once per installation) and verifies the configured release's file manifest."""
+        if self._release_manifest is None:
+            sources = mirror_urls(self.manifest_url, self.mirrors, self.config_version)
+            for index, source in enumerate(sources):
+                try:
+                    self._release_manifest = fetch_manifest(source, self.manifest_sha256)
+                    break
+                except (IOError, ValueError, IntegrityError), e:
+                    if index == len(sources) - 1:
+                        raise
+                    self._log("Could not fetch the manifest from {} ({}); trying the next mirror.\n".format(
+                        urlparse.urlparse(source).netloc, e))
+        return self._release_manifest
+
+    def _peer_sources(self, sha256):
+        """
+        URLs of the archive on LAN peers: those listed in the config or in the
+        PYTHON_CWMS_PEERS environment variable (comma separated), plus those
+        that answer discovery when peer sharing is on.
+        """
+        peers = list(self.peers) + [peer for peer in os.environ.get("PYTHON_CWMS_PEERS", "").split(",") if peer.strip()]
+        urls = configured_peer_urls(peers, sha256, self.peer_port)
+        if self.peer_sharing:
+            self._set_status("Status: Looking for peers on the local network...")
+            try:
+                for url in discover_peers(sha256, self.peer_port):
+                    if url not in urls:
+                        urls.append(url)
+            except socket.error, e:
+                self._log("Could not look for peers on the local network: {}\n".format(e))
+        return urls
+
+    def _ranked_sources(self, url, size_bytes=None, sha256=None):
+        """
+        Returns url and the same file on each configured mirror, fastest first,
+        preceded by the LAN peers that hold the archive with sha256. Only call
+        it for files named by the configuration.
+        """
+        urls = mirror_urls(url, self.mirrors, self.config_version)
+        peer_urls = self._peer_sources(sha256) if sha256 else []
+        if len(urls) + len(peer_urls) < 2:
+            return urls
+        self._set_status("Status: Checking download mirrors...")
+        probes = rank_mirrors(probe_mirrors(peer_urls + urls), size_bytes)
+        # Any neighbour that answered beats the WAN link, which the whole site shares.
+        # Peers that did not answer are left out: they only hold copies of the same file.
+        peers = [probe for probe in probes if probe["url"] in peer_urls and probe["error"] is None]
+        probes = peers + [probe for probe in probes if probe["url"] not in peer_urls]
+        self._log("Download sources, in the order they will be tried:\n")
+        for probe in probes:
+            name = urlparse.urlparse(probe["url"]).netloc + (" (peer)" if probe in peers else "")
+            if probe["error"] is not None:
+                message = "  {}: unreachable ({})".format(name, probe["error"])
+            else:
+                message = "  {}: {:.0f}ms{}".format(name, probe["latency"] * 1000,
+                                                    ", {:.2f}MB/s".format(probe["bytes_per_second"] / BYTES_PER_MB) if probe["bytes_per_second"] else "")
+            self._log(message + "\n")
+        return [probe["url"] for probe in probes]
+
+    def _start_peer_sharing(self):
+        """
+        Starts python_scripts/pythoncwms_peer.py from the new installation so
+        other installers on the network can fetch the archive from this machine.
+        """
+        archive_cache = self._open_archive_cache()
+        if not self.peer_sharing or archive_cache is None or not self.python_exe_path:
+            return
+        if archive_cache.root.startswith("\\\\"):
+            return  # Installers already share this cache over the network.
+        peer_script = os.path.join(os.path.dirname(os.path.dirname(self.python_exe_path)), "python_scripts", "pythoncwms_peer.py")
+        if not os.path.exists(peer_script):
+            return
+        log_file = os.path.join(self.config_cache_dir, "peer.log")
+        try:
+            if not os.path.isdir(self.config_cache_dir):
+                os.makedirs(self.config_cache_dir)
+            # A peer that is already running keeps the port and the new one exits.
+            subprocess.Popen([self.python_exe_path, peer_script, "--cache", archive_cache.root,
+                              "--http-port", str(self.peer_port), "--discovery-port", str(self.peer_port),
+                              "--idle-timeout", str(PEER_IDLE_TIMEOUT), "--log-file", log_file],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self._log("Sharing the archive with other installers on the local network (port {}, log: {}).\n".format(
+                self.peer_port, log_file))
+        except (OSError, IOError), e:
+            self._log("Warning: Could not start sharing the archive on the local network: {}\n".format(e))
+
+    def _try_delta_update(self, current_python_7z_url, current_destination_dir, current_python_exe_sub_dir):
+        """
+        Updates an existing installation in place from the delta pack published
+        for its version. Returns True if the installation now matches the
+        configured release, False if the full archive should be installed
+        instead (no usable delta pack, or the update failed and was rolled back).
+        """
+        if not self.manifest_url or not self.delta_packs or current_python_7z_url != self.python_7z_url:
+            return False
+        manifest_path, index_path = self._installed_state_paths(current_destination_dir, current_python_exe_sub_dir)
+        installed_manifest = load_manifest(manifest_path)
+        if installed_manifest is None:
+            return False
+        installed_version = installed_manifest.get("version")
+        if installed_version == self.config_version:
+            return False  # Reinstalling the same release is a repair; use the full archive.
+        delta_pack = None
+        for entry in self.delta_packs:
+            if entry.get("from_version") == installed_version and entry.get("url") and entry.get("sha256"):
+                delta_pack = entry
+                break
+        if delta_pack is None:
+            self._log("No delta pack from installed version {}; installing the full archive.\n".format(installed_version))
+            return False
+
+        self._log("Found pythonCWMS {} in '{}'; updating it to {} with a delta pack.\n".format(
+            installed_version, current_destination_dir, self.config_version))
+        self._set_status("Status: Checking installed files...")
+        downloader = None
+        try:
+            new_manifest = self._get_release_manifest()
+            changed, removed = plan_delta_update(installed_manifest, new_manifest, current_destination_dir)
+            self._log("{} files changed and {} removed since {}.\n".format(len(changed), len(removed), installed_version))
+
+            archive_cache = self._open_archive_cache()
+            pack_size_bytes = int(delta_pack["size_bytes"]) if delta_pack.get("size_bytes") else None
+            if archive_cache is not None and archive_cache.lookup(delta_pack["sha256"]):
+                pack_sources = [delta_pack["url"]]
+            else:
+                pack_sources = self._ranked_sources(delta_pack["url"], pack_size_bytes, delta_pack["sha256"])
+            self._log("Downloading '{}'...\n".format(pack_sources[0]))
+            self._set_status("Status: Downloading delta pack...")
+            downloader = ResumableDownloader(delta_pack["url"], self.download_dir,
+                                             expected_sha256=delta_pack["sha256"],
+                                             reporthook=self._download_progress_hook,
+                                             cancel_event=self.cancel_event,
+                                             log=lambda message: self._log(message + "\n"),
+                                             connections=self.download_connections,
+                                             expected_size_bytes=pack_size_bytes,
+                                             cache=archive_cache,
+                                             mirrors=pack_sources,
+                                             stall_seconds=MIRROR_STALL_SECONDS,
+                                             stall_min_bytes_per_second=MIRROR_STALL_MIN_BYTES_PER_SECOND,
+                                             untrusted=set(pack_sources) - set(mirror_urls(delta_pack["url"], self.mirrors, self.config_version)))
+            pack_path = downloader.download()
+            calculated_hash = downloader.sha256 or self._calculate_file_hash(pack_path, 'sha256')
+            if calculated_hash.lower() != delta_pack["sha256"].lower():
+                raise IntegrityError("Delta pack hash mismatch: expected {} but calculated {}.".format(delta_pack["sha256"], calculated_hash))
+            self._log("Delta pack hash verified successfully.\n")
+
+            self._set_progress(text="Updating...", indeterminate=True)
+            self._set_status("Status: Applying delta update...")
+            apply_delta_pack(pack_path, current_destination_dir, new_manifest, changed, removed, self.cancel_event,
+                             InstalledFileIndex(index_path))
+            self._log("Delta update to {} applied successfully.\n".format(self.config_version))
+            if archive_cache is not None and not downloader.from_cache:
+                self._store_in_archive_cache(archive_cache, pack_path, delta_pack["sha256"])
+            return True
+        except Exception, e:
+            if self.cancel_event.is_set():
+                raise Exception("Installation cancelled.")
+            self._log("Delta update not applied ({}); the installation was left unchanged. Installing the full archive instead.\n".format(e))
+            self._set_progress()
+            return False
+        finally:
+            if downloader is not None:
+                try:
+                    downloader.discard()
+                except Exception:
+                    pass
+
+    def _plan_upgrade(self, current_python_7z_url, current_destination_dir, current_python_exe_sub_dir):
+        """
+        Compares an existing installation with the configured release. Returns
+        (new_manifest, changed, removed, index) for an in-place upgrade, or
+        None if the installation cannot be compared and the full archive has
+        to be extracted.
+        """
+        if not self.manifest_url or current_python_7z_url != self.python_7z_url:
+            return None
+        manifest_path, index_path = self._installed_state_paths(current_destination_dir, current_python_exe_sub_dir)
+        self._set_status("Status: Comparing installed files...")
+        self._log("Comparing the installation in '{}' with release {}...\n".format(current_destination_dir, self.config_version))
+        try:
+            new_manifest = self._get_release_manifest()
+            index = InstalledFileIndex(index_path)
+            changed, removed = plan_upgrade(current_destination_dir, new_manifest, load_manifest(manifest_path),
+                                            index, self.cancel_event)
+        except Exception, e:
+            if self.cancel_event.is_set():
+                raise Exception("Installation cancelled.")
+            self._log("Could not compare the installed files ({}); extracting the full archive.\n".format(e))
+            return None
+        self._log("{} of {} files differ from the release and {} will be removed; unchanged files are left in place.\n".format(
+            len(changed), len(new_manifest["files"]), len(removed)))
+        return new_manifest, changed, removed, index
+
+    def _index_installed_files(self, current_destination_dir, current_python_exe_sub_dir):
+        """
+        Records the hashes of a freshly extracted (and therefore verified)
+        installation so the next upgrade does not have to hash it again.
+        """
+        manifest_path, index_path = self._installed_state_paths(current_destination_dir, current_python_exe_sub_dir)
+        installed_manifest = load_manifest(manifest_path)
+        if installed_manifest is None:
+            return
+        try:
+            index = InstalledFileIndex(index_path)
+            for relative_path, entry in installed_manifest["files"].items():
+                index.record(current_destination_dir, relative_path, entry["sha256"])
+            index.save()
+        except Exception, e:
+            self._log("Warning: Could not write the installed file index {}: {}\n".format(index_path, e))
+
+    def _replace_installation(self, update, current_destination_dir, current_python_exe_sub_dir):
+        """
+        Swaps a release that was extracted in full into update's staging
+        folder into the existing installation, rolling back if any step fails.
+        Files of the installed release that the new one no longer has are
+        removed; files the user added are left alone.
+        """
+        manifest_path, _ = self._installed_state_paths(current_destination_dir, current_python_exe_sub_dir)
+        installed_manifest = load_manifest(manifest_path)
+        new_manifest = load_manifest(os.path.join(update.staging_dir, os.path.relpath(manifest_path, current_destination_dir)))
+        removed = []
+        if installed_manifest is not None and new_manifest is not None:
+            removed = sorted(path for path in installed_manifest["files"]
+                             if path not in new_manifest["files"] and
+                             os.path.exists(manifest_local_path(current_destination_dir, path)))
+        files = update.stage_extracted()
+        self._set_status("Status: Replacing installed files...")
+        self._log("Replacing the installation in '{}' with the extracted release ({} files, {} removed)...\n".format(
+            current_destination_dir, files, len(removed)))
+        update.commit(removed)
+
+    def _create_destination_dir(self, current_destination_dir):
+        """Creates the destination directory if it does not exist yet."""
+        self._set_status("Status: Creating destination directory...")
+        try:
+            if not os.path.exists(current_destination_dir):
+                os.makedirs(current_destination_dir)
+                self._log("Created destination directory: {}\n".format(current_destination_dir))
+            else:
+                self._log("Destination directory already exists: {}\n".format(current_destination_dir))
+        except Exception, e:
+            self.ui.show_message("Error creating destination directory: {}".format(e), "Directory Error", "error")
+            self._log("Error creating destination directory: {}\n".format(e))
+            raise Exception("Failed to create destination directory.")
+
+    def _extract_archive(self, seven_z_exe_path, archive_path, current_destination_dir, span=None):
+        """
+        Extracts a downloaded archive: zip archives in-process with
+        ParallelZipExtractor, anything else (or a zip the built-in extractor
+        cannot read) with 7z.exe. Returns (return_code, stderr_output); the
+        number of files extracted is recorded on span.
+        """
+        if zipfile.is_zipfile(archive_path):
+            self._log("Extracting with the built-in zip extractor...\n")
+            started = time.time()
+            try:
+                files, total_bytes = ParallelZipExtractor(archive_path, current_destination_dir,
+                                                          cancel_event=self.cancel_event,
+                                                          progress=self._extraction_progress).extract()
+                self._log("Extracted {} files ({:.2f}MB) in {:.1f}s.\n".format(
+                    files, total_bytes / BYTES_PER_MB, time.time() - started))
+                if span is not None:
+                    span.files = files
+                    span.details["extractor"] = "builtin_zip"
+                return 0, ""
+            except ExtractionError, e:
+                if not seven_z_exe_path:
+                    return 1, str(e)
+                self._log("Built-in extraction failed ({}); retrying with 7z.exe.\n".format(e))
+        if not seven_z_exe_path:
+            return 1, "7z.exe is needed to extract {}".format(os.path.basename(archive_path))
+        return self._extract_with_7z(seven_z_exe_path, archive_path, current_destination_dir, span)
+
+    def _extract_with_7z(self, seven_z_exe_path, archive_path, current_destination_dir, span=None):
+        """Runs '7z x' on a downloaded archive. Returns (return_code, stderr_output)."""
+        command = [
+            seven_z_exe_path,
+            "x",
+            archive_path,
+            "-o{}".format(current_destination_dir),
+            "-y",
+            "-mmt=on"  # Multithreaded decoding where the format allows it
+        ]
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
+        files_extracted = 0
+        last_status_time = 0
+        
+        while True:
+            if self.cancel_event.is_set():
+                self._log("Cancellation requested during extraction. Terminating 7z.exe...\n")
+                try:
+                    process.terminate()
+                except Exception, e:
+                    self._log("Warning: Could not terminate 7z.exe process: {}\n".format(e))
+                raise Exception("Installation cancelled.")
+
+            output_line = process.stdout.readline()
+            if output_line == '' and process.poll() is not None:
+                break
+            if output_line:
+                decoded_line = output_line.decode('utf-8', errors='ignore').strip()
+                if decoded_line.startswith("Extracting ") or decoded_line.startswith("- "):
+                    # One line per file: count it and refresh the status a few times a
+                    # second instead of handing every line to the Swing log.
+                    files_extracted += 1
+                    if time.time() - last_status_time >= 0.25:
+                        last_status_time = time.time()
+                        status_text = "Status: Extracting ({} files) {}".format(files_extracted, decoded_line.split(" ", 1)[1].strip())
+                        self._set_status(status_text)
+                elif decoded_line:
+                    self._log(decoded_line + "\n")
+
+        stderr_output = process.stderr.read().decode('utf-8', errors='ignore')
+        if span is not None:
+            span.files = files_extracted
+            span.details["extractor"] = "7z"
+        return process.returncode, stderr_output
+
+    def run(self, current_python_7z_url, current_expected_sha256_hash, current_destination_dir, current_env_var_name, current_python_exe_sub_dir, seven_z_exe_path,
+            set_environment=True):
+        """
+        Performs the download, extraction, and environment variable setup; the
+        arguments are the *current* values from the UI fields. Blocks, so the
+        installer calls it in a separate thread. With set_environment=False the
+        user's environment variables and PATH are left alone (for benchmarks).
+        Returns "succeeded", "failed" or "cancelled".
+        """
+        self.temp_7z_file = None
+        self.cancel_event.clear()
+        downloader = None
+        extractor = None
+        staged_update = None
+        keep_download = False
+        existing_installation = False
+        self._release_manifest = None
+        self.installation_running = True
+        self.telemetry = InstallTelemetry("install")
+        self.telemetry.details["config_version"] = self.config_version
+        outcome, error = "failed", None
+        
+        try:
+            self.ui.install_started()
+            self._set_progress(0, "Starting...")
+            self._set_status("Status: Initializing installation...")
+            self._log("\nStarting installation process...\n")
+
+            if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
+
+            # --- 0. Update an existing installation in place ---
+            # A delta pack is tried first; otherwise only the files that differ from
+            # the release are extracted. An existing installation is never removed.
+            existing_installation = os.path.exists(os.path.join(current_destination_dir, current_python_exe_sub_dir, "python.exe"))
+            self.telemetry.details["existing_installation"] = existing_installation
+            up_to_date = False
+            if existing_installation:
+                with self._phase("delta_update") as span:
+                    up_to_date = self._try_delta_update(current_python_7z_url, current_destination_dir, current_python_exe_sub_dir)
+                    span.details["applied"] = up_to_date
+            upgrade_plan = None
+            if existing_installation and not up_to_date:
+                with self._phase("compare_installed") as span:
+                    upgrade_plan = self._plan_upgrade(current_python_7z_url, current_destination_dir, current_python_exe_sub_dir)
+                    if upgrade_plan is not None:
+                        span.details["changed"] = len(upgrade_plan[1])
+                        span.details["removed"] = len(upgrade_plan[2])
+                if upgrade_plan is not None and not upgrade_plan[1]:
+                    new_manifest, changed, removed, file_index = upgrade_plan
+                    with self._phase("apply_upgrade"):
+                        apply_archive_upgrade(seven_z_exe_path, None, current_destination_dir, new_manifest, changed, removed,
+                                              self.cancel_event, file_index)
+                    self._log("All installed files already match release {}; nothing to download.\n".format(self.config_version))
+                    up_to_date = True
+            if up_to_date:
+                self.python_exe_path = os.path.join(current_destination_dir, current_python_exe_sub_dir, "python.exe")
+                if not os.path.exists(self.python_exe_path):
+                    self.python_exe_path = None
+
+            if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
+
+            if not up_to_date:
+                # --- 1. Download .7z file ---
+                archive_url = current_python_7z_url
+                archive_sha256_hash = current_expected_sha256_hash
+                archive_size_bytes = None
+                archive_cache = self._open_archive_cache()
+                variant = self._select_archive_variant(current_python_7z_url, archive_cache,
+                                                       SEVEN_ZIP_ARCHIVE_FORMATS if seven_z_exe_path else BUILTIN_ARCHIVE_FORMATS)
+                if variant is not None:
+                    archive_url = variant["url"]
+                    archive_sha256_hash = variant["sha256"]
+                    archive_size_bytes = int(variant["size_bytes"])
+                if upgrade_plan is not None or not seven_z_exe_path or \
+                   (archive_cache is not None and archive_cache.lookup(archive_sha256_hash)):
+                    # A cached archive beats any download, pipelined or not, and an in-place
+                    # upgrade picks individual files out of the archive.
+                    streaming_archive = None
+                else:
+                    streaming_archive = self._select_streaming_archive(current_python_7z_url, variant)
+                if variant is not None and not streaming_archive:
+                    estimate = estimated_install_seconds(variant, self._expected_bytes_per_second())
+                    self._log("Using the .{} archive ({:.2f}MB{}).\n".format(
+                        variant["format"], archive_size_bytes / BYTES_PER_MB,
+                        ", about {:.0f}s to download and extract at {} Mbit/s".format(estimate, self.expected_download_mbps) if estimate is not None else ""))
+                extract_dir = current_destination_dir
+                if existing_installation and upgrade_plan is None:
+                    # The installation could not be compared with the release, so the whole
+                    # archive is extracted next to it and swapped in; a failure leaves it as it was.
+                    self._log("Extracting the full release into a staging folder; the installation is replaced once it is complete.\n")
+                    staged_update = StagedUpdate(current_destination_dir, self.cancel_event)
+                    staged_update.begin()
+                    extract_dir = staged_update.staging_dir
+                if streaming_archive:
+                    # Pipelined install: each chunk is checked against its published hash
+                    # and handed to 7-Zip while later chunks are still downloading.
+                    archive_url = streaming_archive["url"]
+                    archive_sha256_hash = streaming_archive["sha256"]
+                    self._log("Using pipelined install: verified chunks are extracted while the download continues.\n")
+                    self._create_destination_dir(current_destination_dir)
+                    extractor = StreamingExtractor(seven_z_exe_path, extract_dir, cancel_event=self.cancel_event)
+
+                download_size_bytes = int(streaming_archive["size_bytes"]) if streaming_archive else archive_size_bytes
+                if current_python_7z_url != self.python_7z_url or \
+                   (archive_cache is not None and archive_cache.lookup(archive_sha256_hash)):
+                    archive_sources = [archive_url]
+                else:
+                    with self._phase("probe_sources") as span:
+                        archive_sources = self._ranked_sources(archive_url, download_size_bytes or
+                                                               (float(self.archive_size_mb) * BYTES_PER_MB if self.archive_size_mb else None),
+                                                               archive_sha256_hash)
+                        span.details["sources"] = len(archive_sources)
+                self._log("Downloading '{}'...\n".format(archive_sources[0]))
+                self._set_status("Status: Downloading .7z file...")
+            
+                downloader = ResumableDownloader(archive_url, self.download_dir,
+                                                 expected_sha256=archive_sha256_hash,
+                                                 expected_size_mb=self.archive_size_mb if archive_size_bytes is None else None,
+                                                 reporthook=self._download_progress_hook,
+                                                 cancel_event=self.cancel_event,
+                                                 log=lambda message: self._log(message + "\n"),
+                                                 connections=self.download_connections,
+                                                 expected_size_bytes=download_size_bytes,
+                                                 chunk_size=int(streaming_archive["chunk_size_bytes"]) if streaming_archive else None,
+                                                 chunk_hashes=streaming_archive["chunk_sha256"] if streaming_archive else None,
+                                                 on_verified_chunk=extractor.feed if extractor else None,
+                                                 cache=archive_cache,
+                                                 mirrors=archive_sources,
+                                                 stall_seconds=MIRROR_STALL_SECONDS,
+                                                 stall_min_bytes_per_second=MIRROR_STALL_MIN_BYTES_PER_SECOND,
+                                                 untrusted=set(archive_sources) - set(mirror_urls(archive_url, self.mirrors, self.config_version)))
+                resumed_bytes = 0
+                if downloader.has_partial():
+                    resumed_bytes = downloader.partial_size()
+                    partial_mb = resumed_bytes / BYTES_PER_MB
+                    self._log("Found partial download ({:.2f}MB), resuming...\n".format(partial_mb))
+
+                with self._phase("download") as span:
+                    span.details.update({
+                        "format": variant["format"] if variant is not None else None,
+                        "pipelined": extractor is not None,
+                        "connections": downloader.connections,
+                        "resumed_bytes": resumed_bytes,
+                    })
+                    try:
+                        if extractor is not None:
+                            extractor.start()
+                        self.temp_7z_file = downloader.download()
+                        span.bytes = os.path.getsize(self.temp_7z_file) - resumed_bytes
+                        span.details.update({
+                            "source": urlparse.urlparse(downloader.source_url).netloc,
+                            "from_cache": downloader.from_cache,
+                            "hashed_while_downloading": bool(downloader.sha256),
+                        })
+                        self._log("Download complete: {}\n".format(self.temp_7z_file))
+                    except IntegrityError, e:
+                        self.ui.show_message("Downloaded data failed verification and the installation was stopped.\n{}".format(e), "Integrity Error", "error")
+                        self._log("ERROR: {}\n".format(e))
+                        raise Exception("File integrity check failed: {}".format(e))
+                    except IOError, e:
+                        self.ui.show_message("Error downloading file: {}".format(e), "Download Error", "error")
+                        self._log("Download failed: {}\n".format(e))
+                        keep_download = True
+                        raise Exception("Download failed.")
+                    except Exception, e:
+                        self.ui.show_message("An unexpected error occurred during download: {}".format(e), "Download Error", "error")
+                        self._log("Download failed with unexpected error: {}\n".format(e))
+                        raise Exception("Unexpected download error.")
+            
+                if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
+
+                # --- 2. Verify Downloaded File Hash ---
+                self._set_status("Status: Verifying file integrity...")
+                self._log("Verifying downloaded file hash...\n")
+                self._log("Expected SHA256 hash: {}\n".format(archive_sha256_hash))
+                try:
+                    if downloader.sha256:
+                        # Computed while the archive was downloading, no second pass needed.
+                        calculated_hash = downloader.sha256
+                    else:
+                        calculated_hash = self._calculate_file_hash(self.temp_7z_file, 'sha256')
+                    self._log("Calculated SHA256 hash: {}\n".format(calculated_hash))
+                    if calculated_hash.lower() != archive_sha256_hash.lower():
+                        self.ui.show_message("Hash mismatch! Downloaded file is corrupted or tampered with.\nExpected: {}\nCalculated: {}".format(archive_sha256_hash, calculated_hash), "Integrity Error", "error")
+                        self._log("ERROR: Hash mismatch! Expected {} but calculated {}.\n".format(archive_sha256_hash, calculated_hash))
+                        raise Exception("File integrity check failed (hash mismatch).")
+                    self._log("File hash verified successfully.\n")
+                    # A verified archive is worth keeping if a later step fails.
+                    keep_download = True
+                except Exception, e:
+                    self.ui.show_message("Error calculating hash: {}".format(e), "Hash Error", "error")
+                    self._log("ERROR: Failed to calculate hash of downloaded file: {}\n".format(e))
+                    raise Exception("Failed to calculate hash.")
+
+                if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
+
+                # --- 3. Create Destination Directory (if it doesn't exist) ---
+                if extractor is None:
+                    self._create_destination_dir(current_destination_dir)
+
+                if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
+
+                # --- 4. Extract 7z Archive ---
+                self._set_progress(text="Extracting...", indeterminate=True)
+                self._set_status("Status: Extracting files...")
+                with self._phase("extract") as span:
+                    if extractor is not None:
+                        self._log("Waiting for 7-Zip to finish the pipelined extraction...\n")
+                        span.details["mode"] = "pipelined"
+                        return_code, stderr_output = extractor.finish()
+                    elif upgrade_plan is not None:
+                        new_manifest, changed, removed, file_index = upgrade_plan
+                        span.details["mode"] = "in_place_upgrade"
+                        span.files = len(changed)
+                        self._log("Upgrading in place: extracting {} changed files from '{}'...\n".format(len(changed), self.temp_7z_file))
+                        try:
+                            apply_archive_upgrade(seven_z_exe_path, self.temp_7z_file, current_destination_dir, new_manifest,
+                                                  changed, removed, self.cancel_event, file_index,
+                                                  progress=self._extraction_progress)
+                            return_code, stderr_output = 0, ""
+                        except Exception, e:
+                            if self.cancel_event.is_set():
+                                raise Exception("Installation cancelled.")
+                            return_code, stderr_output = 1, "In-place upgrade failed and was rolled back: {}".format(e)
+                    else:
+                        self._log("Extracting '{}' to '{}'...\n".format(self.temp_7z_file, extract_dir))
+                        span.details["mode"] = "archive"
+                        span.bytes = os.path.getsize(self.temp_7z_file)
+                        return_code, stderr_output = self._extract_archive(seven_z_exe_path, self.temp_7z_file, extract_dir, span)
+                    if return_code == 0 and staged_update is not None:
+                        span.details["staged"] = True
+                        try:
+                            self._replace_installation(staged_update, current_destination_dir, current_python_exe_sub_dir)
+                        except Exception, e:
+                            if self.cancel_event.is_set():
+                                raise Exception("Installation cancelled.")
+                            return_code, stderr_output = 1, "Replacing the installation failed{}: {}".format(
+                                "" if staged_update.rollback_errors else " and was rolled back", e)
+                    if return_code != 0:
+                        span.outcome = "failed"
+
+                if stderr_output:
+                    self._log("--- 7z Errors ---\n")
+                    self._log(stderr_output + "\n")
+
+                if return_code == 0:
+                    self._log("Extraction completed successfully.\n")
+                
+                    self.python_exe_path = os.path.join(current_destination_dir, current_python_exe_sub_dir, "python.exe")
+
+                    if not os.path.exists(self.python_exe_path):
+                        self._log("ERROR: Expected python.exe at '{}' but it was not found.\n".format(self.python_exe_path))
+                        self._log("Please ensure your .7z archive extracts into the structure specified in the config: '{}' relative to the destination directory.\n".format(current_python_exe_sub_dir))
+                        self.ui.show_message("Extraction completed, but python.exe not found at expected location.\nSee log for details.", "Extraction Warning", "warning")
+                        self.python_exe_path = None
+                    else:
+                        self._log("Identified Python executable at: {}\n".format(self.python_exe_path))
+                        if upgrade_plan is None:
+                            with self._phase("index_files"):
+                                self._index_installed_files(current_destination_dir, current_python_exe_sub_dir)
+
+                else:
+                    self._log("7z extraction failed with error code {}.\n".format(return_code))
+                    self.ui.show_message("7-Zip extraction failed. See log for details (Error code: {}).".format(return_code), "Extraction Error", "error")
+                    raise Exception("7-Zip extraction failed.")
+
+            if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
+
+            # --- 5. Set Python_HOME Environment Variable ---
+            if self.python_exe_path and not set_environment:
+                self._log("Leaving the environment variables unchanged.\n")
+            elif self.python_exe_path:
+                python_base_dir = os.path.dirname(self.python_exe_path)
+                self._set_status("Status: Setting {} environment variable...".format(current_env_var_name))
+                self._log("Setting user environment variable '{}' to '{}'...\n".format(current_env_var_name, python_base_dir))
+                
+                setx_command = ["setx", current_env_var_name, python_base_dir]
+                
+                with self._phase("setx_env_var") as span:
+                    setx_process = subprocess.Popen(setx_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
+                    setx_stdout_bytes, setx_stderr_bytes = setx_process.communicate()
+                    if setx_process.returncode != 0:
+                        span.outcome = "failed"
+                
+                setx_stdout = setx_stdout_bytes.decode('utf-8', errors='ignore')
+                setx_stderr = setx_stderr_bytes.decode('utf-8', errors='ignore')
+                
+                self._log("--- SETX Output for {}---\n".format(current_env_var_name))
+                if setx_stdout:
+                    self._log(setx_stdout)
+                if setx_stderr:
+                    self._log("--- SETX Errors for {}---\n".format(current_env_var_name))
+                    self._log(setx_stderr)
+
+                if setx_process.returncode == 0:
+                    self._log("Environment variable '{}' set successfully for the current user.\n".format(current_env_var_name))
+                    self._log("NOTE: This variable will be available in NEW command prompt windows or applications launched AFTER this installation.\n")
+                    
+                    self._add_to_user_path(current_env_var_name)
+
+                    self.ui.show_message("Portable Python installed and environment variables set successfully!\n\n" +
+                                         "NOTE: Environment variables will be active in new command prompt windows.\n\n" +
+                                         'Python can be accessed using "pythonCWMS" in the command prompt or scripts.',
+                                         "Installation Complete", "info")
+                else:
+                    self._log("Failed to set environment variable. SETX return code: {}.\n".format(setx_process.returncode))
+                    self.ui.show_message("Failed to set environment variable. See log for details (Error code: {}).".format(setx_process.returncode), "Environment Variable Error", "error")
+                    raise Exception("Failed to set main environment variable.")
+            else:
+                self._log("Skipping environment variable setup as python.exe path could not be determined.\n")
+                self.ui.show_message("Portable Python installed, but could not set environment variable automatically.\n" +
+                                     "Please manually set the environment variable for your Python installation.",
+                                     "Installation Partial", "warning")
+            
+            if downloader is not None and archive_cache is not None and not downloader.from_cache:
+                with self._phase("cache_store") as span:
+                    span.bytes = os.path.getsize(self.temp_7z_file)
+                    self._store_in_archive_cache(archive_cache, self.temp_7z_file, archive_sha256_hash)
+            self._start_peer_sharing()
+            keep_download = False
+            outcome = "succeeded"
+            self._installation_finished(True)
+
+        except Exception, e:
+            is_cancelled = self.cancel_event.is_set()
+            outcome, error = ("cancelled" if is_cancelled else "failed"), e
+            if is_cancelled:
+                self.ui.show_message("Installation cancelled by user.", "Installation Cancelled", "info")
+                self._log("Installation cancelled by user.\n")
+            else:
+                self.ui.show_message("An unexpected error occurred during installation: {}".format(e), "Installation Error", "error")
+                self._log("An unexpected error occurred: {}\n".format(e))
+            
+            # Cleanup partially installed directory only if it wasn't a clean cancellation.
+            # A failed upgrade has already been rolled back, so the previous installation stays.
+            if staged_update is not None and staged_update.rollback_errors:
+                self._log("{} files of the installation in '{}' could not be restored; the originals are in '{}'. Run the installer again to repair it.\n".format(
+                    len(staged_update.rollback_errors), current_destination_dir, staged_update.backup_dir))
+            elif existing_installation:
+                self._log("The existing installation in '{}' was left in place.\n".format(current_destination_dir))
+            elif not is_cancelled: 
+                self._cleanup_destination_dir(current_destination_dir)
+            
+            self._installation_finished(False, is_cancelled)
+
+        finally:
+            if extractor is not None:
+                extractor.abort()
+            if staged_update is not None:
+                staged_update.cleanup()
+            if downloader is not None and keep_download and not self.cancel_event.is_set():
+                self._log("Partial download kept in {}; it will be resumed on the next attempt.\n".format(self.download_dir))
+            elif downloader is not None:
+                try:
+                    downloader.discard()
+                    self._log("Cleaned up downloaded .7z file: {}\n".format(downloader.final_path))
+                except Exception, e:
+                    self._log("Warning: Could not remove downloaded .7z file {}: {}\n".format(downloader.final_path, e))
+            self._write_install_report(outcome, error)
+        return outcome
+
+    def _installation_finished(self, success, was_cancelled=False):
+        """Called when run() ends (success, failure, or cancellation)."""
+        self.installation_running = False
+        self.ui.install_finished(success, was_cancelled)
+
+
+# --- UI updates ---
+# Worker threads never touch Swing components directly. Their updates are
+# queued here and applied on the event thread a few times a second, so a
+# download reporting progress several times a second per connection, or a 7z
+# run printing thousands of lines, costs the UI a bounded amount of work.
+
+UI_FRAME_INTERVAL_MS = 100
+LOG_VIEW_MAX_LINES = 2000
+INSTALLER_LOG_NAME = "installer.log"
+
+
+class UiUpdateBus(ActionListener):
+    """
+    Applies UI updates posted from any thread on the Swing event thread, in
+    posting order, at most once per frame. Consecutive log text is appended
+    in one call, and an update posted with a key takes the place of a pending
+    update with the same key, so only the latest progress or status of a
+    frame is drawn. The log view keeps its last max_log_lines lines; every line also
+    goes to log_path (the previous run's log is kept as log_path + ".1").
+    """
+
+    def __init__(self, log_area, log_path=None, interval_ms=UI_FRAME_INTERVAL_MS,
+                 max_log_lines=LOG_VIEW_MAX_LINES):
+        self.log_area = log_area
+        self.log_path = log_path
+        self.max_log_lines = max_log_lines
+        self._lock = threading.Lock()
+        self._pending = []  # [kind, payload] pairs in posting order
+        self._keyed = {}
+        self._scheduled = False
+        self._closed = False
+        self._log_file = None
+        self._timer = Timer(interval_ms, self)
+        self._timer.setRepeats(False)
+        if log_path:
+            self._open_log_file(log_path)
+
+    def _open_log_file(self, log_path):
+        try:
+            if not os.path.isdir(os.path.dirname(log_path)):
+                os.makedirs(os.path.dirname(log_path))
+            if os.path.exists(log_path):
+                if os.path.exists(log_path + ".1"):
+                    os.remove(log_path + ".1")
+                os.rename(log_path, log_path + ".1")
+            self._log_file = open(log_path, "w", 1)
+            self._log_file.write("pythonCWMS installer log, started {}\n".format(time.strftime("%Y-%m-%d %H:%M:%S")))
+        except (IOError, OSError), e:
+            self._log_file = None
+            self.log_path = None
+            print("Could not open the installer log file {}: {}".format(log_path, e))
+
+    def post(self, func, key=None):
+        """Queues func for the next frame, replacing the pending update with the same key."""
+        with self._lock:
+            if key in self._keyed:
+                self._pending[self._keyed[key]][1] = func
+                return
+            if key is not None:
+                self._keyed[key] = len(self._pending)
+            self._pending.append(["call", func])
+            self._schedule()
+
+    def log(self, text):
+        """Appends text to the log view with the next frame and writes it to the log file now."""
+        if isinstance(text, unicode):
+            text = text.encode("utf-8")
+        with self._lock:
+            if self._log_file is not None:
+                try:
+                    self._log_file.write(text)
+                except (IOError, ValueError):
+                    self._log_file = None
+            if self._pending and self._pending[-1][0] == "log":
+                self._pending[-1][1].append(text)
+            else:
+                self._pending.append(["log", [text]])
+            self._schedule()
+
+    def _schedule(self):
+        # Called with the lock held. Swing timers may be started from any thread.
+        if not self._scheduled and not self._closed:
+            self._scheduled = True
+            self._timer.restart()
+
+    def actionPerformed(self, event):
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._keyed = {}
+            self._scheduled = False
+        for kind, payload in pending:
+            if kind == "log":
+                self._append_to_view("".join(payload).decode("utf-8", "replace"))
+            else:
+                try:
+                    payload()
+                except Exception, e:
+                    print("UI update failed: {}".format(e))
+
+    def _append_to_view(self, text):
+        self.log_area.append(text)
+        excess = self.log_area.getLineCount() - self.max_log_lines
+        if excess > 0:
+            self.log_area.replaceRange("", 0, self.log_area.getLineEndOffset(excess - 1))
+
+    def close(self):
+        """Stops the frame timer and closes the log file; later updates are dropped."""
+        with self._lock:
+            self._closed = True
+            self._timer.stop()
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+
+class SwingInstallUi(InstallUi):
+    """Shows the progress of the InstallerGUI's InstallEngine in its window."""
+
+    def __init__(self, gui):
+        self.gui = gui
+
+    def log(self, text):
+        self.gui._log(text)
+
+    def set_status(self, text):
+        self.gui._set_status(text)
+
+    def set_progress(self, value=None, text=None, indeterminate=False):
+        self.gui._set_progress(value, text, indeterminate)
+
+    def show_message(self, message, title, kind="info"):
+        message_type = {"error": JOptionPane.ERROR_MESSAGE, "warning": JOptionPane.WARNING_MESSAGE}.get(
+            kind, JOptionPane.INFORMATION_MESSAGE)
+        self.gui._update_ui(lambda: JOptionPane.showMessageDialog(self.gui, message, title, message_type))
+
+    def install_started(self):
+        gui = self.gui
+        gui._update_ui(lambda: gui.install_button.setEnabled(False))
+        gui._update_ui(lambda: gui.load_config_button.setEnabled(False)) # Disable load config button during install
+        gui._update_ui(lambda: gui.cancel_button.setEnabled(True))
+
+    def install_finished(self, success, was_cancelled=False):
+        gui = self.gui
+        gui._update_ui(lambda: gui.install_button.setEnabled(True))
+        gui._update_ui(lambda: gui.load_config_button.setEnabled(True)) # Re-enable load config button
+        gui._update_ui(lambda: gui.cancel_button.setEnabled(False))
+        
+        if was_cancelled:
+            gui._set_progress(0, "Cancelled")
+            gui._set_status("Status: Installation Cancelled!")
+        elif success:
+            gui._set_progress(100, "Done")
+            gui._set_status("Status: Installation Complete!")
+        else:
+            gui._set_progress(0, "Failed")
+            gui._set_status("Status: Installation Failed!")
+
 
 class InstallerGUI(JFrame):
     def __init__(self):
@@ -30,24 +3456,15 @@ class InstallerGUI(JFrame):
         # This is the starting point for the Config URL input field.
         self.default_config_url = "https://raw.githubusercontent.com/USACE-WaterManagement/pythonCWMS/refs/heads/main/pythonCWMS_config.json"
 
-        # Initialize these as None; they will be populated from the config file
-        self.python_7z_url = None
-        self.expected_sha256_hash = None
-        self.destination_dir = None
-        self.env_var_name = None
-        self.python_exe_sub_dir = None
-
-        self.python_exe_path = None
-        self.temp_7z_file = None
-        self.cancel_event = threading.Event()
+        self.engine = InstallEngine(SwingInstallUi(self))
 
         self.setup_ui()
-        self.log_area.append("Welcome to the Portable Python Installer!\n")
+        self._log("Welcome to the Portable Python Installer!\n")
         
         # Start initial config loading in a separate thread
-        self._update_ui(lambda: self.log_area.append("Attempting to load initial configuration from: {}\n".format(self.default_config_url)))
-        self._update_ui(lambda: self.status_label.setText("Status: Loading configuration..."))
-        self._update_ui(lambda: self.progress_bar.setIndeterminate(True))
+        self._log("Attempting to load initial configuration from: {}\n".format(self.default_config_url))
+        self._set_status("Status: Loading configuration...")
+        self._set_progress(indeterminate=True)
         
         config_load_thread = threading.Thread(target=self._run_load_config_in_thread, args=(self.default_config_url,))
         config_load_thread.daemon = True
@@ -120,6 +3537,9 @@ class InstallerGUI(JFrame):
         self.log_area.setLineWrap(True)
         self.log_area.setWrapStyleWord(True)
         log_scroll_pane = JScrollPane(self.log_area)
+        # Every log line and progress update from the worker threads goes through
+        # this bus; the window only shows the tail of the log, the file has all of it.
+        self.ui_bus = UiUpdateBus(self.log_area, os.path.join(self.engine.config_cache_dir, INSTALLER_LOG_NAME))
         log_scroll_pane.setBorder(BorderFactory.createTitledBorder("Installation Log"))
         log_scroll_pane.setPreferredSize(Dimension(600, 200))
 
@@ -149,77 +3569,133 @@ class InstallerGUI(JFrame):
             JOptionPane.showMessageDialog(self, "Please enter a Config URL.", "Input Error", JOptionPane.ERROR_MESSAGE)
             return
         
-        self._update_ui(lambda: self.log_area.append("Attempting to load configuration from: {}\n".format(config_url)))
-        self._update_ui(lambda: self.status_label.setText("Status: Loading configuration..."))
-        self._update_ui(lambda: self.progress_bar.setIndeterminate(True))
+        self._log("Attempting to load configuration from: {}\n".format(config_url))
+        self._set_status("Status: Loading configuration...")
+        self._set_progress(indeterminate=True)
         
         load_config_thread = threading.Thread(target=self._run_load_config_in_thread, args=(config_url,))
         load_config_thread.daemon = True
         load_config_thread.start()
 
 
+    def _apply_config(self, config_data):
+        """
+        Makes a configuration the one the installer uses (InstallEngine.apply_config).
+        Fields the user has edited since the last configuration are left alone.
+        Raises ValueError if essential keys are missing.
+        """
+        engine = self.engine
+        previous_fields = (engine.python_7z_url, engine.destination_dir, engine.env_var_name)
+        engine.apply_config(config_data)
+
+        # Update UI fields with loaded values
+        for field, previous, value in zip((self.seven_z_field, self.dest_dir_field, self.env_var_name_field),
+                                          previous_fields,
+                                          (engine.python_7z_url, engine.destination_dir, engine.env_var_name)):
+            self._update_ui(lambda field=field, previous=previous, value=value: self._set_config_field(field, previous, value))
+
+    @staticmethod
+    def _set_config_field(field, previous_value, value):
+        """Shows a configured value unless the user typed something else over the previous one."""
+        if field.getText().strip() in ("", previous_value or ""):
+            field.setText(value)
+
+    def _config_sources(self, config_url, cached_config):
+        """
+        Returns config_url and the config mirrors listed in the cached copy of
+        its configuration, the quickest to answer first.
+        """
+        urls = [config_url]
+        for mirror in (cached_config or {}).get("config_mirrors") or []:
+            if mirror and mirror not in urls:
+                urls.append(mirror)
+        if len(urls) < 2:
+            return urls
+        return [probe["url"] for probe in rank_mirrors(probe_mirrors(urls))]
+
     def _run_load_config_in_thread(self, config_url):
         """
-        Runs the config download and parsing in a separate thread.
+        Runs the config loading in a separate thread. A cached copy of the
+        configuration is shown straight away; the server is then asked (with a
+        short timeout) whether it changed, and a newer configuration replaces it.
         """
         self._update_ui(lambda: self.load_config_button.setEnabled(False))
-        self._update_ui(lambda: self.install_button.setEnabled(False))
-        
-        temp_config_filepath = None
-        try:
-            temp_config_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix=".json")
-            temp_config_filepath = temp_config_file_obj.name
-            temp_config_file_obj.close()
+        if not self.engine.installation_running:
+            self._update_ui(lambda: self.install_button.setEnabled(False))
 
-            urllib.urlretrieve(config_url, temp_config_filepath)
-            
-            with open(temp_config_filepath, 'r') as f:
-                config_data = json.load(f)
-            
-            # Populate instance variables (used by installation thread)
-            self.python_7z_url = config_data.get("python_download_url")
-            self.expected_sha256_hash = config_data.get("python_expected_hash_sha256")
-            self.destination_dir = config_data.get("default_install_directory")
-            self.env_var_name = config_data.get("default_env_var_name")
-            self.python_exe_sub_dir = config_data.get("python_exe_sub_directory")
-
-            # Validate essential fields
-            if not self.python_7z_url or not self.expected_sha256_hash or \
-               not self.destination_dir or not self.env_var_name or \
-               self.python_exe_sub_dir is None:
-                raise ValueError("Missing essential configuration keys in JSON.")
-
-            # Update UI fields with loaded values
-            self._update_ui(lambda: self.seven_z_field.setText(self.python_7z_url))
-            self._update_ui(lambda: self.dest_dir_field.setText(self.destination_dir))
-            self._update_ui(lambda: self.env_var_name_field.setText(self.env_var_name))
-            
-            self._update_ui(lambda: self.log_area.append("Configuration loaded successfully.\n"))
-            self._update_ui(lambda: self.install_button.setEnabled(True)) # Enable install button on success
-            self._update_ui(lambda: self.status_label.setText("Status: Configuration Loaded"))
-            
-        except IOError, e:
-            self._update_ui(lambda: self.log_area.append("ERROR: Failed to download configuration file from {}: {}\n".format(config_url, e)))
-            self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Failed to download configuration.\nError: {}".format(e), "Configuration Error", JOptionPane.ERROR_MESSAGE))
-            self._update_ui(lambda: self.status_label.setText("Status: Config Load Failed"))
-        except ValueError, e:
-            self._update_ui(lambda: self.log_area.append("ERROR: Failed to parse configuration JSON or missing required keys: {}\n".format(e)))
-            self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Invalid configuration file.\nError: {}".format(e), "Configuration Error", JOptionPane.ERROR_MESSAGE))
-            self._update_ui(lambda: self.status_label.setText("Status: Config Load Failed"))
+        telemetry = InstallTelemetry("config")
+        telemetry.details["config_url"] = config_url
+        outcome, error = "failed", None
+        config_cache = CachedConfig(config_url, self.engine.config_cache_dir)
+        with telemetry.phase("config_cache_read") as span:
+            cached_config = config_cache.load()
+            span.details["cached"] = cached_config is not None
+        if cached_config is not None and not self.engine.installation_running:
+            try:
+                self._apply_config(cached_config)
+                self._log("Loaded cached configuration (version {}, fetched {}); checking for updates...\n".format(
+                    self.engine.config_version, config_cache.entry.get("fetched")))
+                self._update_ui(lambda: self.install_button.setEnabled(True))
+                self._set_status("Status: Configuration Loaded (checking for updates...)")
+            except ValueError, e:
+                self._log("Ignoring cached configuration: {}\n".format(e))
+                cached_config = None
+
+        try:
+            with telemetry.phase("config_probe_mirrors") as span:
+                config_sources = self._config_sources(config_url, cached_config)
+                span.details["sources"] = len(config_sources)
+            with telemetry.phase("config_fetch") as span:
+                config_data, changed = config_cache.revalidate(config_sources)
+                span.details["changed"] = changed
+                span.details["source"] = config_cache.entry.get("source")
+            outcome = "succeeded"
+            if config_cache.entry.get("source") not in (None, config_url):
+                self._log("Configuration checked against mirror {}.\n".format(config_cache.entry["source"]))
+            if cached_config is None or changed:
+                if self.engine.installation_running:
+                    self._log("A newer configuration (version {}) is available and will be used the next time the installer starts.\n".format(
+                        config_data.get("version")))
+                else:
+                    previous_version = self.engine.config_version
+                    self._apply_config(config_data)
+                    if cached_config is None:
+                        self._log("Configuration loaded successfully.\n")
+                    else:
+                        self._log("Configuration updated from the server (version {} -> {}).\n".format(
+                            previous_version, self.engine.config_version))
+            else:
+                self._log("Cached configuration is up to date.\n")
+            if not self.engine.installation_running:
+                self._update_ui(lambda: self.install_button.setEnabled(True)) # Enable install button on success
+                self._set_status("Status: Configuration Loaded")
+
+        except (IOError, ValueError), e:
+            error = e
+            if cached_config is not None:
+                outcome = "cached"
+                self._log("Warning: Could not check {} for a newer configuration ({}); using the cached copy.\n".format(config_url, e))
+                if not self.engine.installation_running:
+                    self._set_status("Status: Configuration Loaded (cached)")
+            elif isinstance(e, IOError):
+                self._log("ERROR: Failed to download configuration file from {}: {}\n".format(config_url, e))
+                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Failed to download configuration.\nError: {}".format(e), "Configuration Error", JOptionPane.ERROR_MESSAGE))
+                self._set_status("Status: Config Load Failed")
+            else:
+                self._log("ERROR: Failed to parse configuration JSON or missing required keys: {}\n".format(e))
+                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Invalid configuration file.\nError: {}".format(e), "Configuration Error", JOptionPane.ERROR_MESSAGE))
+                self._set_status("Status: Config Load Failed")
         except Exception, e:
-            self._update_ui(lambda: self.log_area.append("ERROR: An unexpected error occurred while loading configuration: {}\n".format(e)))
-            self._update_ui(lambda: JOptionPane.showMessageDialog(self, "An unexpected error occurred during configuration loading.\nError: {}".format(e), "Configuration Error", JOptionPane.ERROR_MESSAGE))
-            self._update_ui(lambda: self.status_label.setText("Status: Config Load Failed"))
+            error = e
+            self._log("ERROR: An unexpected error occurred while loading configuration: {}\n".format(e))
+            if cached_config is None:
+                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "An unexpected error occurred during configuration loading.\nError: {}".format(e), "Configuration Error", JOptionPane.ERROR_MESSAGE))
+                self._set_status("Status: Config Load Failed")
         finally:
-            if temp_config_filepath and os.path.exists(temp_config_filepath):
-                try:
-                    os.remove(temp_config_filepath)
-                    self._update_ui(lambda: self.log_area.append("Cleaned up temporary config file: {}\n".format(temp_config_filepath)))
-                except Exception, e:
-                    self._update_ui(lambda: self.log_area.append("Warning: Could not remove temporary config file {}: {}\n".format(temp_config_filepath, e)))
-            
-            self._update_ui(lambda: self.load_config_button.setEnabled(True))
-            self._update_ui(lambda: self.progress_bar.setIndeterminate(False))
+            telemetry.finish(outcome, error)
+            self.engine.config_telemetry = telemetry
+            self._update_ui(lambda: self.load_config_button.setEnabled(not self.engine.installation_running))
+            self._set_progress()
             # If install button was enabled by success, leave it. Otherwise, leave it disabled.
 
 
@@ -227,9 +3703,9 @@ class InstallerGUI(JFrame):
         file_chooser = JFileChooser()
         file_chooser.setFileSelectionMode(JFileChooser.DIRECTORIES_ONLY)
         file_chooser.setDialogTitle("Select Installation Destination Directory")
-        # Use self.destination_dir which should be populated by config
-        if self.destination_dir:
-            file_chooser.setSelectedFile(JFile(self.destination_dir))
+        # Use self.engine.destination_dir which should be populated by config
+        if self.engine.destination_dir:
+            file_chooser.setSelectedFile(JFile(self.engine.destination_dir))
         else:
             default_user_path = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), "PortablePython")
             file_chooser.setSelectedFile(JFile(default_user_path))
@@ -237,9 +3713,9 @@ class InstallerGUI(JFrame):
         return_val = file_chooser.showSaveDialog(self)
         if return_val == JFileChooser.APPROVE_OPTION:
             selected_dir = file_chooser.getSelectedFile()
-            self.destination_dir = selected_dir.getAbsolutePath()
-            self.dest_dir_field.setText(self.destination_dir)
-            self.log_area.append("Selected Destination: {}\n".format(self.destination_dir))
+            self.engine.destination_dir = selected_dir.getAbsolutePath()
+            self.dest_dir_field.setText(self.engine.destination_dir)
+            self._log("Selected Destination: {}\n".format(self.engine.destination_dir))
     
     def cancel_installation(self, event):
         """Called when the Cancel button is pressed."""
@@ -249,356 +3725,34 @@ class InstallerGUI(JFrame):
                                                  JOptionPane.YES_NO_OPTION, 
                                                  JOptionPane.WARNING_MESSAGE)
         if response == JOptionPane.YES_OPTION:
-            self._update_ui(lambda: self.log_area.append("\nCancellation requested by user...\n"))
-            self._update_ui(lambda: self.status_label.setText("Status: Cancelling..."))
-            self.cancel_event.set()
+            self._log("\nCancellation requested by user...\n")
+            self._set_status("Status: Cancelling...")
+            self.engine.cancel_event.set()
             self._update_ui(lambda: self.cancel_button.setEnabled(False))
 
-    def _update_ui(self, callable_func):
-        SwingUtilities.invokeLater(callable_func)
-
-    def _download_progress_hook(self, blocks_transferred, block_size, total_size):
-        """Callback for urllib.urlretrieve to update download progress."""
-        if self.cancel_event.is_set():
-            raise IOError("Download cancelled by user.")
-
-        if total_size > 0:
-            percentage = int(100.0 * blocks_transferred * block_size / total_size)
-            if percentage > 100:
-                percentage = 100
-            self._update_ui(lambda: self.progress_bar.setValue(percentage))
-            self._update_ui(lambda: self.progress_bar.setString("Downloading: {}%".format(percentage)))
-            
-            downloaded_mb = (blocks_transferred * block_size) / (1024.0 * 1024.0)
-            total_mb = total_size / (1024.0 * 1024.0)
-            self._update_ui(lambda: self.status_label.setText("Status: Downloading {:.2f}MB / {:.2f}MB".format(downloaded_mb, total_mb)))
-        else:
-            self._update_ui(lambda: self.progress_bar.setIndeterminate(True))
-            self._update_ui(lambda: self.status_label.setText("Status: Downloading (size unknown)..."))
-
-    @staticmethod
-    def _calculate_file_hash(filepath, hash_algo='sha256', block_size=65536):
-        """Calculates the hash of a file."""
-        hasher = hashlib.new(hash_algo)
-        try:
-            with open(filepath, 'rb') as f:
-                buf = f.read(block_size)
-                while len(buf) > 0:
-                    hasher.update(buf)
-                    buf = f.read(block_size)
-            return hasher.hexdigest()
-        except Exception, e:
-            raise Exception("Failed to calculate hash of {}: {}".format(filepath, e))
-
-    def _add_to_user_path(self, env_var_name):
-        """
-        Checks if %ENV_VAR_NAME% and %ENV_VAR_NAME%\Scripts are in the user's PATH
-        and adds them if they are not.
-        """
-        self._update_ui(lambda: self.log_area.append("\nChecking/updating user PATH...\n"))
-        current_user_path = ""
-        
-        try:
-            reg_query_cmd = ["reg", "query", "HKCU\\Environment", "/v", "Path"]
-            reg_process = subprocess.Popen(reg_query_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-            reg_stdout_bytes, reg_stderr_bytes = reg_process.communicate()
-            
-            reg_stdout = reg_stdout_bytes.decode('utf-8', errors='ignore')
-            
-            if reg_process.returncode == 0:
-                for line in reg_stdout.splitlines():
-                    if "REG_EXPAND_SZ" in line or "REG_SZ" in line:
-                        parts = line.split("    ") 
-                        if len(parts) >= 3:
-                            current_user_path = parts[3].strip()
-                            break
-            else:
-                self._update_ui(lambda: self.log_area.append("Warning: Could not read current user PATH from registry. Error: {}\n".format(reg_stderr_bytes.decode('utf-8', errors='ignore'))))
-        except Exception, e:
-            self._update_ui(lambda: self.log_area.append("Warning: Error querying registry for PATH: {}\n".format(e)))
-        
-        paths_to_add_str = [
-            "%{}%".format(env_var_name),
-            "%{}%\\Scripts".format(env_var_name)
-        ]
-        
-        expanded_paths_to_add = [os.path.normpath(os.path.expandvars(p)) for p in paths_to_add_str]
-
-        current_paths_normalized = [os.path.normpath(os.path.expandvars(p)) for p in current_user_path.split(os.pathsep) if p]
-        
-        new_paths_for_setx = []
-        for i, path_to_check in enumerate(expanded_paths_to_add):
-            if path_to_check not in current_paths_normalized:
-                new_paths_for_setx.append(paths_to_add_str[i])
-
-        if new_paths_for_setx:
-            self._update_ui(lambda: self.log_area.append("Adding {} to user PATH...\n".format(", ".join(new_paths_for_setx))))
-            
-            new_path_value = current_user_path
-            if new_path_value and not new_path_value.endswith(os.pathsep):
-                new_path_value += os.pathsep
-
-            new_path_value += os.pathsep.join(new_paths_for_setx)
-
-            setx_path_cmd = ["setx", "Path", new_path_value]
-            try:
-                setx_path_process = subprocess.Popen(setx_path_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-                setx_path_stdout_bytes, setx_path_stderr_bytes = setx_path_process.communicate()
-                
-                setx_path_stdout = setx_path_stdout_bytes.decode('utf-8', errors='ignore')
-                setx_path_stderr = setx_path_stderr_bytes.decode('utf-8', errors='ignore')
-
-                if setx_path_process.returncode == 0:
-                    self._update_ui(lambda: self.log_area.append("Successfully added to user PATH.\n"))
-                    self._update_ui(lambda: self.log_area.append("SETX PATH Output: {}\n".format(setx_path_stdout)))
-                    self._update_ui(lambda: self.log_area.append("\nIMPORTANT: User PATH changes will be available in NEW command prompt windows.\n"))
-                    self._update_ui(lambda: self.log_area.append('\nUser can launch python with "pythonCWMS" in the command prompt window.\n'))
-                else:
-                    self._update_ui(lambda: self.log_area.append("Failed to add to user PATH. Error: {}. Output: {}\n".format(setx_path_stderr, setx_path_stdout)))
-            except Exception, e:
-                self._update_ui(lambda: self.log_area.append("Error executing SETX for PATH: {}\n".format(e)))
-        else:
-            self._update_ui(lambda: self.log_area.append("User PATH already contains required Python entries. No changes made.\n"))
-
-
-    def _cleanup_destination_dir(self, path):
-        """Removes the destination directory and its contents."""
-        if os.path.exists(path):
-            self._update_ui(lambda: self.log_area.append("Cleaning up partially installed directory: {}\n".format(path)))
-            self._update_ui(lambda: self.status_label.setText("Status: Cleaning up..."))
-            try:
-                shutil.rmtree(path)
-                self._update_ui(lambda: self.log_area.append("Cleaned up: {}\n".format(path)))
-            except Exception, e:
-                self._update_ui(lambda: self.log_area.append("Warning: Failed to clean up directory {}: {}\n".format(path, e)))
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Warning: Could not fully clean up directory {}. Please close any open python instances and " \
-                "try again or remove it manually if needed.\nError: {}".format(path, e), "Cleanup Warning", JOptionPane.WARNING_MESSAGE))
-
-
-    def _run_installation_in_thread(self, current_python_7z_url, current_expected_sha256_hash, current_destination_dir, current_env_var_name, current_python_exe_sub_dir, seven_z_exe_path):
-        """
-        This method runs in a separate thread to perform the download, extraction,
-        and environment variable setup, using the *current* values from the UI fields.
-        """
-        self.temp_7z_file = None
-        self.cancel_event.clear()
-        
-        try:
-            self._update_ui(lambda: self.install_button.setEnabled(False))
-            self._update_ui(lambda: self.load_config_button.setEnabled(False)) # Disable load config button during install
-            self._update_ui(lambda: self.cancel_button.setEnabled(True))
-            self._update_ui(lambda: self.progress_bar.setIndeterminate(False))
-            self._update_ui(lambda: self.progress_bar.setValue(0))
-            self._update_ui(lambda: self.progress_bar.setString("Starting..."))
-            self._update_ui(lambda: self.status_label.setText("Status: Initializing installation..."))
-            self._update_ui(lambda: self.log_area.append("\nStarting installation process...\n"))
-
-            if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
-
-            # --- 1. Download .7z file ---
-            self._update_ui(lambda: self.log_area.append("Downloading '{}'...\n".format(current_python_7z_url)))
-            self._update_ui(lambda: self.status_label.setText("Status: Downloading .7z file..."))
-            
-            temp_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix=".7z")
-            self.temp_7z_file = temp_file_obj.name
-            temp_file_obj.close()
-
-            try:
-                urllib.urlretrieve(current_python_7z_url, self.temp_7z_file, reporthook=self._download_progress_hook)
-                self._update_ui(lambda: self.log_area.append("Download complete: {}\n".format(self.temp_7z_file)))
-            except IOError, e:
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Error downloading file: {}".format(e), "Download Error", JOptionPane.ERROR_MESSAGE))
-                self._update_ui(lambda: self.log_area.append("Download failed: {}\n".format(e)))
-                raise Exception("Download failed.")
-            except Exception, e:
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "An unexpected error occurred during download: {}".format(e), "Download Error", JOptionPane.ERROR_MESSAGE))
-                self._update_ui(lambda: self.log_area.append("Download failed with unexpected error: {}\n".format(e)))
-                raise Exception("Unexpected download error.")
-            
-            if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
-
-            # --- 2. Verify Downloaded File Hash ---
-            self._update_ui(lambda: self.status_label.setText("Status: Verifying file integrity..."))
-            self._update_ui(lambda: self.log_area.append("Verifying downloaded file hash...\n"))
-            self._update_ui(lambda: self.log_area.append("Expected SHA256 hash: {}\n".format(current_expected_sha256_hash)))
-            try:
-                calculated_hash = self._calculate_file_hash(self.temp_7z_file, 'sha256')
-                self._update_ui(lambda: self.log_area.append("Calculated SHA256 hash: {}\n".format(calculated_hash)))
-                if calculated_hash.lower() != current_expected_sha256_hash.lower():
-                    self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Hash mismatch! Downloaded file is corrupted or tampered with.\nExpected: {}\nCalculated: {}".format(current_expected_sha256_hash, calculated_hash), "Integrity Error", JOptionPane.ERROR_MESSAGE))
-                    self._update_ui(lambda: self.log_area.append("ERROR: Hash mismatch! Expected {} but calculated {}.\n".format(current_expected_sha256_hash, calculated_hash)))
-                    raise Exception("File integrity check failed (hash mismatch).")
-                self._update_ui(lambda: self.log_area.append("File hash verified successfully.\n"))
-            except Exception, e:
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Error calculating hash: {}".format(e), "Hash Error", JOptionPane.ERROR_MESSAGE))
-                self._update_ui(lambda: self.log_area.append("ERROR: Failed to calculate hash of downloaded file: {}\n".format(e)))
-                raise Exception("Failed to calculate hash.")
-
-            if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
-
-            # --- 3. Create Destination Directory (if it doesn't exist) ---
-            self._update_ui(lambda: self.status_label.setText("Status: Creating destination directory..."))
-            try:
-                if not os.path.exists(current_destination_dir):
-                    os.makedirs(current_destination_dir)
-                    self._update_ui(lambda: self.log_area.append("Created destination directory: {}\n".format(current_destination_dir)))
-                else:
-                    self._update_ui(lambda: self.log_area.append("Destination directory already exists: {}\n".format(current_destination_dir)))
-            except Exception, e:
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Error creating destination directory: {}".format(e), "Directory Error", JOptionPane.ERROR_MESSAGE))
-                self._update_ui(lambda: self.log_area.append("Error creating destination directory: {}\n".format(e)))
-                raise Exception("Failed to create destination directory.")
-
-            if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
-
-            # --- 4. Extract 7z Archive ---
-            self._update_ui(lambda: self.progress_bar.setIndeterminate(True))
-            self._update_ui(lambda: self.progress_bar.setString("Extracting..."))
-            self._update_ui(lambda: self.status_label.setText("Status: Extracting files..."))
-            self._update_ui(lambda: self.log_area.append("Extracting '{}' to '{}'...\n".format(self.temp_7z_file, current_destination_dir)))
-            
-            command = [
-                seven_z_exe_path,
-                "x",
-                self.temp_7z_file,
-                "-o{}".format(current_destination_dir),
-                "-y"
-            ]
-
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-            
-            while True:
-                if self.cancel_event.is_set():
-                    self._update_ui(lambda: self.log_area.append("Cancellation requested during extraction. Terminating 7z.exe...\n"))
-                    try:
-                        process.terminate()
-                    except Exception, e:
-                        self._update_ui(lambda: self.log_area.append("Warning: Could not terminate 7z.exe process: {}\n".format(e)))
-                    raise Exception("Installation cancelled.")
-
-                output_line = process.stdout.readline()
-                if output_line == '' and process.poll() is not None:
-                    break
-                if output_line:
-                    decoded_line = output_line.decode('utf-8', errors='ignore').strip()
-                    self._update_ui(lambda: self.log_area.append(decoded_line + "\n"))
-                    if decoded_line.startswith("Extracting "):
-                        filename = decoded_line[len("Extracting "):].split('\n')[0].strip()
-                        self._update_ui(lambda: self.status_label.setText("Status: Extracting " + filename))
-
-            stderr_output = process.stderr.read().decode('utf-8', errors='ignore')
-
-            if stderr_output:
-                self._update_ui(lambda: self.log_area.append("--- 7z Errors ---\n"))
-                self._update_ui(lambda: self.log_area.append(stderr_output + "\n"))
-
-            if process.returncode == 0:
-                self._update_ui(lambda: self.log_area.append("7z extraction completed successfully.\n"))
-                
-                self.python_exe_path = os.path.join(current_destination_dir, current_python_exe_sub_dir, "python.exe")
-
-                if not os.path.exists(self.python_exe_path):
-                    self._update_ui(lambda: self.log_area.append("ERROR: Expected python.exe at '{}' but it was not found.\n".format(self.python_exe_path)))
-                    self._update_ui(lambda: self.log_area.append("Please ensure your .7z archive extracts into the structure specified in the config: '{}' relative to the destination directory.\n".format(current_python_exe_sub_dir)))
-                    self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Extraction completed, but python.exe not found at expected location.\nSee log for details.", "Extraction Warning", JOptionPane.WARNING_MESSAGE))
-                    self.python_exe_path = None
-                else:
-                    self._update_ui(lambda: self.log_area.append("Identified Python executable at: {}\n".format(self.python_exe_path)))
-
-            else:
-                self._update_ui(lambda: self.log_area.append("7z extraction failed with error code {}.\n".format(process.returncode)))
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "7-Zip extraction failed. See log for details (Error code: {}).".format(process.returncode), "Extraction Error", JOptionPane.ERROR_MESSAGE))
-                raise Exception("7-Zip extraction failed.")
-
-            if self.cancel_event.is_set(): raise Exception("Installation cancelled.")
-
-            # --- 5. Set Python_HOME Environment Variable ---
-            if self.python_exe_path:
-                python_base_dir = os.path.dirname(self.python_exe_path)
-                self._update_ui(lambda: self.status_label.setText("Status: Setting {} environment variable...".format(current_env_var_name)))
-                self._update_ui(lambda: self.log_area.append("Setting user environment variable '{}' to '{}'...\n".format(current_env_var_name, python_base_dir)))
-                
-                setx_command = ["setx", current_env_var_name, python_base_dir]
-                
-                setx_process = subprocess.Popen(setx_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-                setx_stdout_bytes, setx_stderr_bytes = setx_process.communicate()
-                
-                setx_stdout = setx_stdout_bytes.decode('utf-8', errors='ignore')
-                setx_stderr = setx_stderr_bytes.decode('utf-8', errors='ignore')
-                
-                self._update_ui(lambda: self.log_area.append("--- SETX Output for {}---\n".format(current_env_var_name)))
-                if setx_stdout:
-                    self._update_ui(lambda: self.log_area.append(setx_stdout))
-                if setx_stderr:
-                    self._update_ui(lambda: self.log_area.append("--- SETX Errors for {}---\n".format(current_env_var_name)))
-                    self._update_ui(lambda: self.log_area.append(setx_stderr))
-
-                if setx_process.returncode == 0:
-                    self._update_ui(lambda: self.log_area.append("Environment variable '{}' set successfully for the current user.\n".format(current_env_var_name)))
-                    self._update_ui(lambda: self.log_area.append("NOTE: This variable will be available in NEW command prompt windows or applications launched AFTER this installation.\n"))
-                    
-                    self._add_to_user_path(current_env_var_name)
-
-                    self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Portable Python installed and environment variables set successfully!\n\n" +
-                                                               "NOTE: Environment variables will be active in new command prompt windows.\n\n" + 
-                                                               'Python can be accessed using "pythonCWMS" in the command prompt or scripts.',
-                                                               "Installation Complete", JOptionPane.INFORMATION_MESSAGE))
-                else:
-                    self._update_ui(lambda: self.log_area.append("Failed to set environment variable. SETX return code: {}.\n".format(setx_process.returncode)))
-                    self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Failed to set environment variable. See log for details (Error code: {}).".format(setx_process.returncode), "Environment Variable Error", JOptionPane.ERROR_MESSAGE))
-                    raise Exception("Failed to set main environment variable.")
-            else:
-                self._update_ui(lambda: self.log_area.append("Skipping environment variable setup as python.exe path could not be determined.\n"))
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Portable Python installed, but could not set environment variable automatically.\n" +
-                                                                   "Please manually set the environment variable for your Python installation.",
-                                                                   "Installation Partial", JOptionPane.WARNING_MESSAGE))
-            
-            self._installation_finished(True)
-
-        except Exception, e:
-            is_cancelled = self.cancel_event.is_set()
-            if is_cancelled:
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "Installation cancelled by user.", "Installation Cancelled", JOptionPane.INFORMATION_MESSAGE))
-                self._update_ui(lambda: self.log_area.append("Installation cancelled by user.\n"))
-            else:
-                self._update_ui(lambda: JOptionPane.showMessageDialog(self, "An unexpected error occurred during installation: {}".format(e), "Installation Error", JOptionPane.ERROR_MESSAGE))
-                self._update_ui(lambda: self.log_area.append("An unexpected error occurred: {}\n".format(e)))
-            
-            # Cleanup partially installed directory only if it wasn't a clean cancellation
-            if not is_cancelled: 
-                self._cleanup_destination_dir(current_destination_dir)
-            
-            self._installation_finished(False, is_cancelled)
+    def _update_ui(self, callable_func, key=None):
+        """Runs callable_func on the Swing thread with the next UI frame; see UiUpdateBus."""
+        self.ui_bus.post(callable_func, key)
 
-        finally:
-            if self.temp_7z_file and os.path.exists(self.temp_7z_file):
-                try:
-                    os.remove(self.temp_7z_file)
-                    self._update_ui(lambda: self.log_area.append("Cleaned up temporary .7z file: {}\n".format(self.temp_7z_file)))
-                except Exception, e:
-                    self._update_ui(lambda: self.log_area.append("Warning: Could not remove temporary .7z file {}: {}\n".format(self.temp_7z_file, e)))
+    def _log(self, text):
+        self.ui_bus.log(text)
 
+    def _set_status(self, text):
+        self._update_ui(lambda: self.status_label.setText(text), key="status")
 
-    def _installation_finished(self, success, was_cancelled=False):
-        """Called when the installation thread completes (success, failure, or cancellation)."""
-        self._update_ui(lambda: self.install_button.setEnabled(True))
-        self._update_ui(lambda: self.load_config_button.setEnabled(True)) # Re-enable load config button
-        self._update_ui(lambda: self.cancel_button.setEnabled(False))
-        self._update_ui(lambda: self.progress_bar.setIndeterminate(False))
-        
-        if was_cancelled:
-            self._update_ui(lambda: self.progress_bar.setString("Cancelled"))
-            self._update_ui(lambda: self.status_label.setText("Status: Installation Cancelled!"))
-            self._update_ui(lambda: self.progress_bar.setValue(0))
-        elif success:
-            self._update_ui(lambda: self.progress_bar.setString("Done"))
-            self._update_ui(lambda: self.status_label.setText("Status: Installation Complete!"))
-            self._update_ui(lambda: self.progress_bar.setValue(100))
-        else:
-            self._update_ui(lambda: self.progress_bar.setString("Failed"))
-            self._update_ui(lambda: self.status_label.setText("Status: Installation Failed!"))
-            self._update_ui(lambda: self.progress_bar.setValue(0))
+    def _set_progress(self, value=None, text=None, indeterminate=False):
+        """Sets the whole progress bar state; only the latest state per frame is shown."""
+        def apply():
+            self.progress_bar.setIndeterminate(indeterminate)
+            if value is not None:
+                self.progress_bar.setValue(value)
+            if text is not None:
+                self.progress_bar.setString(text)
+        self._update_ui(apply, key="progress")
 
+    def dispose(self):
+        self.ui_bus.close()
+        super(InstallerGUI, self).dispose()
 
     def perform_installation(self, event):
         # Retrieve current values from UI fields, as user might have changed them
@@ -607,40 +3761,40 @@ class InstallerGUI(JFrame):
         current_env_var_name = self.env_var_name_field.getText().strip()
         
         # These values come from the last successful config load
-        current_expected_sha256_hash = self.expected_sha256_hash 
-        current_python_exe_sub_dir = self.python_exe_sub_dir
+        current_expected_sha256_hash = self.engine.expected_sha256_hash 
+        current_python_exe_sub_dir = self.engine.python_exe_sub_dir
 
 
-        self.log_area.setText("")
-        self.log_area.append("Starting pre-installation checks...\n")
+        self._update_ui(lambda: self.log_area.setText(""))
+        self._log("Starting pre-installation checks...\n")
 
         # --- 1. Validate Inputs (from UI) ---
         if not current_python_7z_url:
             JOptionPane.showMessageDialog(self, "Please enter a Python .7z URL.", "Input Error", JOptionPane.ERROR_MESSAGE)
-            self.log_area.append("Error: Python .7z URL is empty.\n")
+            self._log("Error: Python .7z URL is empty.\n")
             return
         if not (current_python_7z_url.startswith("http://") or current_python_7z_url.startswith("https://")):
             JOptionPane.showMessageDialog(self, "Please enter a valid URL (must start with http:// or https://).", "Input Error", JOptionPane.ERROR_MESSAGE)
-            self.log_area.append("Error: Invalid URL format.\n")
+            self._log("Error: Invalid URL format.\n")
             return
 
         if not current_destination_dir:
             JOptionPane.showMessageDialog(self, "Please select an installation destination directory.", "Input Error", JOptionPane.ERROR_MESSAGE)
-            self.log_area.append("Error: No destination directory selected.\n")
+            self._log("Error: No destination directory selected.\n")
             return
         if not current_env_var_name:
             JOptionPane.showMessageDialog(self, "Please enter an environment variable name.", "Input Error", JOptionPane.ERROR_MESSAGE)
-            self.log_area.append("Error: Environment variable name is empty.\n")
+            self._log("Error: Environment variable name is empty.\n")
             return
         
         # Validate that config values are present (meaning config was loaded successfully)
         if not current_expected_sha256_hash or len(current_expected_sha256_hash) != 64:
              JOptionPane.showMessageDialog(self, "Internal Error: Expected SHA256 hash is missing or invalid. Please load configuration first.", "Input Error", JOptionPane.ERROR_MESSAGE)
-             self.log_area.append("Error: Expected SHA256 hash is missing or invalid from config.\n")
+             self._log("Error: Expected SHA256 hash is missing or invalid from config.\n")
              return
         if current_python_exe_sub_dir is None:
              JOptionPane.showMessageDialog(self, "Internal Error: Python executable sub-directory is missing from config. Please load configuration first.", "Input Error", JOptionPane.ERROR_MESSAGE)
-             self.log_area.append("Error: Python executable sub-directory is missing from config.\n")
+             self._log("Error: Python executable sub-directory is missing from config.\n")
              return
 
 
@@ -655,7 +3809,7 @@ class InstallerGUI(JFrame):
 
         if os.path.exists(standard_7z_path):
             seven_z_exe_path = standard_7z_path
-            self.log_area.append("Using system-wide 7z.exe at: {}\n".format(seven_z_exe_path))
+            self._log("Using system-wide 7z.exe at: {}\n".format(seven_z_exe_path))
         else:
             script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
             bundled_7z_path_1 = os.path.join(script_dir, "7z", "7z.exe")
@@ -663,22 +3817,24 @@ class InstallerGUI(JFrame):
 
             if os.path.exists(bundled_7z_path_1):
                 seven_z_exe_path = bundled_7z_path_1
-                self.log_area.append("Using bundled 7z.exe at: {}\n".format(seven_z_exe_path))
+                self._log("Using bundled 7z.exe at: {}\n".format(seven_z_exe_path))
             elif os.path.exists(bundled_7z_path_2):
                 seven_z_exe_path = bundled_7z_path_2
-                self.log_area.append("Using bundled 7z.exe at: {}\n".format(seven_z_exe_path))
+                self._log("Using bundled 7z.exe at: {}\n".format(seven_z_exe_path))
+            elif self.engine.zip_archive_available(current_python_7z_url):
+                self._log("7z.exe not found; the .zip archive will be extracted by the built-in extractor.\n")
             else:
                 JOptionPane.showMessageDialog(self, "Error: 7z.exe not found.\nAttempted: '{}', '{}', and '{}'.\nPlease ensure 7-Zip is installed or '7z.exe' is bundled correctly.".format(standard_7z_path, bundled_7z_path_1, bundled_7z_path_2), "Error", JOptionPane.ERROR_MESSAGE)
-                self.log_area.append("Error: 7z.exe not found at any expected location.\n")
+                self._log("Error: 7z.exe not found at any expected location.\n")
                 return
         
-        if not seven_z_exe_path:
+        if not seven_z_exe_path and not self.engine.zip_archive_available(current_python_7z_url):
             JOptionPane.showMessageDialog(self, "Internal Error: 7z.exe path could not be determined.", "Error", JOptionPane.ERROR_MESSAGE)
-            self.log_area.append("Internal Error: 7z.exe path could not be determined after all checks.\n")
+            self._log("Internal Error: 7z.exe path could not be determined after all checks.\n")
             return
 
         # --- Start installation in a new thread ---
-        installation_thread = threading.Thread(target=self._run_installation_in_thread, 
+        installation_thread = threading.Thread(target=self.engine.run, 
                                              args=(current_python_7z_url, current_expected_sha256_hash, current_destination_dir, current_env_var_name, current_python_exe_sub_dir, seven_z_exe_path))
         installation_thread.daemon = True
         installation_thread.start()
@@ -0,0 +1,747 @@
+"""
+Runs pythonCWMS scripts from the CAVI. The example launchers
+(example_python_script_launcher.py and example_batch_launcher.py) hold only
+their settings and call run_script() or run_batch() here; this module ships
+with pythonCWMS in its jython_scripts folder.
+
+run_script() runs one script in the warm pythonCWMS worker
+(python_scripts/pythoncwms_worker.py) or in a new python.exe, streams its
+output to the CAVI console (and optionally a rotating log file), and can
+replay the result of an identical earlier run from the result cache.
+run_batch() runs many independent scripts in parallel and prints a summary.
+Both tell each script its job name and where the job state is kept (see
+python_scripts/pythoncwms_state.py).
+"""
+import os
+import subprocess
+import json
+import socket
+import time
+import hashlib
+import tempfile
+import glob
+import shutil
+import threading
+import Queue
+import collections
+import logging
+import logging.handlers
+
+from java.lang import Runtime
+
+
+def local_dir():
+    """Per-user folder for the worker state, the result cache and the job state."""
+    return os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(), "pythonCWMS")
+
+
+def find_pythoncwms():
+    """Returns (PYTHON_CWMS_HOME, path of python.exe), or (None, None) if PYTHON_CWMS_HOME is not set."""
+    # 1. Get the expanded pythonCWMS directory from the environment variable
+    pythoncwms_home = os.environ.get('PYTHON_CWMS_HOME')  # Get the value of PYTHON_CWMS_HOME
+    if not pythoncwms_home:
+        print("Error: PYTHON_CWMS_HOME environment variable not set.")
+        return None, None
+
+    # 2. Construct the pythonCWMS directory path using os.path.join
+    pythoncwms_path = os.path.join(pythoncwms_home, "python.exe") # Path to the executable
+
+    # 3. Check if the pythonCWMS_dir is in the PATH
+    current_path = os.environ.get('PATH', '')
+    if pythoncwms_home not in current_path:
+        os.environ['PATH'] = pythoncwms_home + os.pathsep + current_path
+        print("Updated PATH:", os.environ['PATH'])
+    else:
+        print("pythonCWMS directory already in PATH.")
+
+    # 4. Check that python.exe exists (no need to start an interpreter just to test it)
+    if os.path.exists(pythoncwms_path):
+        print("Found pythonCWMS at: {}".format(pythoncwms_path))
+    else:
+        print("pythonCWMS not found at {}. Check PYTHON_CWMS_HOME.".format(pythoncwms_path))
+    return pythoncwms_home, pythoncwms_path
+
+
+def python_scripts_dir(pythoncwms_home):
+    return os.path.normpath(os.path.join(pythoncwms_home, os.pardir, "python_scripts"))
+
+
+def default_job_name(script_path, script_args):
+    """The script's file name, plus a hash of its args if there are any."""
+    name = os.path.splitext(os.path.basename(script_path))[0]
+    if script_args:
+        name += "-" + hashlib.sha1("\0".join(script_args)).hexdigest()[:8]
+    return name
+
+
+def script_environment(pythoncwms_home, job_name=None):
+    """
+    The environment for a script: the script finds its job state through
+    PYTHON_CWMS_JOB and PYTHON_CWMS_STATE, and imports pythoncwms_state from
+    python_scripts, which is put on its PYTHONPATH.
+    """
+    env = dict(os.environ)
+    if job_name:
+        env["PYTHON_CWMS_JOB"] = job_name
+    if not env.get("PYTHON_CWMS_STATE"):
+        env["PYTHON_CWMS_STATE"] = os.path.join(local_dir(), "job_state.sqlite3")
+    env["PYTHONPATH"] = os.pathsep.join(path for path in [python_scripts_dir(pythoncwms_home), env.get("PYTHONPATH")] if path)
+    return env
+
+
+def split_setting(value):
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def expand_paths(patterns, base_dir):
+    """Absolute paths matching the comma separated patterns; a pattern matching nothing is kept as is."""
+    paths = []
+    for pattern in split_setting(patterns):
+        pattern = os.path.join(base_dir, os.path.expandvars(pattern))
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return [os.path.abspath(path) for path in paths]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- Output ---
+
+class OutputForwarder(object):
+    """
+    Forwards script output line by line to the CAVI console and, optionally,
+    to a rotating log file. Only the current partial line of each stream is
+    held in memory, so memory use stays flat however much the script writes.
+    """
+
+    MAX_LINE = 64 * 1024
+
+    def __init__(self, log_path=None, log_max_mb=10, log_backups=3, console_max_lines=0, capture_max_bytes=0):
+        self.log_path = log_path
+        self.console_max_lines = console_max_lines
+        self.console_lines = 0
+        self.total_lines = 0
+        # With capture_max_bytes, the output is also kept (up to that size) for the result cache.
+        self.capture_max_bytes = capture_max_bytes
+        self.captured = [] if capture_max_bytes else None
+        self.captured_bytes = 0
+        self._partial = {"stdout": "", "stderr": ""}
+        self._logger = None
+        if log_path:
+            self._logger = logging.getLogger("pythonCWMS.output.{}".format(id(self)))
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=int(log_max_mb * 1024 * 1024),
+                                                           backupCount=log_backups)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._logger.addHandler(handler)
+
+    def write(self, stream, text):
+        if self.captured is not None:
+            self.captured_bytes += len(text)
+            if self.captured_bytes > self.capture_max_bytes:
+                self.captured = None
+            else:
+                append_output(self.captured, stream, text)
+        text = self._partial[stream] + text.replace('\r\n', '\n')
+        lines = text.split('\n')
+        self._partial[stream] = lines.pop()
+        if len(self._partial[stream]) > self.MAX_LINE:
+            lines.append(self._partial[stream])
+            self._partial[stream] = ""
+        for line in lines:
+            self._emit(stream, line)
+
+    def _emit(self, stream, line):
+        self.total_lines += 1
+        if stream == "stderr":
+            line = "[stderr] " + line
+        if self._logger:
+            self._logger.info(line)
+        if not self.console_max_lines or self.console_lines < self.console_max_lines:
+            print(line)
+            self.console_lines += 1
+            if self.console_lines == self.console_max_lines:
+                print("... console output limit of {} lines reached{}".format(
+                    self.console_max_lines, ", see {}".format(self.log_path) if self._logger else ""))
+
+    def close(self):
+        for stream in ("stdout", "stderr"):
+            if self._partial[stream]:
+                self._emit(stream, self._partial[stream])
+                self._partial[stream] = ""
+        if self._logger:
+            for handler in self._logger.handlers[:]:
+                handler.close()
+                self._logger.removeHandler(handler)
+
+
+def stream_process_output(process, forwarder, max_queued=256):
+    """Reads both pipes of process concurrently and forwards them until it exits; returns the exit code."""
+    chunks = Queue.Queue(max_queued)  # Bounded: a slow console holds back the script, not the heap.
+
+    def read_pipe(name, pipe):
+        try:
+            while True:
+                data = pipe.readline(OutputForwarder.MAX_LINE)
+                if not data:
+                    break
+                chunks.put((name, data.decode('utf-8', 'replace')))
+        finally:
+            chunks.put((name, None))
+
+    for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr)):
+        reader = threading.Thread(target=read_pipe, args=(name, pipe))
+        reader.daemon = True
+        reader.start()
+    open_pipes = 2
+    while open_pipes:
+        name, data = chunks.get()
+        if data is None:
+            open_pipes -= 1
+        else:
+            forwarder.write(name, data)
+    return process.wait()
+
+
+def append_output(chunks, stream, text):
+    """Adds text to a list of [stream, text] chunks, merging it into the last chunk of the same stream."""
+    if chunks and chunks[-1][0] == stream:
+        chunks[-1][1] += text
+    else:
+        chunks.append([stream, text])
+
+
+# --- Result cache ---
+
+class ResultCache(object):
+    """
+    Results of earlier script runs, one folder per key under root holding
+    result.json (return code and the output, in order) and copies of the
+    output files. The key covers the script's content, its args, the
+    interpreter, the selected environment variables and the content of the
+    input files. Entries are written to a temporary folder and renamed into
+    place, so several CAVI sessions can share the cache. A hit refreshes the
+    entry's time stamp, which evict() uses to drop the least recently used.
+    """
+
+    def __init__(self, root, ttl_seconds, max_bytes):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def key(self, script_path, script_args, interpreter, env_names, input_paths):
+        parts = {
+            "script": file_sha256(script_path),
+            "args": script_args,
+            "interpreter": os.path.normcase(os.path.abspath(interpreter)),
+            # Values are only hashed; they may hold credentials.
+            "env": [[name, os.environ.get(name)] for name in env_names],
+            "inputs": [[path, file_sha256(path) if os.path.isfile(path) else None] for path in input_paths],
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True)).hexdigest()
+
+    def lookup(self, key):
+        """Returns the unexpired entry for key, or None."""
+        path = os.path.join(self.root, key, "result.json")
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+            if self.ttl_seconds and time.time() - entry["created"] > self.ttl_seconds:
+                return None
+            for output in entry["outputs"]:
+                if not os.path.isfile(os.path.join(self.root, key, output["stored"])):
+                    return None
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def restore_outputs(self, key, entry):
+        for output in entry["outputs"]:
+            target_dir = os.path.dirname(output["path"])
+            if target_dir and not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+            shutil.copyfile(os.path.join(self.root, key, output["stored"]), output["path"])
+
+    def store(self, key, return_code, output, output_paths, description):
+        """Saves a result; output is a list of [stream, text] chunks."""
+        temp_dir = tempfile.mkdtemp(prefix=key[:16] + ".", suffix=".tmp", dir=self.root)
+        try:
+            outputs = []
+            for index, path in enumerate(output_paths):
+                if os.path.isfile(path):
+                    stored = "output_{}".format(index)
+                    shutil.copyfile(path, os.path.join(temp_dir, stored))
+                    outputs.append({"path": path, "stored": stored})
+            entry = dict(description, created=time.time(), return_code=return_code, output=output, outputs=outputs)
+            with open(os.path.join(temp_dir, "result.json"), 'w') as f:
+                json.dump(entry, f)
+            target = os.path.join(self.root, key)
+            if os.path.isdir(target):
+                shutil.rmtree(target, ignore_errors=True)
+            os.rename(temp_dir, target)
+        except (IOError, OSError):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+    def evict(self):
+        """Removes expired entries, then the least recently used until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            try:
+                if name.endswith(".tmp"):
+                    # Left behind by a session that was killed while storing a result.
+                    if time.time() - os.path.getmtime(entry_dir) > 3600:
+                        shutil.rmtree(entry_dir, ignore_errors=True)
+                    continue
+                last_used = os.path.getmtime(os.path.join(entry_dir, "result.json"))
+                size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            except OSError:
+                continue
+            if self.ttl_seconds and time.time() - last_used > self.ttl_seconds:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            else:
+                entries.append((last_used, size, entry_dir))
+        total = sum(size for _, size, _ in entries)
+        for last_used, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+
+# --- Warm worker ---
+
+def read_worker_state(state_file):
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def worker_request(state, request, on_message=None, timeout=None):
+    """Sends one request to the worker and returns its final message (None if the worker went away)."""
+    request = dict(request)
+    request["token"] = state["token"]
+    connection = socket.create_connection(("127.0.0.1", state["port"]), 5)
+    try:
+        connection.settimeout(timeout)
+        connection.sendall(json.dumps(request) + "\n")
+        sock_file = connection.makefile('rb')
+        while True:
+            line = sock_file.readline()
+            if not line:
+                return None
+            message = json.loads(line)
+            if "stream" in message:
+                if on_message:
+                    on_message(message)
+                continue
+            return message
+    finally:
+        connection.close()
+
+
+def ping_worker(state_file):
+    """
+    Returns (state, status) where status is "ready", "busy" (it accepted the
+    connection but is running another script) or "down" (no worker, or a
+    stale state file left by one that crashed).
+    """
+    state = read_worker_state(state_file)
+    if not state:
+        return None, "down"
+    try:
+        connection = socket.create_connection(("127.0.0.1", state["port"]), 2)
+        connection.close()
+    except (socket.error, socket.timeout, KeyError):
+        return None, "down"
+    try:
+        if worker_request(state, {"command": "ping"}, timeout=2):
+            return state, "ready"
+    except (socket.error, socket.timeout, ValueError):
+        pass
+    return None, "busy"
+
+
+def worker_log_path(state_file):
+    return os.path.splitext(state_file)[0] + ".log"
+
+
+def start_worker(python_executable, worker_script, state_file, preload, max_jobs, idle_timeout):
+    """Starts a worker in the background and returns its process."""
+    print("Starting pythonCWMS worker (preloading: {})...".format(preload))
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    log_path = worker_log_path(state_file)
+    cmd = [python_executable, worker_script,
+           "--state-file", state_file,
+           "--preload", preload,
+           "--max-jobs", str(max_jobs),
+           "--idle-timeout", str(idle_timeout),
+           "--log-file", log_path]
+    # Anything the worker prints before it redirects its own output (a bad
+    # interpreter, an import error) ends up in the same log. The file is not
+    # closed here: Jython copies the worker's output into it from a thread.
+    log_file = open(log_path, "a")
+    return subprocess.Popen(cmd, stdin=open(os.devnull, "r"), stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def wait_for_worker(state_file, process=None, timeout=180):
+    """Waits until the worker answers; returns its state, or None if it exited or did not start in time."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        state, status = ping_worker(state_file)
+        if state:
+            return state
+        if process is not None and process.poll() is not None:
+            print("pythonCWMS worker exited with code {} while starting, see {}".format(
+                process.returncode, worker_log_path(state_file)))
+            return None
+        time.sleep(0.25)
+    return None
+
+
+# --- One script ---
+
+def run_script(python_script_path, args=None, job_name=None, use_worker=True,
+               worker_preload="pandas,xarray,cwms,hecdss", worker_max_jobs=50, worker_idle_timeout=3600,
+               stream_output=True, output_log_path=None, output_log_max_mb=10, output_log_backups=3,
+               console_max_lines=0, cache_results=False, cache_env_vars="", cache_input_files="",
+               cache_output_files="", cache_ttl_seconds=3600, cache_max_mb=200, cache_bypass=False):
+    """
+    Runs one script with pythonCWMS and prints its output; the settings are
+    described in example_python_script_launcher.py. Returns the script's
+    return code, or None if pythonCWMS was not found.
+    """
+    pythoncwms_home, pythoncwms_path = find_pythoncwms()
+    if not pythoncwms_home:
+        return None
+
+    cmd_args = [args] if args else []
+    scripts_dir = python_scripts_dir(pythoncwms_home)
+    script_env = script_environment(pythoncwms_home, job_name or default_job_name(python_script_path, cmd_args))
+
+    forwarder = None
+    if stream_output:
+        forwarder = OutputForwarder(output_log_path, output_log_max_mb, output_log_backups, console_max_lines,
+                                    capture_max_bytes=int(cache_max_mb * 1024 * 1024) if cache_results else 0)
+    stdout_str = None
+    stderr_str = None
+    return_code = None
+
+    # 5. Replay the cached result if nothing the script depends on has changed since it last ran
+    result_cache = None
+    cache_key = None
+    replayed = False
+    script_dir = os.path.dirname(os.path.abspath(python_script_path))
+    if cache_results and os.path.exists(pythoncwms_path):
+        try:
+            result_cache = ResultCache(os.path.join(local_dir(), "result_cache"),
+                                       cache_ttl_seconds, cache_max_mb * 1024 * 1024)
+            cache_key = result_cache.key(python_script_path, cmd_args, pythoncwms_path, split_setting(cache_env_vars),
+                                         expand_paths(cache_input_files, script_dir))
+        except (IOError, OSError), e:
+            print("Result cache not used for this run: {}".format(e))
+            result_cache = None
+        if result_cache and (cache_bypass or os.environ.get("PYTHON_CWMS_NO_CACHE")):
+            print("Result cache bypassed; running the script and replacing its cached result.")
+        elif result_cache:
+            entry = result_cache.lookup(cache_key)
+            if entry:
+                try:
+                    result_cache.restore_outputs(cache_key, entry)
+                    replayed = True
+                except (IOError, OSError), e:
+                    print("Could not restore the cached output files ({}); running the script.".format(e))
+            if replayed:
+                print("Replaying the result of the run at {} (inputs unchanged; set cache_bypass = True to run the script):".format(
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["created"]))))
+                return_code = entry["return_code"]
+                if forwarder:
+                    forwarder.captured = None
+                    for stream, text in entry["output"]:
+                        forwarder.write(stream, text)
+                else:
+                    stdout_str = "".join(text for stream, text in entry["output"] if stream == "stdout")
+                    stderr_str = "".join(text for stream, text in entry["output"] if stream == "stderr")
+
+    # 6. Run the script in the warm worker, starting one if none is running
+    worker_script = os.path.join(scripts_dir, "pythoncwms_worker.py")
+    if os.path.exists(pythoncwms_path) and use_worker and os.path.exists(worker_script) and return_code is None:
+        if not os.path.isdir(local_dir()):
+            os.makedirs(local_dir())
+        # One worker per installation
+        install_key = hashlib.sha1(os.path.normcase(os.path.abspath(pythoncwms_home))).hexdigest()[:8]
+        state_file = os.path.join(local_dir(), "worker_{}.json".format(install_key))
+
+        state, status = ping_worker(state_file)
+        if status == "busy":
+            print("pythonCWMS worker is busy with another script, running this script in a new process.")
+        else:
+            if not state:
+                worker_process = start_worker(pythoncwms_path, worker_script, state_file, worker_preload, worker_max_jobs,
+                                              worker_idle_timeout)
+                state = wait_for_worker(state_file, worker_process)
+            if state:
+                print("Running in pythonCWMS worker (pid {}):".format(state["pid"]), [python_script_path] + cmd_args)
+                output = {"stdout": [], "stderr": []}
+                if forwarder:
+                    on_message = lambda message: forwarder.write(message["stream"], message["data"])
+                else:
+                    on_message = lambda message: output[message["stream"]].append(message["data"])
+                started = time.time()
+                try:
+                    result = worker_request(state, {"script": python_script_path, "args": cmd_args,
+                                                    "cwd": os.path.dirname(python_script_path),
+                                                    "env": script_env},
+                                            on_message=on_message)
+                except (socket.error, ValueError), e:
+                    result = None
+                    print("Lost connection to the pythonCWMS worker: {}".format(e))
+                if result is None:
+                    # The worker crashed mid-run; the next run starts a new one. The script is not
+                    # re-run here because it may already have posted data.
+                    return_code = -1
+                    on_message({"stream": "stderr", "data": "pythonCWMS worker exited before the script finished.\n"})
+                else:
+                    return_code = result["exit"]
+                    print("Worker run took {:.2f}s".format(time.time() - started))
+                    if result.get("retiring"):
+                        # Warm up the replacement now so the next run does not wait for imports.
+                        start_worker(pythoncwms_path, worker_script, state_file, worker_preload, worker_max_jobs,
+                                     worker_idle_timeout)
+                stdout_str = "".join(output["stdout"])
+                stderr_str = "".join(output["stderr"])
+            else:
+                print("pythonCWMS worker did not start, running this script in a new process.")
+
+    # 7. Subprocess Call (when the worker is disabled or unavailable)
+    if os.path.exists(pythoncwms_path) and return_code is None:
+        cmd = [pythoncwms_path, python_script_path] + cmd_args
+
+        print("Executing command:", cmd)
+
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=script_env)
+        if forwarder:
+            return_code = stream_process_output(process, forwarder)
+        else:
+            stdout, stderr = process.communicate()
+
+            stdout_str = stdout.decode('utf-8')
+            stderr_str = stderr.decode('utf-8')
+            return_code = process.returncode
+
+    # 8. Keep a successful run's result for the next identical run
+    if result_cache and cache_key and not replayed and return_code == 0:
+        if forwarder:
+            cached_output = forwarder.captured
+        else:
+            cached_output = [["stdout", stdout_str or ""], ["stderr", stderr_str or ""]]
+        if cached_output is None:
+            print("Output is larger than cache_max_mb, so this result was not cached.")
+        else:
+            try:
+                result_cache.store(cache_key, return_code, cached_output, expand_paths(cache_output_files, script_dir),
+                                   {"script": python_script_path, "args": cmd_args, "env_vars": split_setting(cache_env_vars)})
+                result_cache.evict()
+            except (IOError, OSError), e:
+                print("Could not cache the result: {}".format(e))
+
+    if forwarder:
+        forwarder.close()
+        if return_code is not None:
+            print("Output lines: {}".format(forwarder.total_lines))
+            print("Return Code:", return_code)
+        else:
+            print("\nSkipping subprocess call because pythonCWMS was not found.")
+    elif return_code is not None:
+        stdout_str = stdout_str.replace('\r\n', '\n')
+        stderr_str = stderr_str.replace('\r\n', '\n')
+        print("STDOUT:\n")
+        print(stdout_str)
+        print("STDERR:\n")
+        print(stderr_str)
+
+        print("Return Code:", return_code)
+    else:
+        print("\nSkipping subprocess call because pythonCWMS was not found.")
+    return return_code
+
+
+# --- Batches ---
+
+class BatchJob(object):
+    def __init__(self, index, script, args=None, timeout=None, job_name=None, tail_lines=20):
+        self.index = index
+        self.script = script
+        self.args = args
+        self.timeout = timeout
+        self.job_name = job_name
+        self.name = "{}:{}".format(index, os.path.splitext(os.path.basename(script))[0])
+        self.return_code = None
+        self.status = "pending"
+        self.elapsed = 0.0
+        self.output_lines = 0
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.log_path = None
+
+    def command(self, python_executable):
+        cmd = [python_executable, self.script]
+        if isinstance(self.args, (list, tuple)):
+            cmd.extend(str(arg) for arg in self.args)
+        elif self.args:
+            cmd.append(self.args)
+        return cmd
+
+    def environment(self, script_env):
+        env = dict(script_env)
+        env["PYTHON_CWMS_JOB"] = self.job_name or default_job_name(self.script, self.command("")[2:])
+        return env
+
+
+def load_jobs(jobs, jobs_manifest_path=None, timeout=None, tail_lines=20):
+    """BatchJobs for (script, args) pairs and the entries of the JSON manifest at jobs_manifest_path."""
+    batch = [BatchJob(i + 1, script, args, timeout, tail_lines=tail_lines) for i, (script, args) in enumerate(jobs)]
+    if jobs_manifest_path:
+        with open(jobs_manifest_path, 'r') as f:
+            for entry in json.load(f):
+                batch.append(BatchJob(len(batch) + 1, entry["script"], entry.get("args"),
+                                      entry.get("timeout", timeout), entry.get("job"), tail_lines))
+    return batch
+
+
+def run_job(job, python_executable, print_lock, script_env, log_dir=None):
+    """Runs one script, keeping its last output lines (and optionally a full log); stops it at its timeout."""
+    log_file = None
+    if log_dir:
+        job.log_path = os.path.join(log_dir, "{}.log".format(job.name.replace(":", "_")))
+        log_file = open(job.log_path, 'w')
+    write_lock = threading.Lock()
+
+    def read_pipe(pipe, prefix):
+        while True:
+            data = pipe.readline(64 * 1024)
+            if not data:
+                break
+            line = prefix + data.decode('utf-8', 'replace').rstrip('\r\n')
+            with write_lock:
+                job.output_lines += 1
+                job.tail.append(line)
+                if log_file:
+                    log_file.write(line.encode('utf-8') + "\n")
+
+    started = time.time()
+    try:
+        process = subprocess.Popen(job.command(python_executable), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   cwd=os.path.dirname(job.script) or None, env=job.environment(script_env))
+        readers = [threading.Thread(target=read_pipe, args=(process.stdout, "")),
+                   threading.Thread(target=read_pipe, args=(process.stderr, "[stderr] "))]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+        while process.poll() is None:
+            if job.timeout and time.time() - started > job.timeout:
+                process.kill()
+                process.wait()
+                job.status = "timeout"
+                break
+            time.sleep(0.1)
+        for reader in readers:
+            reader.join(5)
+        job.return_code = process.returncode
+        if job.status != "timeout":
+            job.status = "ok" if job.return_code == 0 else "failed"
+    except Exception, e:
+        job.status = "error"
+        job.tail.append("Could not run {}: {}".format(job.script, e))
+    finally:
+        job.elapsed = time.time() - started
+        if log_file:
+            log_file.close()
+    with print_lock:
+        print("Finished {} ({}, exit code {}) in {:.1f}s".format(job.name, job.status, job.return_code, job.elapsed))
+
+
+def run_jobs(batch, python_executable, concurrency, script_env, log_dir=None):
+    """Runs the BatchJobs on concurrency threads, each job in its own process."""
+    pending = Queue.Queue()
+    for job in batch:
+        pending.put(job)
+    print_lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                job = pending.get_nowait()
+            except Queue.Empty:
+                return
+            job.status = "running"
+            with print_lock:
+                print("Starting {}: {}".format(job.name, job.command(python_executable)))
+            run_job(job, python_executable, print_lock, script_env, log_dir)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(concurrency, len(batch)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def print_batch_summary(batch, wall_clock):
+    print("\n--- Batch summary ---")
+    print("{:<40} {:>8} {:>10} {:>8}".format("Job", "Status", "Exit code", "Seconds"))
+    for job in batch:
+        print("{:<40} {:>8} {:>10} {:>8.1f}".format(job.name[:40], job.status, job.return_code, job.elapsed))
+    total_time = sum(job.elapsed for job in batch)
+    print("Wall clock: {:.1f}s for {:.1f}s of script time ({:.1f}x)".format(
+        wall_clock, total_time, total_time / wall_clock if wall_clock else 0))
+
+    for job in batch:
+        print("\n--- Output of {} ({} lines{}) ---".format(
+            job.name, job.output_lines, ", full log: {}".format(job.log_path) if job.log_path else ""))
+        for line in job.tail:
+            print(line)
+
+    failed = [job.name for job in batch if job.status != "ok"]
+    if failed:
+        print("\n{} of {} jobs did not succeed: {}".format(len(failed), len(batch), ", ".join(failed)))
+
+
+def run_batch(jobs, jobs_manifest_path=None, max_concurrent=None, job_timeout_seconds=1800, batch_log_dir=None,
+              output_tail_lines=20):
+    """
+    Runs many scripts in parallel and prints a summary; the settings are
+    described in example_batch_launcher.py. Returns the BatchJobs (with
+    their status, return code and output tail), or None if pythonCWMS was
+    not found.
+    """
+    pythoncwms_home, pythoncwms_path = find_pythoncwms()
+    if not pythoncwms_home or not os.path.exists(pythoncwms_path):
+        return None
+    script_env = script_environment(pythoncwms_home)
+
+    # Build the job list and size the pool
+    batch = load_jobs(jobs, jobs_manifest_path, job_timeout_seconds, output_tail_lines)
+    concurrency = max_concurrent or Runtime.getRuntime().availableProcessors()
+    if batch_log_dir and not os.path.isdir(batch_log_dir):
+        os.makedirs(batch_log_dir)
+    print("Running {} scripts, up to {} at a time.".format(len(batch), concurrency))
+
+    batch_started = time.time()
+    run_jobs(batch, pythoncwms_path, concurrency, script_env, batch_log_dir)
+    print_batch_summary(batch, time.time() - batch_started)
+    return batch
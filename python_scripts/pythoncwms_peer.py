@@ -0,0 +1,333 @@
+"""
+Shares the verified pythonCWMS archives of this machine with installers on the
+same network, so a rollout to many workstations pulls each release over the
+WAN link once instead of once per machine.
+
+The peer serves the installer's archive cache (<sha256>.archive files, by
+default %ProgramData%\\pythonCWMS\\archive_cache) read-only over HTTP:
+
+    GET /archive/<sha256>      the archive, with single Range requests
+
+and answers discovery datagrams sent to UDP port --discovery-port, either
+broadcast or to the multicast group DISCOVERY_GROUP:
+
+    pythonCWMS-discover <sha256>   ->   pythonCWMS-have <sha256> <http port>
+
+An archive is only offered once its content has been hashed and matches its
+name; it is hashed again if the file is replaced. Installers check whatever
+they download against the hash in pythonCWMS_config.json regardless, so a
+misbehaving peer can slow an install down but not change it. At most
+--max-clients transfers run at once; further requests get 503 and the
+installer moves on to another peer or mirror.
+
+The installer starts a peer after a successful install when the config has
+"peer_sharing": true. To run one by hand (several can run on one machine for
+testing if they use their own caches and --http-port 0):
+
+    %PYTHON_CWMS_HOME%\\python.exe %PYTHON_CWMS_HOME%\\..\\python_scripts\\pythoncwms_peer.py
+"""
+import argparse
+import hashlib
+import http.server
+import os
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+
+PEER_PORT = 8737
+DISCOVERY_GROUP = "239.255.67.77"
+DISCOVER = "pythonCWMS-discover"
+HAVE = "pythonCWMS-have"
+ENTRY_SUFFIX = ".archive"
+BLOCK_SIZE = 1024 * 1024
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def default_cache_dir():
+    """Same default as the installer: PYTHON_CWMS_ARCHIVE_CACHE, else ProgramData."""
+    if os.environ.get("PYTHON_CWMS_ARCHIVE_CACHE"):
+        return os.environ["PYTHON_CWMS_ARCHIVE_CACHE"]
+    machine_dir = os.environ.get("ProgramData") or os.environ.get("TEMP") or "/tmp"
+    return os.path.join(machine_dir, "pythonCWMS", "archive_cache")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VerifiedArchives(object):
+    """
+    The cache entries whose content matches their name. A file is identified
+    by its size and file id (the installer touches the modification time on
+    every cache hit), so it is hashed again only when it is replaced, and a
+    bad entry is not hashed again until then either.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._verified = {}
+        self._rejected = {}
+        self._lock = threading.Lock()
+        self._hashing = set()
+
+    def _entry(self, sha256):
+        """Returns (path, identity) of the entry for sha256, or None."""
+        if not SHA256_PATTERN.match(sha256 or ""):
+            return None
+        path = os.path.join(self.root, sha256 + ENTRY_SUFFIX)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return path, (stat.st_size, stat.st_ino or stat.st_mtime_ns)
+
+    def verified_path(self, sha256):
+        """The entry's path if it is already known to be good, without hashing it."""
+        entry = self._entry(sha256)
+        if entry is None:
+            return None
+        with self._lock:
+            return entry[0] if self._verified.get(sha256) == entry[1] else None
+
+    def verify(self, sha256):
+        """Hashes the entry if needed; returns its path if it is good, else None."""
+        entry = self._entry(sha256)
+        if entry is None:
+            return None
+        path, identity = entry
+        with self._lock:
+            if self._verified.get(sha256) == identity:
+                return path
+            if self._rejected.get(sha256) == identity:
+                return None
+        if file_sha256(path) != sha256:
+            print("Not sharing {}: its content does not match its name".format(path), flush=True)
+            with self._lock:
+                self._rejected[sha256] = identity
+            return None
+        with self._lock:
+            self._verified[sha256] = identity
+        return path
+
+    def verify_in_background(self, sha256):
+        """Starts hashing an entry so later requests for it can be answered."""
+        with self._lock:
+            if sha256 in self._hashing or self._entry(sha256) is None:
+                return
+            self._hashing.add(sha256)
+
+        def run():
+            try:
+                self.verify(sha256)
+            except OSError as e:
+                print("Could not verify {}: {}".format(sha256, e), flush=True)
+            finally:
+                with self._lock:
+                    self._hashing.discard(sha256)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def names(self):
+        try:
+            filenames = os.listdir(self.root)
+        except OSError:
+            return []
+        return [name[:-len(ENTRY_SUFFIX)] for name in filenames
+                if name.endswith(ENTRY_SUFFIX) and SHA256_PATTERN.match(name[:-len(ENTRY_SUFFIX)])]
+
+
+def parse_range(header, size):
+    """Returns (start, end) for a single 'bytes=a-b' range, None for the whole file; raises ValueError if unsatisfiable."""
+    if not header:
+        return None
+    match = re.match(r"^bytes=(\d*)-(\d*)$", header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None  # Multiple or malformed ranges: send the whole file.
+    if not match.group(1):
+        start, end = max(0, size - int(match.group(2))), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class PeerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "pythonCWMS-peer"
+
+    def log_message(self, format, *args):
+        print("{} {}".format(self.address_string(), format % args), flush=True)
+
+    def do_HEAD(self):
+        self._send_archive(head=True)
+
+    def do_GET(self):
+        self._send_archive(head=False)
+
+    def _send_error(self, status, message):
+        body = (message + "\n").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "10")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_archive(self, head):
+        self.server.touch()
+        match = re.match(r"^/archive/([0-9a-fA-F]{64})$", self.path.split("?")[0])
+        if not match:
+            self._send_error(404, "Not found")
+            return
+        sha256 = match.group(1).lower()
+        if not self.server.clients.acquire(blocking=False):
+            self._send_error(503, "Busy, try another peer")
+            return
+        try:
+            path = self.server.archives.verify(sha256)
+            if path is None:
+                self._send_error(404, "No verified archive with that hash")
+                return
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                try:
+                    byte_range = parse_range(self.headers.get("Range"), size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header("Content-Range", "bytes */{}".format(size))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                start, end = byte_range or (0, size - 1)
+                self.send_response(206 if byte_range else 200)
+                if byte_range:
+                    self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(end - start + 1))
+                # The content never changes for a given name, so the hash is a perfect ETag.
+                self.send_header("ETag", '"{}"'.format(sha256))
+                self.end_headers()
+                if head:
+                    return
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    block = f.read(min(BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+                    self.server.touch()
+        except (ConnectionError, socket.timeout):
+            pass  # The installer gave up on this peer or switched to another one.
+        finally:
+            self.server.clients.release()
+
+
+class PeerServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, archives, max_clients):
+        http.server.ThreadingHTTPServer.__init__(self, address, PeerHandler)
+        self.archives = archives
+        self.clients = threading.BoundedSemaphore(max_clients)
+        self.last_activity = time.time()
+
+    def touch(self):
+        self.last_activity = time.time()
+
+
+def open_discovery_socket(port):
+    """UDP socket receiving broadcast and multicast discovery requests on port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Several peers on one machine (a test setup) can all listen on the same port.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", port))
+    try:
+        membership = struct.pack("4s4s", socket.inet_aton(DISCOVERY_GROUP), socket.inet_aton("0.0.0.0"))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    except OSError as e:
+        print("Multicast discovery unavailable ({}); answering broadcasts only".format(e), flush=True)
+    return sock
+
+
+def answer_discovery(sock, archives, http_port, server):
+    while True:
+        try:
+            data, address = sock.recvfrom(512)
+        except OSError:
+            return
+        parts = data.decode("ascii", "replace").split()
+        if len(parts) != 2 or parts[0] != DISCOVER:
+            continue
+        sha256 = parts[1].lower()
+        if archives.verified_path(sha256):
+            server.touch()
+            try:
+                sock.sendto("{} {} {}".format(HAVE, sha256, http_port).encode("ascii"), address)
+            except OSError as e:
+                print("Could not answer {}: {}".format(address[0], e), flush=True)
+        else:
+            # Not answered this time; the next installer that asks gets an answer.
+            archives.verify_in_background(sha256)
+
+
+def serve(args):
+    if args.log_file:
+        log = open(args.log_file, "a", buffering=1, encoding="utf-8", errors="replace")
+        sys.stdout = sys.stderr = log
+    archives = VerifiedArchives(os.path.abspath(args.cache))
+    try:
+        server = PeerServer((args.bind, args.http_port), archives, args.max_clients)
+    except OSError as e:
+        # Usually another peer on this machine already serves the default port.
+        print("pythonCWMS peer could not listen on port {}: {}".format(args.http_port, e), flush=True)
+        return 1
+    http_port = server.server_address[1]
+    discovery = open_discovery_socket(args.discovery_port)
+    print("pythonCWMS peer {} sharing {} on port {} (discovery on UDP {})".format(
+        os.getpid(), archives.root, http_port, args.discovery_port), flush=True)
+
+    for name in archives.names():
+        archives.verify_in_background(name)
+    threading.Thread(target=answer_discovery, args=(discovery, archives, http_port, server), daemon=True).start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        while args.idle_timeout <= 0 or time.time() - server.last_activity < args.idle_timeout:
+            time.sleep(1)
+        print("Idle for {}s, exiting".format(args.idle_timeout), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        discovery.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Share verified pythonCWMS archives with installers on the local network.")
+    parser.add_argument("--cache", default=default_cache_dir(), help="archive cache folder to share")
+    parser.add_argument("--bind", default="", help="address to serve HTTP on (default: all)")
+    parser.add_argument("--http-port", type=int, default=PEER_PORT, help="HTTP port (0 picks a free one)")
+    parser.add_argument("--discovery-port", type=int, default=PEER_PORT, help="UDP port for discovery requests")
+    parser.add_argument("--max-clients", type=int, default=16, help="transfers (connections) served at once")
+    parser.add_argument("--idle-timeout", type=float, default=0, help="exit after this many seconds without requests (0 = never)")
+    parser.add_argument("--log-file", help="file for the peer's own output")
+    return serve(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
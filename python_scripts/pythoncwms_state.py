@@ -0,0 +1,209 @@
+"""
+Durable per-job state for scripts run by the pythonCWMS launchers, so an
+acquisition script can remember how far it got and only ask for new data on
+its next run instead of pulling a fixed window again.
+
+The launchers tell the script where the state is kept and which job it is:
+PYTHON_CWMS_STATE (an SQLite file, by default
+%LOCALAPPDATA%\\pythonCWMS\\job_state.sqlite3) and PYTHON_CWMS_JOB (the
+script's file name, plus a hash of its arguments if it has any). A script
+keeps a high-water mark like this:
+
+    from datetime import datetime, timedelta, timezone
+    import pythoncwms_state
+
+    state = pythoncwms_state.JobState()
+    now = datetime.now(timezone.utc)
+    begin = state.since("last_observation", default=now - timedelta(days=60), overlap=timedelta(hours=2))
+    ...  # fetch and store the data from begin onwards
+    state.advance("last_observation", newest_observation_time)
+
+advance() never moves a value backwards, so an older batch or two runs that
+overlap cannot undo progress. Only record the mark once the data is stored:
+if the script fails before that, the next run asks for the same data again.
+Outside the launchers (e.g. in VS Code) the job is named after the script
+file unless PYTHON_CWMS_JOB is set.
+
+To look at or reset the stored state:
+
+    python pythoncwms_state.py list
+    python pythoncwms_state.py show get_USGS_measurements-1a2b3c4d
+    python pythoncwms_state.py reset get_USGS_measurements-1a2b3c4d [KEY]
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+
+STATE_ENV = "PYTHON_CWMS_STATE"
+JOB_ENV = "PYTHON_CWMS_JOB"
+STATE_FILE_NAME = "job_state.sqlite3"
+# Several scripts (or CAVI sessions) may write at once; SQLite waits this long for the lock.
+LOCK_TIMEOUT_SECONDS = 30
+DATETIME_TAG = "$datetime"
+
+
+def default_state_path():
+    if os.environ.get(STATE_ENV):
+        return os.environ[STATE_ENV]
+    local_dir = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    return os.path.join(local_dir, "pythonCWMS", STATE_FILE_NAME)
+
+
+def default_job_name():
+    if os.environ.get(JOB_ENV):
+        return os.environ[JOB_ENV]
+    return os.path.splitext(os.path.basename(sys.argv[0] or "interactive"))[0] or "interactive"
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return json.dumps({DATETIME_TAG: value.isoformat()})
+    return json.dumps(value)
+
+
+def _decode(text):
+    value = json.loads(text)
+    if isinstance(value, dict) and list(value) == [DATETIME_TAG]:
+        return datetime.datetime.fromisoformat(value[DATETIME_TAG])
+    return value
+
+
+class JobState(object):
+    """
+    The stored values of one job. Values can be anything JSON can hold, or
+    datetimes (returned as datetimes, with their time zone). Every call is
+    its own transaction, so a value is on disk as soon as the call returns.
+    """
+
+    def __init__(self, job=None, path=None):
+        self.job = job or default_job_name()
+        self.path = path or default_state_path()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS job_state ("
+                               "job TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated TEXT NOT NULL, "
+                               "PRIMARY KEY (job, key))")
+
+    def _connect(self):
+        # isolation_level=None: transactions are opened explicitly with BEGIN IMMEDIATE, so a
+        # read-then-write (advance) holds the write lock from the read on.
+        connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT_SECONDS, isolation_level=None)
+        return _Transaction(connection)
+
+    def get(self, key, default=None):
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM job_state WHERE job = ? AND key = ?", (self.job, key)).fetchone()
+        return _decode(row[0]) if row else default
+
+    def set(self, key, value):
+        with self._connect() as connection:
+            self._write(connection, key, value)
+
+    def advance(self, key, value):
+        """
+        Stores value unless the stored one is already at or beyond it; returns
+        True if it was stored. Values must be comparable (e.g. all aware
+        datetimes, or all numbers).
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM job_state WHERE job = ? AND key = ?", (self.job, key)).fetchone()
+            if row is not None and _decode(row[0]) >= value:
+                return False
+            self._write(connection, key, value)
+            return True
+
+    def since(self, key, default=None, overlap=None):
+        """
+        Where the next run should start: the stored value minus overlap (to
+        catch data that arrives late), or default if nothing is stored yet.
+        """
+        value = self.get(key)
+        if value is None:
+            return default
+        return value - overlap if overlap else value
+
+    def delete(self, key=None):
+        """Removes one value of this job, or all of them."""
+        with self._connect() as connection:
+            if key is None:
+                connection.execute("DELETE FROM job_state WHERE job = ?", (self.job,))
+            else:
+                connection.execute("DELETE FROM job_state WHERE job = ? AND key = ?", (self.job, key))
+
+    def items(self):
+        """(key, value, updated) of every stored value of this job."""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT key, value, updated FROM job_state WHERE job = ? ORDER BY key",
+                                      (self.job,)).fetchall()
+        return [(key, _decode(value), updated) for key, value, updated in rows]
+
+    def _write(self, connection, key, value):
+        connection.execute("INSERT OR REPLACE INTO job_state (job, key, value, updated) VALUES (?, ?, ?, ?)",
+                           (self.job, key, _encode(value),
+                            datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")))
+
+
+class _Transaction(object):
+    """Runs the block in one BEGIN IMMEDIATE transaction and closes the connection afterwards."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.connection.close()
+        return False
+
+
+def jobs(path=None):
+    """Names of all jobs with stored state."""
+    state_path = path or default_state_path()
+    if not os.path.exists(state_path):
+        return []
+    connection = sqlite3.connect(state_path, timeout=LOCK_TIMEOUT_SECONDS)
+    try:
+        return [row[0] for row in connection.execute("SELECT DISTINCT job FROM job_state ORDER BY job")]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or reset the stored state of pythonCWMS jobs.")
+    parser.add_argument("--state", default=default_state_path(), help="state database (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the jobs with stored state")
+    show = commands.add_parser("show", help="show the stored values of a job")
+    show.add_argument("job")
+    reset = commands.add_parser("reset", help="remove a job's values, so its next run starts from scratch")
+    reset.add_argument("job")
+    reset.add_argument("key", nargs="?", help="only remove this value")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for job in jobs(args.state):
+            print(job)
+    elif args.command == "show":
+        for key, value, updated in JobState(args.job, args.state).items():
+            print("{:<30} {:<35} (updated {})".format(key, value.isoformat() if isinstance(value, datetime.datetime)
+                                                      else json.dumps(value), updated))
+    else:
+        JobState(args.job, args.state).delete(args.key)
+        print("Reset {}{}".format(args.job, " " + args.key if args.key else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Long-lived pythonCWMS worker. It imports the heavy modules once and then runs
+scripts sent by the CAVI launcher (jython_scripts/pythoncwms_launch.py) over a
+localhost socket, so repeated runs skip interpreter start-up and imports.
+
+The worker writes its port and a random token to --state-file once it is ready.
+Each connection carries one JSON request line:
+
+    {"token": ..., "script": ..., "args": [...], "cwd": ..., "env": {...}}
+
+which is answered with {"stream": "stdout" | "stderr", "data": ...} lines while
+the script runs and a final {"exit": <code>, "elapsed": <seconds>, "retiring": <bool>}.
+{"token": ..., "command": "ping"} is answered with {"pong": <pid>, "jobs": <count>}.
+
+Jobs run one at a time in this process. After each job, sys.argv, sys.path, the
+working directory, the environment, logging handlers and any modules imported
+from the script's own folder are restored, and the worker exits after
+--max-jobs jobs (or --idle-timeout seconds without a job) so that state that
+cannot be reset does not build up.
+"""
+import argparse
+import hmac
+import importlib
+import json
+import logging
+import os
+import runpy
+import secrets
+import socket
+import sys
+import threading
+import time
+import traceback
+
+REQUEST_TIMEOUT = 30
+MAX_LOG_BYTES = 5 * 1024 * 1024
+
+
+class SocketStream(object):
+    """Text stream that forwards writes to the launcher as JSON lines, one line of output at a time."""
+
+    encoding = "utf-8"
+    errors = "replace"
+
+    def __init__(self, sock_file, name, lock, max_buffer=8192):
+        self.sock_file = sock_file
+        self.name = name
+        self.lock = lock
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, text):
+        if not isinstance(text, str):
+            text = str(text)
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if "\n" in text or self._buffered >= self.max_buffer:
+            self.flush()
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        data = "".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        send_message(self.sock_file, {"stream": self.name, "data": data}, self.lock)
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        raise OSError("pythonCWMS worker output is not backed by a file descriptor")
+
+
+def send_message(sock_file, message, lock):
+    line = (json.dumps(message) + "\n").encode("utf-8")
+    with lock:
+        sock_file.write(line)
+        sock_file.flush()
+
+
+def preload_modules(names):
+    for name in names:
+        started = time.time()
+        try:
+            importlib.import_module(name)
+            print("Preloaded {} in {:.2f}s".format(name, time.time() - started))
+        except Exception as e:
+            print("Could not preload {}: {}".format(name, e))
+
+
+def run_job(request, sock_file, lock):
+    """Runs one script as __main__ and returns its exit code, restoring interpreter state afterwards."""
+    script = os.path.abspath(request["script"])
+    script_dir = os.path.dirname(script)
+    saved_argv = list(sys.argv)
+    saved_path = list(sys.path)
+    saved_cwd = os.getcwd()
+    saved_environ = dict(os.environ)
+    saved_streams = (sys.stdout, sys.stderr)
+    saved_handlers = list(logging.root.handlers)
+    saved_modules = set(sys.modules)
+
+    stdout = SocketStream(sock_file, "stdout", lock)
+    stderr = SocketStream(sock_file, "stderr", lock)
+    exit_code = 0
+    try:
+        if request.get("env"):
+            os.environ.clear()
+            os.environ.update(request["env"])
+        os.chdir(request.get("cwd") or script_dir)
+        sys.argv = [script] + [str(arg) for arg in request.get("args") or []]
+        sys.path.insert(0, script_dir)
+        sys.stdout, sys.stderr = stdout, stderr
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            stderr.write("{}\n".format(e.code))
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc(file=stderr)
+        exit_code = 1
+    finally:
+        for stream in (stdout, stderr):
+            try:
+                stream.flush()
+            except OSError:
+                pass  # Launcher went away; the exit message will fail the same way.
+        sys.stdout, sys.stderr = saved_streams
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        for handler in logging.root.handlers[:]:
+            if handler not in saved_handlers:
+                logging.root.removeHandler(handler)
+        # Modules that live next to the script are reloaded on the next run so edits are picked up.
+        for name in set(sys.modules) - saved_modules:
+            module_file = getattr(sys.modules.get(name), "__file__", None) or ""
+            if os.path.abspath(module_file).startswith(script_dir + os.sep):
+                del sys.modules[name]
+    return exit_code
+
+
+def write_state(path, state):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+
+def remove_state(path):
+    """Removes the state file if it still describes this process."""
+    try:
+        with open(path) as f:
+            if json.load(f).get("pid") != os.getpid():
+                return
+        os.remove(path)
+    except (OSError, ValueError):
+        pass
+
+
+def redirect_output(log_file):
+    """Sends this process's own output (including C-level writes) to a log file."""
+    mode = "w" if os.path.exists(log_file) and os.path.getsize(log_file) > MAX_LOG_BYTES else "a"
+    log = open(log_file, mode, buffering=1, encoding="utf-8", errors="replace")
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+
+
+def serve(args):
+    if args.log_file:
+        redirect_output(args.log_file)
+    print("pythonCWMS worker {} starting with {}".format(os.getpid(), sys.executable))
+    preload_modules([name.strip() for name in args.preload.split(",") if name.strip()])
+
+    token = secrets.token_hex(16)
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    if args.idle_timeout > 0:
+        server.settimeout(args.idle_timeout)
+    write_state(args.state_file, {
+        "pid": os.getpid(),
+        "port": server.getsockname()[1],
+        "token": token,
+        "executable": sys.executable,
+        "started": time.time(),
+    })
+    print("Listening on port {}".format(server.getsockname()[1]))
+
+    jobs = 0
+    try:
+        while jobs < args.max_jobs:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                print("Idle for {}s, exiting".format(args.idle_timeout))
+                break
+            with connection:
+                connection.settimeout(REQUEST_TIMEOUT)
+                sock_file = connection.makefile("rwb")
+                lock = threading.Lock()
+                try:
+                    request = json.loads(sock_file.readline().decode("utf-8"))
+                    if not hmac.compare_digest(str(request.get("token", "")), token):
+                        send_message(sock_file, {"error": "invalid token"}, lock)
+                        continue
+                    if request.get("command") == "ping":
+                        send_message(sock_file, {"pong": os.getpid(), "jobs": jobs}, lock)
+                        continue
+                    connection.settimeout(None)
+                    jobs += 1
+                    retiring = jobs >= args.max_jobs
+                    if retiring:
+                        # Let the launcher start a replacement while this job is still running.
+                        remove_state(args.state_file)
+                    print("Job {}: {} {}".format(jobs, request.get("script"), request.get("args") or []))
+                    started = time.time()
+                    exit_code = run_job(request, sock_file, lock)
+                    send_message(sock_file, {"exit": exit_code, "elapsed": time.time() - started,
+                                             "retiring": retiring}, lock)
+                except (OSError, ValueError, KeyError) as e:
+                    print("Request failed: {}".format(e))
+                finally:
+                    try:
+                        sock_file.close()
+                    except OSError:
+                        pass
+    finally:
+        remove_state(args.state_file)
+        server.close()
+    print("pythonCWMS worker {} exiting after {} jobs".format(os.getpid(), jobs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm pythonCWMS worker for the CAVI script launcher.")
+    parser.add_argument("--state-file", required=True, help="where to publish the port and token once ready")
+    parser.add_argument("--preload", default="", help="comma separated modules to import at start-up")
+    parser.add_argument("--max-jobs", type=int, default=50, help="exit after this many jobs")
+    parser.add_argument("--idle-timeout", type=float, default=3600, help="exit after this many idle seconds (0 = never)")
+    parser.add_argument("--log-file", help="file for the worker's own output")
+    serve(parser.parse_args(argv))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
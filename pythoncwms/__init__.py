@@ -0,0 +1,26 @@
+"""
+Helpers shipped with pythonCWMS for scripts that move many timeseries at
+once. Instead of one request after another, each on a new connection, every
+timeseries is requested concurrently over one pooled aiohttp session, with
+a cap per host, retries with backoff and paging handled here:
+
+    import pythoncwms
+
+    frames = pythoncwms.fetch_timeseries(ts_ids, "SWT", begin, end)       # CDA
+    gages = pythoncwms.fetch_usgs_iv(sites, "00060", period="P1D")        # USGS NWIS
+    pythoncwms.store_timeseries(converted, "SWT")                          # CDA, needs CDA_API_KEY
+
+Each call returns a BulkResult: a dict of name -> DataFrame, with the items
+that failed in .errors, and .to_wide() / .to_xarray() for one table of all
+of them. In a notebook (or other async code) await the _async versions.
+fetch_timeseries(..., cache=True) keeps what it fetched in an on-disk cache
+shared by all scripts and requests only what is not there yet.
+"""
+from .cache import TimeseriesCache
+from .cda import fetch_timeseries, fetch_timeseries_async, store_timeseries, store_timeseries_async
+from .client import BulkClient, RequestError, RetryPolicy
+from .frames import BulkResult
+from .usgs import fetch_usgs_iv, fetch_usgs_iv_async
+
+__all__ = ["BulkClient", "BulkResult", "RequestError", "RetryPolicy", "TimeseriesCache", "fetch_timeseries",
+           "fetch_timeseries_async", "fetch_usgs_iv", "fetch_usgs_iv_async", "store_timeseries", "store_timeseries_async"]
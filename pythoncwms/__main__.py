@@ -0,0 +1,13 @@
+"""
+Command line tools of the package:
+
+    python -m pythoncwms cache stats|evict|clear
+"""
+import sys
+
+from . import cache
+
+if len(sys.argv) < 2 or sys.argv[1] != "cache":
+    print(__doc__.strip())
+    sys.exit(2)
+sys.exit(cache.main(sys.argv[2:], prog="python -m pythoncwms cache"))
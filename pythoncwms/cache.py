@@ -0,0 +1,442 @@
+"""
+An on-disk timeseries cache shared by every script on the machine, so a
+window that was already fetched is read from disk instead of downloaded and
+parsed again:
+
+    frames = pythoncwms.fetch_timeseries(ts_ids, "SWT", begin, end, cache=True)
+
+Each series keeps its values as three column files (times, values, quality
+codes; NumPy .npy) plus the time ranges it holds ("coverage": every range
+that was fetched, including stretches without values). A request reads what
+is covered with memory-mapped reads of just the requested rows and fetches
+only the gaps. Values newer than settle at the time they were fetched are
+not counted as covered, so the recent end of a window is fetched again on
+the next run and late or revised values come in.
+
+Several processes can use the cache at once: the column files are never
+modified, a writer creates new ones under a per-series lock and then
+replaces the series' meta.json (which names the current files) in one
+step, and readers never lock. Replaced files are deleted a minute later, so
+a reader that has just read the old meta.json can still open them. The
+least recently read series are removed once the cache grows past max_mb.
+
+The cache is %LOCALAPPDATA%\\pythonCWMS\\timeseries_cache unless
+PYTHON_CWMS_TS_CACHE is set. To see or empty it:
+
+    python -m pythoncwms cache stats
+    python -m pythoncwms cache clear
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import numpy
+import pandas
+
+from .frames import epoch_ms, utc_timestamp
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+CACHE_ENV = "PYTHON_CWMS_TS_CACHE"
+CACHE_MB_ENV = "PYTHON_CWMS_TS_CACHE_MB"
+DEFAULT_MAX_MB = 2048
+DEFAULT_SETTLE = datetime.timedelta(hours=6)
+# Version 1 kept quality codes as int32, which wraps codes with bit 31 set; those generations are rebuilt
+FORMAT_VERSION = 2
+COLUMNS = (("time", "int64"), ("value", "float64"), ("quality", "int64"))
+LOCK_TIMEOUT_SECONDS = 60
+# Replaced column files are kept this long for readers that have just read the old meta.json
+RETIRE_GRACE_SECONDS = 60
+# Eviction goes down to this share of max_mb, so it does not run again after every store
+EVICT_TO = 0.8
+# The fetch helpers check the cache size at most this often (it means a stat of every file)
+EVICT_INTERVAL_SECONDS = 60
+
+
+def default_cache_dir():
+    if os.environ.get(CACHE_ENV):
+        return os.environ[CACHE_ENV]
+    local_dir = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    return os.path.join(local_dir, "pythonCWMS", "timeseries_cache")
+
+
+def to_ms(value):
+    return int(utc_timestamp(value).value // 1000000)
+
+
+def from_ms(value):
+    return pandas.Timestamp(value, unit="ms", tz="UTC")
+
+
+def merge_ranges(ranges):
+    """Sorted, non-overlapping [begin, end] ms ranges (inclusive) covering the same times as ranges."""
+    merged = []
+    for begin, end in sorted(ranges):
+        if merged and begin <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([begin, end])
+    return merged
+
+
+def subtract_ranges(begin, end, covered):
+    """The parts of [begin, end] not in the merged ranges covered."""
+    gaps = []
+    for covered_begin, covered_end in covered:
+        if covered_end < begin or covered_begin > end:
+            continue
+        if covered_begin > begin:
+            gaps.append([begin, covered_begin - 1])
+        begin = covered_end + 1
+        if begin > end:
+            return gaps
+    gaps.append([begin, end])
+    return gaps
+
+
+class FileLock(object):
+    """An exclusive lock on a file, between processes and between threads (each acquire opens the file itself)."""
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout = timeout
+        self._file = None
+
+    def acquire(self, blocking=True):
+        f = open(self.path, "a+b")
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if msvcrt:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._file = f
+                return True
+            except OSError:
+                if not blocking or time.monotonic() > deadline:
+                    f.close()
+                    if not blocking:
+                        return False
+                    raise TimeoutError("Timed out waiting for {}".format(self.path))
+                time.sleep(0.05)
+
+    def release(self):
+        f, self._file = self._file, None
+        try:
+            if msvcrt:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+def _remove(path):
+    """Deletes a file; returns False if it is still in use (a Windows reader has it mapped) but not if it is gone."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False
+    return True
+
+
+class TimeseriesCache(object):
+    """
+    The cache in root. Series are identified by a key, any tuple of strings
+    (the CDA helpers use ("cda", api root, office, name, unit)); times are
+    anything utc_timestamp accepts.
+    """
+
+    def __init__(self, root=None, max_mb=None, settle=DEFAULT_SETTLE):
+        self.root = root or default_cache_dir()
+        if max_mb is None:
+            max_mb = float(os.environ.get(CACHE_MB_ENV) or DEFAULT_MAX_MB)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.settle = settle
+        os.makedirs(self.root, exist_ok=True)
+
+    def _directory(self, key):
+        digest = hashlib.sha1("\x1f".join(str(part) for part in key).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    @staticmethod
+    def _meta(directory, any_version=False):
+        try:
+            with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None  # Not cached, or evicted while it was being read.
+        return meta if any_version or meta.get("version") == FORMAT_VERSION else None
+
+    @staticmethod
+    def _load(directory, meta):
+        """The column arrays of the series' current generation, memory-mapped."""
+        if not meta["count"]:
+            return [numpy.empty(0, dtype) for _, dtype in COLUMNS]
+        return [numpy.load(os.path.join(directory, "{}.{}.npy".format(meta["generation"], column)), mmap_mode="r")
+                for column, _ in COLUMNS]
+
+    def coverage(self, key):
+        """The [begin, end] ranges (UTC Timestamps) held for key."""
+        meta = self._meta(self._directory(key))
+        return [(from_ms(begin), from_ms(end)) for begin, end in (meta["coverage"] if meta else [])]
+
+    def missing(self, key, begin, end):
+        """The (begin, end) ranges of [begin, end] that are not cached and have to be fetched."""
+        meta = self._meta(self._directory(key))
+        gaps = subtract_ranges(to_ms(begin), to_ms(end), meta["coverage"] if meta else [])
+        return [(from_ms(gap_begin), from_ms(gap_end)) for gap_begin, gap_end in gaps]
+
+    def read(self, key, begin, end, partial=False):
+        """
+        The cached values between begin and end as a DataFrame (UTC
+        DatetimeIndex, value, quality-code; attrs as stored), or None unless
+        that whole range is cached (or, with partial, anything of key is).
+        """
+        directory = self._directory(key)
+        begin_ms, end_ms = to_ms(begin), to_ms(end)
+        for _ in range(3):
+            meta = self._meta(directory)
+            if meta is None or (not partial and subtract_ranges(begin_ms, end_ms, meta["coverage"])):
+                return None
+            try:
+                times, values, qualities = self._load(directory, meta)
+            except FileNotFoundError:
+                continue  # Replaced and deleted after meta.json was read; read the new one.
+            start = int(numpy.searchsorted(times, begin_ms, "left"))
+            stop = int(numpy.searchsorted(times, end_ms, "right"))
+            # Copy the rows out so the mapping is closed (on Windows a mapped file cannot be deleted).
+            frame = pandas.DataFrame({"value": numpy.array(values[start:stop]),
+                                      "quality-code": numpy.array(qualities[start:stop])},
+                                     index=pandas.DatetimeIndex(pandas.to_datetime(numpy.array(times[start:stop]),
+                                                                                   unit="ms", utc=True),
+                                                                name="date-time"))
+            del times, values, qualities
+            frame.attrs.update(meta.get("attrs") or {})
+            try:
+                os.utime(os.path.join(directory, "meta.json"))  # Last use, for eviction
+            except OSError:
+                pass
+            return frame
+        return None
+
+    def store(self, key, frame, begin, end, fetched_at=None):
+        """
+        Records that frame holds all values between begin and end: cached
+        values in that range are replaced by frame's, and the range is added
+        to the coverage, up to settle before fetched_at (default now).
+        frame needs a DatetimeIndex and a value column; quality-code is
+        optional.
+        """
+        directory = self._directory(key)
+        begin_ms, end_ms = to_ms(begin), to_ms(end)
+        fetched_at = utc_timestamp(fetched_at if fetched_at is not None else pandas.Timestamp.now(tz="UTC"))
+        covered_end = min(end_ms, to_ms(fetched_at - self.settle))
+        new_times = numpy.asarray(epoch_ms(frame.index), dtype="int64")
+        inside = (new_times >= begin_ms) & (new_times <= end_ms)
+        new_columns = [new_times[inside], frame["value"].to_numpy(dtype="float64", na_value=numpy.nan)[inside],
+                       (frame["quality-code"].fillna(0).to_numpy(dtype="int64") if "quality-code" in frame
+                        else numpy.zeros(len(frame), "int64"))[inside]]
+        os.makedirs(directory, exist_ok=True)
+        with FileLock(os.path.join(directory, "lock")):
+            meta = self._meta(directory, any_version=True)
+            if meta is None or meta.get("version") != FORMAT_VERSION:
+                # Files of an older format are retired like a replaced generation; its coverage is fetched again.
+                retired = list(meta.get("retired") or []) if meta else []
+                if meta and meta.get("generation"):
+                    retired.append([meta["generation"], time.time()])
+                meta = {"version": FORMAT_VERSION, "key": list(key), "generation": None, "count": 0,
+                        "coverage": [], "attrs": {}, "retired": retired}
+            old_columns = self._load(directory, meta)
+            keep = (old_columns[0] < begin_ms) | (old_columns[0] > end_ms)
+            columns = [numpy.concatenate([old[keep], new]) for old, new in zip(old_columns, new_columns)]
+            del old_columns
+            order = numpy.argsort(columns[0], kind="stable")
+            generation = uuid.uuid4().hex[:12]
+            for (column, dtype), values in zip(COLUMNS, columns):
+                numpy.save(os.path.join(directory, "{}.{}.npy".format(generation, column)),
+                           numpy.ascontiguousarray(values[order], dtype=dtype))
+
+            now = time.time()
+            retired = [entry for entry in meta["retired"] if not self._delete_generation(directory, entry, now)]
+            if meta["generation"]:
+                retired.append([meta["generation"], now])
+            coverage = meta["coverage"] + ([[begin_ms, covered_end]] if covered_end >= begin_ms else [])
+            attrs = dict(meta["attrs"])
+            attrs.update({name: value for name, value in frame.attrs.items() if isinstance(value, (str, int, float))})
+            meta.update({"generation": generation, "count": int(len(order)), "coverage": merge_ranges(coverage),
+                         "attrs": attrs, "retired": retired, "updated": now})
+            self._write_meta(directory, meta)
+
+    @staticmethod
+    def _delete_generation(directory, entry, now):
+        """Deletes a replaced generation once readers have had time to open it; True once it is gone."""
+        generation, retired_at = entry
+        if now - retired_at < RETIRE_GRACE_SECONDS:
+            return False
+        return all([_remove(os.path.join(directory, "{}.{}.npy".format(generation, column))) for column, _ in COLUMNS])
+
+    @staticmethod
+    def _write_meta(directory, meta):
+        path = os.path.join(directory, "meta.json")
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        for attempt in range(50):
+            try:
+                os.replace(temp_path, path)
+                return
+            except PermissionError:
+                # Windows: a reader has meta.json open for the moment it takes to read it.
+                if attempt == 49:
+                    raise
+                time.sleep(0.02)
+
+    def _series(self):
+        """(last used, bytes, directory, files) of every series in the cache."""
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for series in os.scandir(shard.path):
+                size = 0
+                last_used = 0
+                files = 0
+                try:
+                    for entry in os.scandir(series.path):
+                        stat = entry.stat()
+                        size += stat.st_size
+                        files += 1
+                        if entry.name == "meta.json":
+                            last_used = stat.st_mtime
+                except (FileNotFoundError, NotADirectoryError):
+                    continue  # Removed by another process meanwhile.
+                entries.append((last_used, size, series.path, files))
+        return entries
+
+    def _sweep(self, directory):
+        """Deletes the replaced generations of a series that are past their grace period (normally done by the next store)."""
+        lock = FileLock(os.path.join(directory, "lock"))
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            meta = self._meta(directory)
+            if meta is None:
+                return
+            now = time.time()
+            retired = [entry for entry in meta["retired"] if not self._delete_generation(directory, entry, now)]
+            if len(retired) != len(meta["retired"]):
+                meta["retired"] = retired
+                self._write_meta(directory, meta)
+        finally:
+            lock.release()
+
+    def _remove_series(self, directory):
+        """Deletes a series unless it is being written; files a reader still has mapped are left for the next eviction."""
+        lock = FileLock(os.path.join(directory, "lock"))
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            # meta.json first: from here on readers see a miss and never open the column files.
+            removed = _remove(os.path.join(directory, "meta.json"))
+            for entry in os.scandir(directory):
+                if entry.name != "lock":
+                    removed = _remove(entry.path) and removed
+        finally:
+            lock.release()
+        if removed:
+            _remove(os.path.join(directory, "lock"))
+            try:
+                os.rmdir(directory)
+                os.rmdir(os.path.dirname(directory))
+            except OSError:
+                pass  # The shard folder still holds other series.
+        return removed
+
+    def evict(self, max_bytes=None, force=True):
+        """
+        Removes the least recently read series while the cache is larger
+        than max_bytes (default max_mb), down to EVICT_TO of it, and deletes
+        replaced generations that are past their grace period; returns how
+        many series were removed. Does nothing if another process is
+        evicting, or (unless force) if the cache was checked less than
+        EVICT_INTERVAL_SECONDS ago.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        lock_path = os.path.join(self.root, "evict.lock")
+        try:
+            if not force and time.time() - os.path.getmtime(lock_path) < EVICT_INTERVAL_SECONDS:
+                return 0
+        except OSError:
+            pass  # Never checked yet.
+        lock = FileLock(lock_path)
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            os.utime(lock_path)
+            series = self._series()
+            for _, _, directory, files in series:
+                if files > len(COLUMNS) + 2:  # More than meta.json, the lock and one generation
+                    self._sweep(directory)
+            total = sum(size for _, size, _, _ in series)
+            if total <= max_bytes:
+                return 0
+            removed = 0
+            for _, size, directory, _ in sorted(series):
+                if total <= max_bytes * EVICT_TO:
+                    break
+                if self._remove_series(directory):
+                    total -= size
+                    removed += 1
+            return removed
+        finally:
+            lock.release()
+
+    def clear(self):
+        return sum(1 for _, _, directory, _ in self._series() if self._remove_series(directory))
+
+    def stats(self):
+        series = self._series()
+        return {"root": self.root, "series": len(series), "bytes": sum(size for _, size, _, _ in series),
+                "max_bytes": self.max_bytes}
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Show, trim or empty the pythonCWMS timeseries cache.")
+    parser.add_argument("command", choices=["stats", "evict", "clear"])
+    parser.add_argument("--root", default=default_cache_dir(), help="cache folder (default: %(default)s)")
+    parser.add_argument("--max-mb", type=float, help="size to evict down to (default: {} or {} MB)".format(
+        CACHE_MB_ENV, DEFAULT_MAX_MB))
+    args = parser.parse_args(argv)
+
+    cache = TimeseriesCache(args.root, args.max_mb)
+    if args.command == "evict":
+        print("Removed {} series".format(cache.evict()))
+    elif args.command == "clear":
+        print("Removed {} series".format(cache.clear()))
+    stats = cache.stats()
+    print("{} series, {:.1f} of {:.0f} MB in {}".format(stats["series"], stats["bytes"] / 1048576.0,
+                                                       stats["max_bytes"] / 1048576.0, stats["root"]))
+    return 0
+
@@ -0,0 +1,208 @@
+"""
+Bulk timeseries retrieval from and storage to the CWMS Data API (CDA).
+
+    import pythoncwms
+
+    frames = pythoncwms.fetch_timeseries(ts_ids, "SWT", begin, end)
+    for name, error in frames.errors.items():
+        print("Could not fetch {}: {}".format(name, error))
+    flows = frames.to_wide()
+
+All the timeseries are requested at once over a pooled connection, at most
+per_host at a time, and every page of a long series is followed. The API
+root and key default to the CDA_API_ROOT and CDA_API_KEY environment
+variables (the key is only needed to store). With cache=True, only what the
+local timeseries cache (see cache.py) does not hold yet is requested.
+"""
+import asyncio
+import math
+import os
+
+import pandas
+
+from .cache import TimeseriesCache
+from .client import DEFAULT_CONNECTIONS, DEFAULT_PER_HOST, gather, run
+from .frames import BulkResult, epoch_ms, iso_utc
+
+DEFAULT_API_ROOT = "https://cwms-data.usace.army.mil/cwms-data/"
+TIMESERIES_FORMAT = "application/json;version=2"
+PAGE_SIZE = 100000
+STORE_CHUNK_SIZE = 50000
+
+
+def api_root(root=None):
+    root = root or os.environ.get("CDA_API_ROOT") or DEFAULT_API_ROOT
+    return root if root.endswith("/") else root + "/"
+
+
+def api_headers(api_key=None):
+    headers = {"Accept": TIMESERIES_FORMAT}
+    api_key = api_key or os.environ.get("CDA_API_KEY")
+    if api_key:
+        headers["Authorization"] = api_key if api_key.lower().startswith("apikey ") else "apikey " + api_key
+    return headers
+
+
+def timeseries_frame(pages, name, office):
+    """
+    One DataFrame from the pages of a CDA timeseries response: a UTC
+    DatetimeIndex and one column per value column after the time (value,
+    quality-code), with name, office and units in attrs.
+    """
+    first = pages[0]
+    columns = [column["name"] for column in sorted(first.get("value-columns") or [], key=lambda c: c["ordinal"])]
+    columns = columns or ["date-time", "value", "quality-code"]
+    rows = [row for page in pages for row in page.get("values") or []]
+    frame = pandas.DataFrame(rows, columns=columns)
+    frame.index = pandas.DatetimeIndex(pandas.to_datetime(frame.pop(columns[0]), unit="ms", utc=True), name="date-time")
+    frame["value"] = frame["value"].astype("float64")
+    frame.attrs.update({"name": first.get("name", name), "office": first.get("office-id", office),
+                        "units": first.get("units")})
+    return frame
+
+
+async def fetch_one(client, root, name, office, begin, end, unit=None, page_size=PAGE_SIZE, headers=None):
+    params = {"name": name, "office": office, "begin": iso_utc(begin), "end": iso_utc(end), "page-size": page_size}
+    if unit:
+        params["unit"] = unit
+    pages = []
+    while True:
+        page = await client.get_json(root + "timeseries", params=params, headers=headers)
+        pages.append(page)
+        cursor = page.get("next-page")
+        if not cursor or not page.get("values"):
+            return timeseries_frame(pages, name, office)
+        params = dict(params, page=cursor)
+
+
+async def fetch_cached(client, cache, root, name, office, begin, end, unit=None, page_size=PAGE_SIZE, headers=None,
+                       counters=None):
+    """fetch_one through cache: fetches only the parts of the window it does not hold, stores them and reads the window."""
+    key = ("cda", root, office.upper(), name, unit or "")
+    gaps = await asyncio.to_thread(cache.missing, key, begin, end)
+    for gap_begin, gap_end in gaps:
+        fetched_at = pandas.Timestamp.now(tz="UTC")
+        frame = await fetch_one(client, root, name, office, gap_begin, gap_end, unit, page_size, headers)
+        await asyncio.to_thread(cache.store, key, frame, gap_begin, gap_end, fetched_at)
+    if counters is not None and gaps:
+        counters["cache_gaps"] += len(gaps)
+    elif counters is not None:
+        counters["cache_hits"] += 1
+    # partial: the recent end of the window was just fetched, but is not counted as covered (see settle).
+    frame = await asyncio.to_thread(cache.read, key, begin, end, True)
+    if frame is None:
+        # Evicted by another process since it was stored; fetch the window without the cache.
+        return await fetch_one(client, root, name, office, begin, end, unit, page_size, headers)
+    return frame
+
+
+async def _gather_by_name(names, work, **client_options):
+    """Runs work(client, name) for every name; returns a BulkResult of the results in the order of names."""
+    result = BulkResult()
+
+    async def one(client, name):
+        try:
+            result[name] = await work(client, name)
+        except Exception as e:
+            result.errors[name] = e
+
+    result.stats = await gather(names, one, **client_options)
+    # Keep the order the names were given in, whichever finished first.
+    ordered = [(name, result[name]) for name in names if name in result]
+    result.clear()
+    result.update(ordered)
+    return result
+
+
+async def fetch_timeseries_async(names, office, begin, end, unit=None, page_size=PAGE_SIZE, root=None, api_key=None,
+                                 client=None, connections=DEFAULT_CONNECTIONS, per_host=DEFAULT_PER_HOST, retry=None,
+                                 cache=None):
+    """
+    Fetches the timeseries names (timeseries ids) of office between begin
+    and end (datetimes or ISO 8601 strings, naive ones are UTC) and returns a
+    BulkResult of DataFrames (see timeseries_frame). unit is a unit system
+    (EN or SI) or a unit for all of them. Pass a BulkClient as client to
+    share its connections with other calls. cache is True for the default
+    TimeseriesCache, or a TimeseriesCache; stats then also counts the
+    series served from the cache alone (cache_hits) and the gaps fetched
+    (cache_gaps).
+    """
+    root = api_root(root)
+    headers = api_headers(api_key)
+    names = list(dict.fromkeys(names))
+    if cache is True:
+        cache = TimeseriesCache()
+    counters = {"cache_hits": 0, "cache_gaps": 0}
+
+    def work(client, name):
+        if cache:
+            return fetch_cached(client, cache, root, name, office, begin, end, unit, page_size, headers, counters)
+        return fetch_one(client, root, name, office, begin, end, unit, page_size, headers)
+
+    result = await _gather_by_name(names, work, client=client, connections=connections, per_host=per_host, retry=retry)
+    if cache:
+        result.stats.update(counters)
+        await asyncio.to_thread(cache.evict, force=False)
+    return result
+
+
+def fetch_timeseries(names, office, begin, end, **options):
+    """fetch_timeseries_async for plain scripts; see there for the options."""
+    return run(fetch_timeseries_async(names, office, begin, end, **options))
+
+
+def store_payloads(frame, name, office, units, chunk_size=STORE_CHUNK_SIZE):
+    """The CDA timeseries documents for a DataFrame with a DatetimeIndex, a value and (optionally) a quality-code column."""
+    frame = frame.sort_index()
+    times = epoch_ms(frame.index)
+    values = [None if value is None or math.isnan(value) else value for value in frame["value"].astype("float64").tolist()]
+    if "quality-code" in frame:
+        qualities = frame["quality-code"].fillna(0).astype("int64").tolist()
+    else:
+        qualities = [0] * len(values)
+    for start in range(0, len(times), chunk_size):
+        stop = start + chunk_size
+        yield {"name": name, "office-id": office, "units": units,
+               "values": [list(row) for row in zip(times[start:stop], values[start:stop], qualities[start:stop])]}
+
+
+async def store_one(client, root, frame, name, office, units, store_rule, override_protection, headers):
+    params = {"store-rule": store_rule, "override-protection": "true" if override_protection else "false"}
+    stored = 0
+    for payload in store_payloads(frame, name, office, units):
+        await client.post_json(root + "timeseries", payload, params=params,
+                               headers=dict(headers, **{"Content-Type": TIMESERIES_FORMAT}))
+        stored += len(payload["values"])
+    return stored
+
+
+async def store_timeseries_async(frames, office, units=None, store_rule="REPLACE_ALL", override_protection=False,
+                                 root=None, api_key=None, client=None, connections=DEFAULT_CONNECTIONS,
+                                 per_host=DEFAULT_PER_HOST, retry=None):
+    """
+    Stores every DataFrame of frames (name -> DataFrame, e.g. a BulkResult)
+    and returns a BulkResult of name -> number of values stored. units is a
+    unit for all of them or a name -> unit mapping; by default each frame's
+    attrs["units"]. Long series are sent in chunks of STORE_CHUNK_SIZE.
+    """
+    root = api_root(root)
+    headers = api_headers(api_key)
+    if "Authorization" not in headers:
+        raise ValueError("Storing needs an API key: pass api_key or set CDA_API_KEY")
+
+    def unit_of(name):
+        if isinstance(units, dict):
+            return units.get(name) or frames[name].attrs.get("units")
+        return units or frames[name].attrs.get("units")
+
+    def work(client, name):
+        return store_one(client, root, frames[name], name, office, unit_of(name), store_rule, override_protection,
+                         headers)
+
+    return await _gather_by_name(list(frames), work, client=client, connections=connections, per_host=per_host,
+                                 retry=retry)
+
+
+def store_timeseries(frames, office, **options):
+    """store_timeseries_async for plain scripts; see there for the options."""
+    return run(store_timeseries_async(frames, office, **options))
@@ -0,0 +1,182 @@
+"""
+A pooled asyncio HTTP client for pulling many small responses from a few
+hosts: one aiohttp session whose connections are reused between requests,
+a cap on requests in flight per host (and in total), and retries with
+exponential backoff for throttled, failing or dropped requests.
+"""
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+DEFAULT_CONNECTIONS = 32
+DEFAULT_PER_HOST = 8
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class RequestError(Exception):
+    """A request that failed for good: a non-retryable status, or the last attempt failed."""
+
+    def __init__(self, method, url, status=None, message=""):
+        Exception.__init__(self, "{} {} failed{}: {}".format(
+            method, url, " with HTTP {}".format(status) if status else "", message))
+        self.method = method
+        self.url = url
+        self.status = status
+
+
+class RetryPolicy(object):
+    """
+    How often and how long to wait before a request is tried again. Delays
+    grow as backoff * 2**attempt, capped at max_backoff, with full jitter so
+    that many requests failing together do not come back together. A
+    Retry-After header from the server takes precedence (up to max_backoff).
+    """
+
+    def __init__(self, attempts=5, backoff=0.5, max_backoff=30.0, statuses=RETRY_STATUSES):
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def _retry_after(response):
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return None  # Missing, or an HTTP date: use the normal backoff.
+
+
+class BulkClient(object):
+    """
+    Use it as an async context manager, and run requests concurrently with
+    asyncio.gather; each host gets at most per_host requests at a time
+    (host_limits overrides that for single hosts, e.g. a slow office
+    server), so a large batch queues in the client instead of overloading
+    the server:
+
+        async with BulkClient(per_host=8) as client:
+            pages = await asyncio.gather(*[client.get_json(url, params=p) for p in params])
+
+    stats counts requests (every attempt), retries, failures, received
+    bytes and the time requests spent waiting for a free slot.
+    """
+
+    def __init__(self, connections=DEFAULT_CONNECTIONS, per_host=DEFAULT_PER_HOST, host_limits=None, retry=None,
+                 timeout=120, headers=None):
+        self.connections = connections
+        self.per_host = per_host
+        self.host_limits = dict(host_limits or {})
+        self.retry = retry or RetryPolicy()
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "bytes": 0, "queued_seconds": 0.0}
+        self._session = None
+        self._hosts = {}
+
+    async def __aenter__(self):
+        # The per-host caps are the client's own semaphores, so the connector only bounds the total.
+        connector = aiohttp.TCPConnector(limit=self.connections, limit_per_host=0, ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(
+            connector=connector, headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=self.timeout))
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _slot(self, host):
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.host_limits.get(host, self.per_host))
+        return semaphore
+
+    async def request(self, method, url, params=None, json_body=None, headers=None, parse_json=True):
+        """
+        Sends the request, retrying it as the RetryPolicy allows; returns the
+        decoded JSON (or the text, or None for an empty body). Raises
+        RequestError once it gives up.
+        """
+        if self._session is None:
+            raise RuntimeError("BulkClient must be used with 'async with'")
+        slot = self._slot(urlsplit(url).hostname)
+        attempts = self.retry.attempts
+        for attempt in range(attempts):
+            retry_after = None
+            queued = time.monotonic()
+            async with slot:
+                self.stats["queued_seconds"] += time.monotonic() - queued
+                self.stats["requests"] += 1
+                try:
+                    async with self._session.request(method, url, params=params, json=json_body,
+                                                     headers=headers) as response:
+                        body = await response.read()
+                        self.stats["bytes"] += len(body)
+                        if response.status < 400:
+                            if not body.strip():
+                                return None
+                            text = body.decode(response.charset or "utf-8", "replace")
+                            return json.loads(text) if parse_json else text
+                        failure = RequestError(method, str(response.url), response.status,
+                                               body[:200].decode("utf-8", "replace").strip())
+                        if response.status not in self.retry.statuses:
+                            self.stats["failures"] += 1
+                            raise failure
+                        retry_after = _retry_after(response)
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                    failure = RequestError(method, url, message=str(e) or type(e).__name__)
+            # Back off outside the slot, so a waiting retry does not hold up other requests.
+            if attempt + 1 < attempts:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self.retry.delay(attempt, retry_after))
+        self.stats["failures"] += 1
+        raise failure
+
+    async def get_json(self, url, params=None, headers=None):
+        return await self.request("GET", url, params=params, headers=headers)
+
+    async def post_json(self, url, body, params=None, headers=None):
+        return await self.request("POST", url, params=params, json_body=body, headers=headers, parse_json=False)
+
+
+async def gather(items, work, client=None, **client_options):
+    """
+    Runs work(client, item) for every item at once on one BulkClient (a new
+    one made from client_options, unless client is given); the client's
+    limits decide how many are actually in flight. Returns the client's
+    stats plus the elapsed seconds.
+    """
+    started = time.monotonic()
+    if client is None:
+        async with BulkClient(**client_options) as client:
+            await asyncio.gather(*[work(client, item) for item in items])
+    else:
+        await asyncio.gather(*[work(client, item) for item in items])
+    return dict(client.stats, seconds=time.monotonic() - started)
+
+
+def run(coroutine):
+    """
+    Runs a coroutine from plain (synchronous) script code. Inside a running
+    event loop, e.g. a Jupyter notebook, await the _async function instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    coroutine.close()
+    raise RuntimeError("An event loop is already running here; await the _async version of this function instead")
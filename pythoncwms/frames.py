@@ -0,0 +1,73 @@
+"""
+Results of bulk requests, and the pandas/xarray views of them.
+"""
+import datetime
+
+import pandas
+
+
+class BulkResult(dict):
+    """
+    name -> result (a DataFrame for fetches, the number of values stored for
+    stores) of every item that succeeded. The items that failed are in
+    errors (name -> exception) instead, so one bad timeseries does not cost
+    the whole batch; call raise_errors() if any failure should stop the
+    script. stats holds the client's request counters and the elapsed time.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.errors = {}
+        self.stats = {}
+
+    def raise_errors(self):
+        if self.errors:
+            name, error = next(iter(self.errors.items()))
+            raise RuntimeError("{} of {} items failed, first {}: {}".format(
+                len(self.errors), len(self.errors) + len(self), name, error)) from error
+
+    def to_wide(self, column="value"):
+        """One column per timeseries on the union of their times (NaN where a series has no value)."""
+        if not self:
+            return pandas.DataFrame()
+        table = pandas.concat({name: frame[column] for name, frame in self.items()}, axis=1).sort_index()
+        table.columns.name = "name"
+        return table
+
+    def to_xarray(self, column="value"):
+        """
+        A (time, name) xarray DataArray of to_wide(column), with each series'
+        units as a coordinate. Times are UTC without a time zone, since
+        xarray does not keep one.
+        """
+        import xarray
+
+        table = self.to_wide(column)
+        if isinstance(table.index, pandas.DatetimeIndex) and table.index.tz is not None:
+            table.index = table.index.tz_convert("UTC").tz_localize(None)
+        table.index.name = "time"
+        array = xarray.DataArray(table, dims=("time", "name"), name=column, attrs={"time_zone": "UTC"})
+        return array.assign_coords(units=("name", [self[name].attrs.get("units") for name in table.columns]))
+
+
+def utc_timestamp(value):
+    """A datetime, pandas Timestamp or ISO 8601 string as an aware UTC Timestamp; naive values are taken as UTC."""
+    timestamp = pandas.Timestamp(value)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC")
+
+
+def iso_utc(value):
+    timestamp = utc_timestamp(value)
+    if timestamp.microsecond:
+        return timestamp.strftime("%Y-%m-%dT%H:%M:%S.") + "{:03d}Z".format(timestamp.microsecond // 1000)
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def epoch_ms(index):
+    """Milliseconds since 1970 of every time in a DatetimeIndex (naive times are taken as UTC)."""
+    index = pandas.DatetimeIndex(index)
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+    return ((index - pandas.Timestamp(0, tz="UTC")) // datetime.timedelta(milliseconds=1)).tolist()
@@ -0,0 +1,90 @@
+"""
+Bulk retrieval of USGS instantaneous values (the NWIS IV service that
+dataretrieval.nwis.get_iv also uses), many sites per request:
+
+    frames = pythoncwms.fetch_usgs_iv(site_numbers, ["00060", "00065"], period="P7D")
+    frames["USGS:07164500:00060:00000"]
+
+Results are keyed by the NWIS timeseries name (agency:site:parameter:statistic),
+with a ":<method id>" suffix where a site reports one parameter with several
+methods (e.g. two sensors).
+"""
+import pandas
+
+from .client import RequestError, DEFAULT_CONNECTIONS, gather, run
+from .frames import BulkResult, iso_utc
+
+IV_URL = "https://waterservices.usgs.gov/nwis/iv/"
+# NWIS accepts up to 100 sites per request
+SITES_PER_REQUEST = 100
+# USGS asks for moderate concurrency from automated clients
+DEFAULT_PER_HOST = 4
+
+
+def iv_frames(document):
+    """name -> DataFrame (UTC DatetimeIndex, value, qualifiers) of every series in a WaterML JSON document."""
+    frames = {}
+    for series in (document or {}).get("value", {}).get("timeSeries", []):
+        variable = series["variable"]
+        no_data = variable.get("noDataValue")
+        blocks = [block for block in series.get("values", []) if block.get("value")]
+        for block in blocks:
+            name = series["name"]
+            if len(blocks) > 1:
+                name += ":{}".format(block["method"][0]["methodID"])
+            points = block["value"]
+            values = pandas.to_numeric(pandas.Series([point["value"] for point in points]), errors="coerce")
+            if no_data is not None:
+                values = values.mask(values == no_data)
+            frame = pandas.DataFrame({"value": values.to_numpy(dtype="float64"),
+                                      "qualifiers": [",".join(point.get("qualifiers") or []) for point in points]})
+            frame.index = pandas.DatetimeIndex(pandas.to_datetime([point["dateTime"] for point in points], utc=True),
+                                               name="date-time")
+            frame.attrs.update({"name": name, "site": series["sourceInfo"]["siteCode"][0]["value"],
+                                "site_name": series["sourceInfo"].get("siteName"),
+                                "parameter": variable["variableCode"][0]["value"],
+                                "units": variable.get("unit", {}).get("unitCode")})
+            frames[name] = frame
+    return frames
+
+
+async def fetch_usgs_iv_async(sites, parameters=None, begin=None, end=None, period=None, url=IV_URL, client=None,
+                              connections=DEFAULT_CONNECTIONS, per_host=DEFAULT_PER_HOST, retry=None):
+    """
+    Fetches the instantaneous values of parameters (parameter codes, None =
+    all) at sites, between begin and end or for the last period (an ISO
+    8601 duration such as "P7D"; NWIS returns only the latest value if
+    neither is given). Sites are requested SITES_PER_REQUEST at a time; a
+    batch that fails puts each of its sites in the result's errors.
+    """
+    sites = list(dict.fromkeys(str(site) for site in sites))
+    params = {"format": "json"}
+    if parameters:
+        params["parameterCd"] = ",".join([parameters] if isinstance(parameters, str) else parameters)
+    if period:
+        params["period"] = period
+    if begin is not None:
+        params["startDT"] = iso_utc(begin)
+    if end is not None:
+        params["endDT"] = iso_utc(end)
+    batches = [sites[start:start + SITES_PER_REQUEST] for start in range(0, len(sites), SITES_PER_REQUEST)]
+    result = BulkResult()
+
+    async def one(client, batch):
+        try:
+            document = await client.get_json(url, params=dict(params, sites=",".join(batch)))
+        except RequestError as e:
+            if e.status == 404:
+                return  # NWIS answers 404 when none of the sites has data for the request.
+            for site in batch:
+                result.errors[site] = e
+            return
+        result.update(iv_frames(document))
+
+    result.stats = await gather(batches, one, client=client, connections=connections, per_host=per_host, retry=retry)
+    return result
+
+
+def fetch_usgs_iv(sites, parameters=None, **options):
+    """fetch_usgs_iv_async for plain scripts; see there for the options."""
+    return run(fetch_usgs_iv_async(sites, parameters, **options))